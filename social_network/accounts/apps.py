@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class AccountsConfig(AppConfig):
@@ -7,3 +8,7 @@ class AccountsConfig(AppConfig):
 
     def ready(self):
         from accounts import signals
+
+        if settings.HOLIDAY_RESOLVER == 'local':
+            from accounts import holidays
+            holidays.load_index()
@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import (
+    AuthenticationFailed,
+    InvalidToken,
+)
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import User
+
+
+# access tokens carry a snapshot of the fields the permissions look at, so
+# authenticating doesn't load the user. the snapshot is as fresh as the token,
+# it's taken again whenever an access token is issued or refreshed
+
+SNAPSHOT_CLAIM = 'usr'
+SNAPSHOT_FIELDS = ['username', 'is_active', 'is_staff', 'is_superuser']
+
+
+def add_snapshot(token, user):
+    token[SNAPSHOT_CLAIM] = [getattr(user, field) for field in SNAPSHOT_FIELDS]
+    return token
+
+
+def from_snapshot(user_id, snapshot):
+    # the other fields are deferred, they are loaded if something reads them.
+    # from_db wants the values in the order of the model's fields
+    values = dict(zip(SNAPSHOT_FIELDS, snapshot), id=user_id)
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+    return User.from_db(None, names, [values[name] for name in names])
+
+
+def get_cache():
+    return caches[settings.AUTH_USER_CACHE_ALIAS]
+
+
+def user_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def get_user(user_id):
+    cache = get_cache()
+    user = cache.get(user_key(user_id))
+    if user is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+        cache.set(user_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+
+def forget_user(user_id):
+    get_cache().delete(user_key(user_id))
+
+
+class SnapshotJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        snapshot = validated_token.get(SNAPSHOT_CLAIM)
+        if snapshot is not None and len(snapshot) == len(SNAPSHOT_FIELDS):
+            user = from_snapshot(user_id, snapshot)
+        else:
+            # tokens issued before the snapshot was added
+            user = get_user(user_id)
+            if user is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class SnapshotTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # the access token copies the claims of its refresh token
+        return add_snapshot(super().get_token(user), user)
+
+
+class SnapshotTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = get_user(access[api_settings.USER_ID_CLAIM])
+        if user is None or not user.is_active:
+            raise InvalidToken(_('Token is no longer valid'))
+        data['access'] = str(add_snapshot(access, user))
+        return data
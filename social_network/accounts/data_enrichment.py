@@ -1,10 +1,24 @@
+import asyncio
 from datetime import datetime as dt
 from datetime import timedelta
 import logging
 import os
-from time import sleep
+import threading
+from time import perf_counter
+import weakref
 
-import requests
+import aiohttp
+from django.conf import settings
+
+from accounts import (
+    email_validation,
+    enrichment_cache,
+    geoip,
+    holidays,
+    resilience,
+)
+from accounts.enrichment_cache import cached
+from social_network import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -13,60 +27,229 @@ EMAIL_API_KEY = os.environ.get('EMAIL_API_KEY')
 GEO_API_KEY = os.environ.get('GEO_API_KEY')
 HOLIDAY_API_KEY = os.environ.get('HOLIDAY_API_KEY')
 
-RETRIES = 5
+EMAIL_URL = 'https://emailvalidation.abstractapi.com/v1/'
+GEO_URL = 'https://ipgeolocation.abstractapi.com/v1/'
+HOLIDAY_URL = 'https://holidays.abstractapi.com/v1/'
 
+# seconds per call
+EMAIL_TIMEOUT = 5
+GEO_TIMEOUT = 5
+HOLIDAY_TIMEOUT = 5
 
-def is_valid_email(email):
-    url = 'https://emailvalidation.abstractapi.com/v1/'
-    params = {'api_key': EMAIL_API_KEY, 'email': email}
-    response = requests.get(url, params=params)
-
-    for _ in range(RETRIES):
-        if response.status_code >= 500:
-            sleep(1)
-            response = requests.get(url, params=params)
-        else:
-            break
-    else:
-        # assuming the "safe" option
-        return False
-
-    if response.status_code >= 400:
-        logger.exception(f'There is a problem with the request on our side- '
-                         f'status code: {response.status_code}'
-                         f'response json: {response.json()}')
-        return False
-
-    response_dict = response.json()
-    return response_dict['is_valid_format']['value']
+POOL_SIZE = 100
 
 
-def enrich_geo(user):
-    print('hello')
-    url = 'https://ipgeolocation.abstractapi.com/v1/'
-    params = {'api_key': GEO_API_KEY, 'ip_address': user.ip}
-    res = requests.get(url, params=params)
-
-    for _ in range(5):
-        if res.status_code >= 500:
-            sleep(1)
-            continue
-        geo_data = res.json()
-        user.city = geo_data['city']
-        user.region = geo_data['region']
-        user.country = geo_data['country_code']
+class EnrichmentError(Exception):
+    pass
+
+
+class EnrichmentClient:
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self._session = None
+
+    def session(self):
+        # created lazily since the session has to be bound to the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def _request(self, url, params, timeout):
+        try:
+            async with self.session().get(url, params=params,
+                                          timeout=aiohttp.ClientTimeout(total=timeout)) as res:
+                # the server errors of a proxy in front are HTML, they're
+                # retried without reading them
+                if res.status >= 500:
+                    return res.status, None
+                return res.status, await res.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise EnrichmentError(f'request to {url} failed: {e!r}') from e
+
+    async def _get(self, provider, url, params, timeout):
+        # server errors and timeouts are retried with backoff until the
+        # provider's breaker opens or the deadline of the caller runs out
+        breaker = resilience.get_breaker(provider)
+        for attempt in range(settings.ENRICHMENT_RETRIES):
+            if not breaker.allow():
+                raise EnrichmentError(f'the {provider} provider circuit is open')
+            budget = resilience.remaining()
+            if budget is not None and budget <= 0:
+                raise EnrichmentError(f'out of time calling the {provider} provider')
+
+            start = perf_counter()
+            try:
+                status_code, data = await self._request(
+                    url, params, timeout if budget is None else min(timeout, budget))
+            except EnrichmentError:
+                metrics.observe_outbound(provider, perf_counter() - start, 'error')
+                logger.warning(f'request to the {provider} provider failed', exc_info=True)
+            else:
+                metrics.observe_outbound(provider, perf_counter() - start,
+                                         'ok' if status_code < 500 else 'error')
+                if status_code < 500:
+                    breaker.record_success()
+                    return status_code, data
+                logger.warning(f'the {provider} provider answered {status_code}')
+            breaker.record_failure()
+
+            delay = resilience.backoff(attempt)
+            budget = resilience.remaining()
+            if budget is not None and delay >= budget:
+                break
+            if attempt + 1 < settings.ENRICHMENT_RETRIES:
+                await asyncio.sleep(delay)
+
+        raise EnrichmentError(f'the {provider} provider is unavailable')
+
+    async def is_valid_email(self, email):
+        verdict = email_validation.local_verdict(email)
+        if verdict is not None:
+            return verdict
+        return await self.remote_is_valid_email(email)
+
+    async def remote_is_valid_email(self, email):
+        with resilience.deadline(settings.ENRICHMENT_DEADLINE):
+            try:
+                valid = await self.email_verdict(email.strip().lower())
+            except EnrichmentError:
+                logger.exception('email validation failed')
+                # assuming the "safe" option
+                return False
+        if valid:
+            email_validation.remember_domain(email)
+        return valid
+
+    @cached('email')
+    async def email_verdict(self, email):
+        params = {'api_key': EMAIL_API_KEY, 'email': email}
+        status_code, response_dict = await self._get('email', EMAIL_URL, params, EMAIL_TIMEOUT)
+
+        if status_code >= 400:
+            raise EnrichmentError(f'There is a problem with the request on our side- '
+                                  f'status code: {status_code}'
+                                  f'response json: {response_dict}')
+
+        return response_dict['is_valid_format']['value']
+
+    async def lookup_geo(self, ip):
+        if settings.GEO_RESOLVER == 'local':
+            return geoip.get_database().lookup(ip) or {
+                'city': None, 'region': None, 'country': None, 'gmt_offset': 0,
+            }
+        return await self.remote_geo(ip)
+
+    @cached('geo')
+    async def remote_geo(self, ip):
+        params = {'api_key': GEO_API_KEY, 'ip_address': ip}
+        status_code, geo_data = await self._get('geo', GEO_URL, params, GEO_TIMEOUT)
+
+        if status_code >= 400:
+            raise EnrichmentError(f'geo lookup failed with status code: {status_code}')
+
         # if we on localhost it doesn't really matter
-        if user.ip == '127.0.0.1':
+        if ip == '127.0.0.1':
             geo_data['timezone'] = {'gmt_offset': 0}
-        user.signup_at_holiday = is_holiday(user, geo_data['timezone']['gmt_offset'])
-        user.save()
+        return {
+            'city': geo_data['city'],
+            'region': geo_data['region'],
+            'country': geo_data['country_code'],
+            'gmt_offset': geo_data['timezone']['gmt_offset'],
+        }
+
+    async def is_holiday(self, country, gmt_offset):
+        user_date = (dt.now() + timedelta(hours=gmt_offset)).date()
+        if settings.HOLIDAY_RESOLVER == 'local':
+            return holidays.get_index().is_holiday(country, user_date)
+        return await self.holiday_on(country, user_date)
+
+    @cached('holiday')
+    async def holiday_on(self, country, date):
+        params = {'country': country, 'year': date.year, 'month': date.month,
+                  'day': date.day, 'api_key': HOLIDAY_API_KEY}
+        status_code, holidays = await self._get('holiday', HOLIDAY_URL, params, HOLIDAY_TIMEOUT)
+
+        if status_code >= 400:
+            raise EnrichmentError(f'holiday lookup failed with status code: {status_code}')
+        return bool(holidays)
+
+    async def enrich(self, ip):
+        with resilience.deadline(settings.ENRICHMENT_DEADLINE):
+            return await self._enrich(ip)
+
+    async def _enrich(self, ip):
+        geo = dict(await self.lookup_geo(ip))
+        geo['signup_at_holiday'] = None
+        if geo['country']:
+            geo['signup_at_holiday'] = await self.is_holiday(geo['country'], geo['gmt_offset'])
+        return geo
+
+    async def enrich_signup(self, email, ip):
+        # the email check doesn't depend on the geo -> holiday chain
+        with resilience.deadline(settings.ENRICHMENT_DEADLINE):
+            return await asyncio.gather(self.is_valid_email(email), self.enrich(ip))
+
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        _clients[loop] = EnrichmentClient()
+    return _clients[loop]
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _run(coro_func, *args):
+    # the sync wrappers share one long lived loop, so its client keeps
+    # its pooled connections between calls
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='data-enrichment',
+                             daemon=True).start()
+
+    async def call():
+        return await coro_func(get_client(), *args)
+    return asyncio.run_coroutine_threadsafe(call(), _loop).result()
+
+
+def is_valid_email(email):
+    # most addresses are judged locally, without hopping to the loop
+    verdict = email_validation.local_verdict(email)
+    if verdict is not None:
+        return verdict
+    return _run(EnrichmentClient.remote_is_valid_email, email)
+
+
+def enrich_geo(user):
+    # fills in the geo fields without saving, retries are left to the job
+    # queue so a failing provider doesn't hold a worker
+    geo = _run(EnrichmentClient.enrich, user.ip)
+    user.city = geo['city']
+    user.region = geo['region']
+    user.country = geo['country']
+    user.signup_at_holiday = geo['signup_at_holiday']
+    return user
 
 
 def is_holiday(user, gmt_offset):
-    url = 'https://holidays.abstractapi.com/v1/'
-    now = dt.now()
-    user_date = now + timedelta(hours=gmt_offset)
-    params = {'country': user.country, 'year': user_date.year, 'month': user_date.month,
-              'day': user_date.day, 'api_key': HOLIDAY_API_KEY}
-    res = requests.get(url, params=params)
-    return bool(res.json())
+    return _run(EnrichmentClient.is_holiday, user.country, gmt_offset)
+
+
+def cache_stats():
+    return enrichment_cache.stats.as_dict()
+
+
+def breaker_states():
+    return resilience.breaker_states()
@@ -0,0 +1,124 @@
+import functools
+import re
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from accounts import enrichment_cache
+
+
+VALID = 'valid'
+INVALID = 'invalid'
+
+# RFC 5322 dot-atom local part and RFC 1035 host names, the quoted local
+# parts and address literals the RFC allows are not accepted on signup
+ATEXT = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+LOCAL_PART_RE = re.compile(rf'^{ATEXT}(\.{ATEXT})*$')
+LABEL_RE = re.compile(r'^(?!-)[A-Za-z0-9-]{1,63}(?<!-)$')
+TLD_RE = re.compile(r'^([A-Za-z]{2,63}|xn--[A-Za-z0-9-]{1,59})$')
+
+DISPOSABLE_DOMAINS = frozenset([
+    '10minutemail.com',
+    'discard.email',
+    'dispostable.com',
+    'getnada.com',
+    'guerrillamail.com',
+    'mailinator.com',
+    'maildrop.cc',
+    'sharklasers.com',
+    'temp-mail.org',
+    'throwawaymail.com',
+    'trashmail.com',
+    'yopmail.com',
+])
+
+
+def split_address(email):
+    local_part, at, domain = email.strip().rpartition('@')
+    if not at:
+        return None, None
+    try:
+        domain = domain.encode('idna').decode('ascii').lower()
+    except UnicodeError:
+        return None, None
+    return local_part, domain
+
+
+def is_valid_syntax(email):
+    local_part, domain = split_address(email)
+    if not local_part or not domain:
+        return False
+    if len(local_part) > 64 or len(local_part) + len(domain) + 1 > 254:
+        return False
+    if not LOCAL_PART_RE.match(local_part):
+        return False
+
+    labels = domain.split('.')
+    return (len(labels) > 1 and all(LABEL_RE.match(label) for label in labels)
+            and bool(TLD_RE.match(labels[-1])))
+
+
+@functools.lru_cache(maxsize=None)
+def disposable_domains():
+    domains = set(DISPOSABLE_DOMAINS)
+    if settings.EMAIL_DISPOSABLE_DOMAINS_FILE:
+        with open(settings.EMAIL_DISPOSABLE_DOMAINS_FILE) as f:
+            domains.update(line.strip().lower() for line in f
+                           if line.strip() and not line.startswith('#'))
+    return frozenset(domains)
+
+
+class StaticMXResolver:
+    # stands in for DNS with a file of "domain mx-host [mx-host...]" lines,
+    # a domain listed without hosts has no MX records
+    def __init__(self, path=None):
+        self.records = {}
+        with open(path or settings.EMAIL_MX_RECORDS) as f:
+            for line in f:
+                if line.strip() and not line.startswith('#'):
+                    domain, *hosts = line.split()
+                    self.records[domain.lower()] = hosts
+
+    def __call__(self, domain):
+        if domain not in self.records:
+            return None
+        return bool(self.records[domain])
+
+
+@functools.lru_cache(maxsize=None)
+def mx_resolver():
+    if not settings.EMAIL_MX_RESOLVER:
+        return None
+    return import_string(settings.EMAIL_MX_RESOLVER)()
+
+
+def domain_verdict(domain):
+    if domain in disposable_domains():
+        return INVALID
+
+    verdict = enrichment_cache.lookup('email_domain', domain)
+    if verdict is not enrichment_cache.MISSING:
+        return verdict
+
+    resolver = mx_resolver()
+    has_mx = resolver(domain) if resolver else None
+    if has_mx is None:
+        return None
+    verdict = VALID if has_mx else INVALID
+    enrichment_cache.store('email_domain', verdict, domain)
+    return verdict
+
+
+def local_verdict(email):
+    # True or False when the address can be judged locally, None when only
+    # the remote validation can tell
+    if not is_valid_syntax(email):
+        return False
+    verdict = domain_verdict(split_address(email)[1])
+    if verdict is None:
+        return None
+    return verdict == VALID
+
+
+def remember_domain(email):
+    enrichment_cache.store('email_domain', VALID, split_address(email)[1])
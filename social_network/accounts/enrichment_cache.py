@@ -0,0 +1,127 @@
+from collections import (
+    Counter,
+    OrderedDict,
+)
+import functools
+import threading
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            value, expires_at = item
+            if expires_at <= monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCache:
+    # shared between the workers, whatever the cache alias is configured with
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key, MISSING)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def as_dict(self):
+        names = set(self.hits) | set(self.misses)
+        return {name: {'hits': self.hits[name], 'misses': self.misses[name]}
+                for name in names}
+
+    def reset(self):
+        self.hits.clear()
+        self.misses.clear()
+
+
+stats = CacheStats()
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        if settings.ENRICHMENT_CACHE_BACKEND == 'django':
+            _cache = DjangoCache(settings.ENRICHMENT_CACHE_ALIAS)
+        else:
+            _cache = LRUCache(settings.ENRICHMENT_CACHE_SIZE)
+    return _cache
+
+
+def reset_cache():
+    global _cache
+    _cache = None
+    stats.reset()
+
+
+def cache_key(name, key):
+    return f'enrichment:{name}:' + ':'.join(str(part) for part in key)
+
+
+def lookup(name, *key):
+    value = get_cache().get(cache_key(name, key))
+    if value is MISSING:
+        stats.misses[name] += 1
+    else:
+        stats.hits[name] += 1
+    return value
+
+
+def store(name, value, *key):
+    get_cache().set(cache_key(name, key), value, settings.ENRICHMENT_CACHE_TTLS[name])
+
+
+def cached(name, key=lambda *args: args):
+    # memoizes an async lookup, exceptions are not cached so a failing
+    # provider is asked again next time
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args):
+            value = lookup(name, *key(*args))
+            if value is not MISSING:
+                return value
+
+            value = await func(self, *args)
+            store(name, value, *key(*args))
+            return value
+        return wrapper
+    return decorator
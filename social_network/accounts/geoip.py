@@ -0,0 +1,163 @@
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+
+
+# layout: header, IPv4 ranges, IPv6 ranges, records, null terminated strings.
+# ranges are sorted by their start so a lookup is a binary search, and
+# the file is memory mapped so the pages are shared between the workers
+MAGIC = b'SNGEOIP1'
+HEADER = struct.Struct('<8sIIII')
+V4_RANGE = struct.Struct('<III')
+V6_RANGE = struct.Struct('<16s16sI')
+RECORD = struct.Struct('<IIIi')
+
+CSV_FIELDS = ['start_ip', 'end_ip', 'city', 'region', 'country_code', 'gmt_offset']
+
+
+class GeoIPError(Exception):
+    pass
+
+
+def build_database(rows, path):
+    strings = bytearray()
+    string_offsets = {}
+    records = []
+    record_indexes = {}
+    v4_ranges = []
+    v6_ranges = []
+
+    def add_string(value):
+        value = value or ''
+        if value not in string_offsets:
+            string_offsets[value] = len(strings)
+            strings.extend(value.encode() + b'\0')
+        return string_offsets[value]
+
+    for row in rows:
+        start = ipaddress.ip_address(row['start_ip'].strip())
+        end = ipaddress.ip_address(row['end_ip'].strip())
+        if start.version != end.version or start > end:
+            raise GeoIPError(f'invalid range {start} - {end}')
+
+        record = (add_string(row['city']), add_string(row['region']),
+                  add_string(row['country_code']),
+                  round(float(row['gmt_offset'] or 0) * 60))
+        if record not in record_indexes:
+            record_indexes[record] = len(records)
+            records.append(record)
+
+        if start.version == 4:
+            v4_ranges.append((int(start), int(end), record_indexes[record]))
+        else:
+            v6_ranges.append((start.packed, end.packed, record_indexes[record]))
+
+    v4_ranges.sort()
+    v6_ranges.sort()
+    for ranges in (v4_ranges, v6_ranges):
+        for previous, current in zip(ranges, ranges[1:]):
+            if current[0] <= previous[1]:
+                raise GeoIPError('overlapping ranges in the source data')
+
+    # written next to the target and renamed, so running workers keep
+    # their mapping of the old file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(v4_ranges), len(v6_ranges), len(records), len(strings)))
+        for ip_range in v4_ranges:
+            f.write(V4_RANGE.pack(*ip_range))
+        for ip_range in v6_ranges:
+            f.write(V6_RANGE.pack(*ip_range))
+        for record in records:
+            f.write(RECORD.pack(*record))
+        f.write(strings)
+    os.replace(tmp_path, path)
+    return len(v4_ranges) + len(v6_ranges)
+
+
+def build_database_from_csv(csv_path, path):
+    with open(csv_path, newline='') as f:
+        # the header row is optional
+        rows = (row for row in csv.DictReader(f, fieldnames=CSV_FIELDS)
+                if row['start_ip'] != CSV_FIELDS[0])
+        return build_database(rows, path)
+
+
+class GeoIPDatabase:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.v4_count, self.v6_count, self.record_count, _ = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise GeoIPError(f'{path} is not a geoip database')
+        self.v4_offset = HEADER.size
+        self.v6_offset = self.v4_offset + self.v4_count * V4_RANGE.size
+        self.records_offset = self.v6_offset + self.v6_count * V6_RANGE.size
+        self.strings_offset = self.records_offset + self.record_count * RECORD.size
+
+    def close(self):
+        self._mm.close()
+
+    def _search(self, table_offset, count, row, key):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if row.unpack_from(self._mm, table_offset + middle * row.size)[0] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return None
+        _, end, record_index = row.unpack_from(self._mm, table_offset + (low - 1) * row.size)
+        return record_index if key <= end else None
+
+    def _string(self, offset):
+        start = self.strings_offset + offset
+        return self._mm[start:self._mm.find(b'\0', start)].decode() or None
+
+    def lookup(self, ip):
+        ip = ipaddress.ip_address(ip)
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+
+        if ip.version == 4:
+            record_index = self._search(self.v4_offset, self.v4_count, V4_RANGE, int(ip))
+        else:
+            record_index = self._search(self.v6_offset, self.v6_count, V6_RANGE, ip.packed)
+        if record_index is None:
+            return None
+
+        city, region, country, gmt_offset = RECORD.unpack_from(
+            self._mm, self.records_offset + record_index * RECORD.size)
+        return {
+            'city': self._string(city),
+            'region': self._string(region),
+            'country': self._string(country),
+            'gmt_offset': gmt_offset / 60,
+        }
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def get_database():
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = GeoIPDatabase(settings.GEOIP_DATABASE)
+        return _database
+
+
+def reset_database():
+    global _database
+    with _database_lock:
+        if _database is not None:
+            _database.close()
+        _database = None
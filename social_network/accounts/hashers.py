@@ -0,0 +1,100 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    BasePasswordHasher,
+    mask_hash,
+)
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # bounds how many passwords are hashed at once, a storm of logins waits
+    # for a slot instead of taking every core and scrypt's memory per hash
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(settings.PASSWORD_HASHING_WORKERS,
+                                       thread_name_prefix='password-hashing')
+        return _pool
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+    algorithm = 'scrypt'
+    dklen = 64
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_N
+
+    @property
+    def block_size(self):
+        return settings.PASSWORD_SCRYPT_R
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT_P
+
+    def derive(self, password, salt, work_factor, block_size, parallelism):
+        # hashlib.scrypt releases the GIL, the pool threads really run in parallel
+        maxmem = 2 * 128 * work_factor * block_size * parallelism
+        return get_pool().submit(
+            hashlib.scrypt, password.encode(), salt=salt.encode(), n=work_factor,
+            r=block_size, p=parallelism, maxmem=maxmem, dklen=self.dklen).result()
+
+    def encode(self, password, salt, work_factor=None, block_size=None, parallelism=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        work_factor = work_factor or self.work_factor
+        block_size = block_size or self.block_size
+        parallelism = parallelism or self.parallelism
+        hash_ = base64.b64encode(
+            self.derive(password, salt, work_factor, block_size, parallelism)).decode('ascii')
+        return f'{self.algorithm}${work_factor}${salt}${block_size}${parallelism}${hash_}'
+
+    def decode(self, encoded):
+        algorithm, work_factor, salt, block_size, parallelism, hash_ = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return {
+            'algorithm': algorithm,
+            'work_factor': int(work_factor),
+            'salt': salt,
+            'block_size': int(block_size),
+            'parallelism': int(parallelism),
+            'hash': hash_,
+        }
+
+    def verify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = self.encode(password, decoded['salt'], decoded['work_factor'],
+                                decoded['block_size'], decoded['parallelism'])
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        return {
+            _('algorithm'): decoded['algorithm'],
+            _('work factor'): decoded['work_factor'],
+            _('block size'): decoded['block_size'],
+            _('parallelism'): decoded['parallelism'],
+            _('salt'): mask_hash(decoded['salt']),
+            _('hash'): mask_hash(decoded['hash']),
+        }
+
+    def must_update(self, encoded):
+        # hashes made with older parameters are redone on the next login
+        decoded = self.decode(encoded)
+        return ((decoded['work_factor'], decoded['block_size'], decoded['parallelism'])
+                != (self.work_factor, self.block_size, self.parallelism))
+
+    def harden_runtime(self, password, encoded):
+        # the parameters are the cost, there are no rounds to make up for
+        pass
@@ -0,0 +1,93 @@
+from array import array
+from bisect import bisect_left
+import csv
+from datetime import date
+import logging
+import os
+import struct
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# layout: header, then per country its code, the number of holidays and
+# the sorted proleptic ordinals of the holiday dates
+MAGIC = b'SNHOLID1'
+HEADER = struct.Struct('<8sI')
+COUNTRY = struct.Struct('<2sI')
+
+
+class HolidayIndex:
+    def __init__(self, holidays=None):
+        self.holidays = holidays or {}
+
+    def __len__(self):
+        return sum(len(ordinals) for ordinals in self.holidays.values())
+
+    def is_holiday(self, country, day):
+        ordinals = self.holidays.get(country.upper())
+        if not ordinals:
+            return False
+        ordinal = day.toordinal()
+        i = bisect_left(ordinals, ordinal)
+        return i < len(ordinals) and ordinals[i] == ordinal
+
+    @classmethod
+    def from_rows(cls, rows):
+        dates = {}
+        for country, day in rows:
+            dates.setdefault(country.strip().upper(), set()).add(
+                date.fromisoformat(day.strip()).toordinal())
+        return cls({country: array('I', sorted(ordinals)) for country, ordinals in dates.items()})
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        # country,date[,name] rows, the header row is optional
+        with open(csv_path, newline='') as f:
+            return cls.from_rows((row[0], row[1]) for row in csv.reader(f)
+                                 if row and row[0] != 'country')
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        magic, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a holidays index')
+        offset = HEADER.size
+        holidays = {}
+        for _ in range(count):
+            country, size = COUNTRY.unpack_from(data, offset)
+            offset += COUNTRY.size
+            holidays[country.decode()] = array('I', struct.unpack_from(f'<{size}I', data, offset))
+            offset += size * 4
+        return cls(holidays)
+
+    def save(self, path):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(self.holidays)))
+            for country, ordinals in sorted(self.holidays.items()):
+                f.write(COUNTRY.pack(country.encode(), len(ordinals)))
+                f.write(struct.pack(f'<{len(ordinals)}I', *ordinals))
+        os.replace(tmp_path, path)
+
+
+_index = HolidayIndex()
+
+
+def get_index():
+    return _index
+
+
+def load_index(path=None):
+    global _index
+    path = path or settings.HOLIDAYS_INDEX
+    try:
+        _index = HolidayIndex.load(path)
+    except FileNotFoundError:
+        logger.warning(f'no holidays index at {path}, run ./manage.py load_holidays')
+        _index = HolidayIndex()
+    return _index
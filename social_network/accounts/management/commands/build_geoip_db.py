@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from accounts.geoip import (
+    GeoIPError,
+    build_database_from_csv,
+)
+
+
+class Command(BaseCommand):
+    help = ('Build the local geoip database from a CSV of '
+            'start_ip,end_ip,city,region,country_code,gmt_offset rows')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--output', default=settings.GEOIP_DATABASE)
+
+    def handle(self, *args, **options):
+        try:
+            count = build_database_from_csv(options['csv_path'], options['output'])
+        except (GeoIPError, ValueError) as e:
+            raise CommandError(e)
+        self.stdout.write(f'wrote {count} ranges to {options["output"]}')
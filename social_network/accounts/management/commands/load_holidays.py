@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from accounts import holidays
+
+
+class Command(BaseCommand):
+    help = 'Build the local holidays index from a CSV of country,date rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--output', default=settings.HOLIDAYS_INDEX)
+
+    def handle(self, *args, **options):
+        try:
+            index = holidays.HolidayIndex.from_csv(options['csv_path'])
+        except (OSError, ValueError, IndexError) as e:
+            raise CommandError(e)
+        index.save(options['output'])
+        holidays.load_index(options['output'])
+        self.stdout.write(f'wrote {len(index)} holidays of {len(index.holidays)} countries '
+                          f'to {options["output"]}, restart the workers to pick it up')
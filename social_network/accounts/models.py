@@ -9,3 +9,22 @@ class User(AbstractUser):
     country = models.CharField(max_length=2, null=True)
     region = models.CharField(max_length=200, null=True)
     signup_at_holiday = models.BooleanField(null=True)
+    # kept in step with Follow, tells the feed which accounts are
+    # read on demand instead of being fanned out
+    follower_count = models.PositiveIntegerField(default=0)
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['follower', 'followee'], name='unique_follow'),
+        ]
+        # fanning a post out walks the followers of its owner
+        indexes = [models.Index(fields=['followee', 'follower'], name='follow_followee_idx')]
+
+    def __str__(self):
+        return f'{self.follower}- {self.followee}'
@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+import contextvars
+import random
+import threading
+from time import monotonic
+
+from django.conf import settings
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and monotonic() - self.opened_at >= self.reset_timeout:
+                # let a single probe through, everyone else keeps failing fast
+                self.state = self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = monotonic()
+
+    def as_dict(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, settings.ENRICHMENT_BREAKER_THRESHOLD,
+                                             settings.ENRICHMENT_BREAKER_RESET)
+        return _breakers[name]
+
+
+def breaker_states():
+    with _breakers_lock:
+        return {name: breaker.as_dict() for name, breaker in _breakers.items()}
+
+
+def reset_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def backoff(attempt):
+    # exponential backoff with full jitter
+    cap = min(settings.ENRICHMENT_RETRY_MAX_DELAY,
+              settings.ENRICHMENT_RETRY_BASE_DELAY * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+_deadline = contextvars.ContextVar('enrichment_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    # nested budgets never extend the outer one
+    expires_at = monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expires_at = min(expires_at, current)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - monotonic()
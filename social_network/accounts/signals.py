@@ -1,12 +1,25 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
 from django.dispatch import receiver
 
-import accounts.data_enrichment
+from accounts import authentication
 from accounts.models import User
+from accounts.tasks import enrich_user
+from jobs.queue import enqueue
+from social_network import response_cache
 
 
 @receiver(post_save, sender=User, dispatch_uid='post_save_enrich_user_data')
 def enrich_user_data(sender, **kwargs):
     if kwargs.get('created'):
         instance = kwargs.get('instance')
-        accounts.data_enrichment.enrich_geo(instance)
+        enqueue(enrich_user, user_id=instance.pk)
+
+
+@receiver(post_save, sender=User, dispatch_uid='post_save_invalidate_user_responses')
+@receiver(post_delete, sender=User, dispatch_uid='post_delete_invalidate_user_responses')
+def invalidate_user_responses(sender, instance, **kwargs):
+    response_cache.invalidate('user', instance.pk)
+    authentication.forget_user(instance.pk)
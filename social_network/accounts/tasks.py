@@ -0,0 +1,20 @@
+import accounts.data_enrichment
+from accounts import authentication
+from accounts.models import User
+from jobs.queue import task
+from social_network import response_cache
+
+
+@task
+def enrich_user(user_id):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        return
+
+    accounts.data_enrichment.enrich_geo(user)
+    User.objects.filter(pk=user_id).update(city=user.city, region=user.region,
+                                           country=user.country,
+                                           signup_at_holiday=user.signup_at_holiday)
+    # update() doesn't send post_save
+    response_cache.invalidate('user', user_id)
+    authentication.forget_user(user_id)
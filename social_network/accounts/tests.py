@@ -1,18 +1,56 @@
+from datetime import (
+    date,
+    datetime,
+)
+import os
+import tempfile
 from unittest import mock
 
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import (
+    cache,
+    caches,
+)
+from django.core.management import call_command
 from django.test import (
     Client,
+    SimpleTestCase,
     TestCase,
+    override_settings,
+)
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts import (
+    authentication,
+    data_enrichment,
+    email_validation,
+    enrichment_cache,
+    geoip,
+    hashers,
+    holidays,
+    resilience,
 )
+from accounts.models import User
+from jobs.worker import run_pending
 
 
 BASE_URL = 'http://localhost:8000'
 
 SIGNUP = f'{BASE_URL}/api/signup/'
 LOGIN = f'{BASE_URL}/api/token/'
+REFRESH = f'{BASE_URL}/api/token/refresh/'
 USER_DATA = f'{BASE_URL}/api/user_data/1/'
 
 
+# the logins of one test would count against the throttles of the next ones
+UNTHROTTLED = override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'login': None, 'signup': None}})
+
+
+@UNTHROTTLED
 class AccountTestCase(TestCase):
     def setUp(self) -> None:
         self.client = Client()
@@ -88,3 +126,410 @@ class AccountTestCase(TestCase):
         self.assertEqual(200, user_data.status_code)
         self.assertEqual(user_json['username'], 'moshe')
         self.assertEqual(user_json['email'], 'moshe@gmail.com')
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    @mock.patch('accounts.data_enrichment.enrich_geo')
+    def test_user_data_cache_is_invalidated_by_enrichment(self, enrich_geo, is_valid_email):
+        is_valid_email.return_value = True
+        enrich_geo.side_effect = lambda user: setattr(user, 'country', 'IL')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(SIGNUP,
+                             {'username': 'moshe', 'email': 'moshe@gmail.com',
+                              'password': 'hello'})
+        res = self.client.post(LOGIN,
+                               {'username': 'moshe', 'password': 'hello'})
+        token = f"Bearer {res.json()['access']}"
+        before = self.client.get(USER_DATA, HTTP_AUTHORIZATION=token)
+        self.assertIsNone(before.json()['country'])
+
+        run_pending()
+        after = self.client.get(USER_DATA, HTTP_AUTHORIZATION=token,
+                                HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(200, after.status_code)
+        self.assertEqual('IL', after.json()['country'])
+
+
+@UNTHROTTLED
+class AuthenticationTestCase(TestCase):
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.client.post(SIGNUP,
+                         {'username': 'moshe', 'email': 'moshe@gmail.com',
+                          'password': 'hello'})
+        self.tokens = self.client.post(LOGIN, {'username': 'moshe', 'password': 'hello'}).json()
+        authentication.get_cache().clear()
+
+    def get_user_data(self, token):
+        return self.client.get(USER_DATA, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_comes_from_the_token(self):
+        request = mock.Mock(META={'HTTP_AUTHORIZATION': f"Bearer {self.tokens['access']}"})
+        with self.assertNumQueries(0):
+            user, _ = authentication.SnapshotJWTAuthentication().authenticate(request)
+            self.assertEqual((1, 'moshe', False), (user.pk, user.username, user.is_staff))
+        # anything else is loaded when it's read
+        self.assertEqual('moshe@gmail.com', user.email)
+
+    def test_tokens_without_a_snapshot_use_the_cache(self):
+        access = AccessToken(self.tokens['access'])
+        del access[authentication.SNAPSHOT_CLAIM]
+        self.assertEqual(200, self.get_user_data(str(access)).status_code)
+        with self.assertNumQueries(0):
+            authentication.get_user(1)
+
+        # saving the user drops it from the cache
+        User.objects.get(pk=1).save()
+        with self.assertNumQueries(1):
+            authentication.get_user(1)
+
+    def test_inactive_users_are_rejected(self):
+        User.objects.filter(pk=1).update(is_active=False)
+        authentication.forget_user(1)
+        res = self.client.post(REFRESH, {'refresh': self.tokens['refresh']})
+        self.assertEqual(401, res.status_code)
+
+    def test_refresh_takes_a_new_snapshot(self):
+        User.objects.filter(pk=1).update(is_staff=True)
+        authentication.forget_user(1)
+        access = self.client.post(REFRESH, {'refresh': self.tokens['refresh']}).json()['access']
+        self.assertEqual(['moshe', True, True, False],
+                         AccessToken(access)[authentication.SNAPSHOT_CLAIM])
+
+
+class PasswordHashingTestCase(TestCase):
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        # starts the login throttle over
+        caches['shared'].clear()
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.client.post(SIGNUP,
+                         {'username': 'moshe', 'email': 'moshe@gmail.com',
+                          'password': 'hello'})
+
+    def test_scrypt(self):
+        hasher = hashers.ScryptPasswordHasher()
+        encoded = hasher.encode('hello', hasher.salt())
+        self.assertTrue(encoded.startswith('scrypt$16384$'))
+        self.assertTrue(hasher.verify('hello', encoded))
+        self.assertFalse(hasher.verify('hell', encoded))
+        self.assertFalse(hasher.must_update(encoded))
+        with self.settings(PASSWORD_SCRYPT_N=2 ** 15):
+            self.assertTrue(hasher.must_update(encoded))
+
+    def test_new_passwords_use_scrypt(self):
+        self.assertTrue(User.objects.get(pk=1).password.startswith('scrypt$'))
+
+    def test_older_hashes_are_upgraded_on_login(self):
+        user = User.objects.get(pk=1)
+        user.password = make_password('hello', hasher='pbkdf2_sha256')
+        user.save(update_fields=['password'])
+
+        res = self.client.post(LOGIN, {'username': 'moshe', 'password': 'hello'})
+        self.assertEqual(200, res.status_code)
+        self.assertTrue(User.objects.get(pk=1).password.startswith('scrypt$'))
+
+    def test_logins_are_throttled(self):
+        with mock.patch('accounts.hashers.ScryptPasswordHasher.verify',
+                        return_value=False) as verify:
+            for _ in range(20):
+                res = self.client.post(LOGIN, {'username': 'moshe', 'password': 'wrong'})
+                self.assertEqual(401, res.status_code)
+            res = self.client.post(LOGIN, {'username': 'moshe', 'password': 'wrong'})
+        self.assertEqual(429, res.status_code)
+        # refused before the password is checked
+        self.assertEqual(20, verify.call_count)
+        # counted where every web process sees it
+        self.assertEqual(20, len(caches['shared'].get('throttle_login_127.0.0.1')))
+
+
+GEO_RESPONSE = {'city': 'Tel Aviv', 'region': 'Tel Aviv', 'country_code': 'IL',
+                'timezone': {'gmt_offset': 3}}
+
+
+def fake_provider(url, params, timeout):
+    if url == data_enrichment.EMAIL_URL:
+        return 200, {'is_valid_format': {'value': True}}
+    if url == data_enrichment.GEO_URL:
+        return 200, GEO_RESPONSE
+    return 200, [{'name': 'Yom Kippur', 'country': params['country']}]
+
+
+class EnrichmentClientTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        enrichment_cache.reset_cache()
+        resilience.reset_breakers()
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', side_effect=fake_provider)
+    async def test_enrich_signup(self, _request):
+        client = data_enrichment.EnrichmentClient()
+        valid, geo = await client.enrich_signup('moshe@gmail.com', '8.8.8.8')
+
+        self.assertTrue(valid)
+        self.assertEqual({'city': 'Tel Aviv', 'region': 'Tel Aviv', 'country': 'IL',
+                          'gmt_offset': 3, 'signup_at_holiday': True}, geo)
+        holiday_params = _request.call_args_list[-1].args[1]
+        self.assertEqual('IL', holiday_params['country'])
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', return_value=(503, {}))
+    async def test_lookup_geo_server_error_raises(self, _request):
+        client = data_enrichment.EnrichmentClient()
+        with self.assertRaises(data_enrichment.EnrichmentError):
+            await client.lookup_geo('8.8.8.8')
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', side_effect=fake_provider)
+    def test_sync_wrappers(self, _request):
+        user = mock.Mock(ip='8.8.8.8')
+        self.assertTrue(data_enrichment.is_valid_email('moshe@gmail.com'))
+        data_enrichment.enrich_geo(user)
+        self.assertEqual('IL', user.country)
+        self.assertTrue(user.signup_at_holiday)
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', side_effect=fake_provider)
+    async def test_lookups_are_cached(self, _request):
+        client = data_enrichment.EnrichmentClient()
+        await client.enrich('8.8.8.8')
+        await client.enrich('8.8.8.8')
+        await client.is_valid_email('moshe@gmail.com')
+        await client.is_valid_email('Moshe@Gmail.com ')
+
+        self.assertEqual(3, _request.call_count)
+        self.assertEqual({'email': {'hits': 0, 'misses': 1},
+                          'email_domain': {'hits': 1, 'misses': 1},
+                          'geo': {'hits': 1, 'misses': 1},
+                          'holiday': {'hits': 1, 'misses': 1}},
+                         data_enrichment.cache_stats())
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', return_value=(400, {}))
+    async def test_failed_lookups_are_not_cached(self, _request):
+        client = data_enrichment.EnrichmentClient()
+        self.assertFalse(await client.is_valid_email('moshe@gmail.com'))
+        self.assertFalse(await client.is_valid_email('moshe@gmail.com'))
+        self.assertEqual(2, _request.call_count)
+
+
+@mock.patch('accounts.data_enrichment.asyncio.sleep', new=mock.AsyncMock())
+class ResilienceTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        enrichment_cache.reset_cache()
+        resilience.reset_breakers()
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request')
+    async def test_server_errors_are_retried(self, _request):
+        _request.side_effect = [(503, {}), (200, {'is_valid_format': {'value': True}})]
+        client = data_enrichment.EnrichmentClient()
+        self.assertTrue(await client.is_valid_email('moshe@gmail.com'))
+        self.assertEqual(2, _request.call_count)
+        self.assertEqual('closed', data_enrichment.breaker_states()['email']['state'])
+
+    async def test_answers_that_arent_json_are_retried(self):
+        answers = [
+            web.Response(status=502, text='<html>Bad Gateway</html>', content_type='text/html'),
+            web.Response(status=200, text='<html>Maintenance</html>', content_type='text/html'),
+            web.json_response({'is_valid_format': {'value': True}}),
+        ]
+
+        async def provider(request):
+            return answers.pop(0)
+        app = web.Application()
+        app.router.add_get('/', provider)
+        server = TestServer(app)
+        await server.start_server()
+        client = data_enrichment.EnrichmentClient()
+        try:
+            with mock.patch.multiple(data_enrichment, EMAIL_URL=str(server.make_url('/')),
+                                     EMAIL_API_KEY='key'):
+                self.assertTrue(await client.is_valid_email('moshe@gmail.com'))
+        finally:
+            await client.close()
+            await server.close()
+        self.assertEqual([], answers)
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', return_value=(503, {}))
+    async def test_breaker_opens_and_fails_fast(self, _request):
+        client = data_enrichment.EnrichmentClient()
+        with self.settings(ENRICHMENT_BREAKER_THRESHOLD=2, ENRICHMENT_RETRIES=3):
+            self.assertFalse(await client.is_valid_email('moshe@gmail.com'))
+            self.assertEqual(2, _request.call_count)
+            self.assertFalse(await client.is_valid_email('moshe1@gmail.com'))
+            self.assertEqual(2, _request.call_count)
+
+        state = data_enrichment.breaker_states()['email']
+        self.assertEqual('open', state['state'])
+        self.assertEqual(1, state['times_opened'])
+        self.assertEqual(2, state['rejected'])
+
+    def test_breaker_lets_a_probe_through_after_reset_timeout(self):
+        breaker = resilience.CircuitBreaker('geo', failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual('open', breaker.state)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual('closed', breaker.state)
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', return_value=(503, {}))
+    async def test_deadline_stops_retries(self, _request):
+        client = data_enrichment.EnrichmentClient()
+        with resilience.deadline(0):
+            with self.assertRaises(data_enrichment.EnrichmentError):
+                await client.lookup_geo('8.8.8.8')
+        _request.assert_not_called()
+
+    def test_nested_deadline_never_extends_outer(self):
+        with resilience.deadline(1):
+            with resilience.deadline(60):
+                self.assertLessEqual(resilience.remaining(), 1)
+        self.assertIsNone(resilience.remaining())
+
+
+class LRUCacheTestCase(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = enrichment_cache.LRUCache(2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIs(enrichment_cache.MISSING, cache.get('b'))
+
+    def test_expired_entries_are_missing(self):
+        cache = enrichment_cache.LRUCache(2)
+        cache.set('a', 1, 0)
+        self.assertIs(enrichment_cache.MISSING, cache.get('a'))
+
+
+GEOIP_CSV = """start_ip,end_ip,city,region,country_code,gmt_offset
+1.0.0.0,1.0.0.255,Brisbane,Queensland,AU,10
+5.22.128.0,5.22.191.255,Tel Aviv,Tel Aviv,IL,3
+2001:4860::,2001:4860:ffff:ffff:ffff:ffff:ffff:ffff,Mountain View,California,US,-7
+103.1.0.0,103.1.0.255,Mumbai,Maharashtra,IN,5.5
+"""
+
+
+class GeoIPTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        csv_path = os.path.join(tmp_dir.name, 'geo.csv')
+        with open(csv_path, 'w') as f:
+            f.write(GEOIP_CSV)
+        self.db_path = os.path.join(tmp_dir.name, 'geoip.bin')
+        call_command('build_geoip_db', csv_path, output=self.db_path, stdout=open(os.devnull, 'w'))
+        self.db = geoip.GeoIPDatabase(self.db_path)
+        self.addCleanup(self.db.close)
+
+    def test_lookup_ipv4(self):
+        self.assertEqual({'city': 'Tel Aviv', 'region': 'Tel Aviv', 'country': 'IL',
+                          'gmt_offset': 3}, self.db.lookup('5.22.150.1'))
+        self.assertEqual('AU', self.db.lookup('1.0.0.0')['country'])
+        self.assertEqual(5.5, self.db.lookup('103.1.0.255')['gmt_offset'])
+
+    def test_lookup_ipv6(self):
+        self.assertEqual('US', self.db.lookup('2001:4860:4860::8888')['country'])
+        self.assertEqual('IL', self.db.lookup('::ffff:5.22.128.0')['country'])
+
+    def test_lookup_unknown_ip(self):
+        self.assertIsNone(self.db.lookup('127.0.0.1'))
+        self.assertIsNone(self.db.lookup('5.22.192.0'))
+        self.assertIsNone(self.db.lookup('::1'))
+
+    def test_overlapping_ranges_are_rejected(self):
+        rows = [dict(zip(geoip.CSV_FIELDS, ['1.0.0.0', '1.0.0.10', '', '', 'AU', '10'])),
+                dict(zip(geoip.CSV_FIELDS, ['1.0.0.5', '1.0.0.20', '', '', 'AU', '10']))]
+        with self.assertRaises(geoip.GeoIPError):
+            geoip.build_database(rows, os.path.join(os.path.dirname(self.db_path), 'bad.bin'))
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', side_effect=fake_provider)
+    def test_local_resolver(self, _request):
+        enrichment_cache.reset_cache()
+        geoip.reset_database()
+        self.addCleanup(geoip.reset_database)
+        user = mock.Mock(ip='5.22.150.1')
+        with self.settings(GEO_RESOLVER='local', GEOIP_DATABASE=self.db_path):
+            data_enrichment.enrich_geo(user)
+        self.assertEqual('IL', user.country)
+        self.assertEqual('Tel Aviv', user.city)
+        # only the holiday lookup went out
+        self.assertEqual(1, _request.call_count)
+
+
+HOLIDAYS_CSV = """country,date,name
+IL,2021-09-16,Yom Kippur
+US,2021-07-04,Independence Day
+IL,2021-09-07,Rosh Hashana
+"""
+
+
+class HolidayIndexTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        csv_path = os.path.join(tmp_dir.name, 'holidays.csv')
+        with open(csv_path, 'w') as f:
+            f.write(HOLIDAYS_CSV)
+        self.index_path = os.path.join(tmp_dir.name, 'holidays.bin')
+        call_command('load_holidays', csv_path, output=self.index_path,
+                     stdout=open(os.devnull, 'w'))
+        self.addCleanup(holidays.load_index, os.path.join(tmp_dir.name, 'missing.bin'))
+
+    def test_is_holiday(self):
+        index = holidays.HolidayIndex.load(self.index_path)
+        self.assertTrue(index.is_holiday('IL', date(2021, 9, 16)))
+        self.assertTrue(index.is_holiday('il', date(2021, 9, 7)))
+        self.assertFalse(index.is_holiday('IL', date(2021, 7, 4)))
+        self.assertFalse(index.is_holiday('FR', date(2021, 7, 4)))
+        self.assertEqual(3, len(index))
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request')
+    async def test_local_resolver(self, _request):
+        client = data_enrichment.EnrichmentClient()
+        with self.settings(HOLIDAY_RESOLVER='local'):
+            with mock.patch('accounts.data_enrichment.dt') as dt:
+                dt.now.return_value = datetime(2021, 9, 16, 12)
+                self.assertTrue(await client.is_holiday('IL', 0))
+                self.assertFalse(await client.is_holiday('US', 0))
+        _request.assert_not_called()
+
+
+class EmailValidationTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        enrichment_cache.reset_cache()
+        email_validation.mx_resolver.cache_clear()
+        self.addCleanup(email_validation.mx_resolver.cache_clear)
+
+    def test_syntax(self):
+        for email in ['moshe@gmail.com', 'moshe.cohen+tag@mail.example.co.il',
+                      "o'brien@example.org", 'moshe@xn--5dbqzzl.com', 'moshe@שלום.com']:
+            self.assertTrue(email_validation.is_valid_syntax(email), email)
+        for email in ['moshe@gmail', 'moshe', '@gmail.com', 'moshe@', 'mo..she@gmail.com',
+                      '.moshe@gmail.com', 'moshe@-gmail.com', 'moshe@gmail..com',
+                      'mo she@gmail.com', f'{"m" * 65}@gmail.com', 'moshe@gmail.c0m']:
+            self.assertFalse(email_validation.is_valid_syntax(email), email)
+
+    def test_disposable_domains_are_invalid(self):
+        self.assertFalse(email_validation.local_verdict('moshe@mailinator.com'))
+
+    def test_mx_records(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'mx.txt')
+        with open(path, 'w') as f:
+            f.write('gmail.com gmail-smtp-in.l.google.com\nno-mail.com\n')
+
+        with self.settings(EMAIL_MX_RESOLVER='accounts.email_validation.StaticMXResolver',
+                           EMAIL_MX_RECORDS=path):
+            self.assertTrue(email_validation.local_verdict('moshe@gmail.com'))
+            self.assertFalse(email_validation.local_verdict('moshe@no-mail.com'))
+            self.assertIsNone(email_validation.local_verdict('moshe@example.com'))
+        self.assertEqual({'hits': 0, 'misses': 3}, enrichment_cache.stats.as_dict()['email_domain'])
+
+    @mock.patch.object(data_enrichment.EnrichmentClient, '_request', side_effect=fake_provider)
+    def test_remote_validation_only_for_new_domains(self, _request):
+        self.assertFalse(data_enrichment.is_valid_email('moshe@gmail'))
+        self.assertTrue(data_enrichment.is_valid_email('moshe@gmail.com'))
+        self.assertTrue(data_enrichment.is_valid_email('moshe1@gmail.com'))
+        self.assertFalse(data_enrichment.is_valid_email('moshe..1@gmail.com'))
+        self.assertEqual(1, _request.call_count)
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class LoginRateThrottle(SimpleRateThrottle):
+    # per client IP, DRF checks it before the view hashes any password
+    scope = 'login'
+
+    @property
+    def cache(self):
+        return caches[settings.THROTTLE_CACHE_ALIAS]
+
+    def get_rate(self):
+        # read when the throttle is made rather than when DRF's class was
+        # imported, so the rates follow the settings, overridden ones included
+        return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class SignupRateThrottle(LoginRateThrottle):
+    scope = 'signup'
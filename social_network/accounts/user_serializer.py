@@ -1,8 +1,10 @@
 from rest_framework import serializers
+
+from social_network.metrics import TimedSerializerMixin
 from .models import User
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'city', 'country', 'signup_at_holiday']
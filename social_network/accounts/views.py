@@ -1,3 +1,6 @@
+from django.db import transaction
+from django.db.models import F
+from django.shortcuts import get_object_or_404
 from rest_framework import (
     generics,
     status,
@@ -5,13 +8,34 @@ from rest_framework import (
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.views import (
+    TokenObtainPairView,
+    TokenRefreshView,
+)
 
 import accounts.data_enrichment
+from jobs.queue import enqueue
+from posts import timeline
+from posts.tasks import backfill_timeline
+from social_network.response_cache import CachedRetrieveMixin
+from .throttling import (
+    LoginRateThrottle,
+    SignupRateThrottle,
+)
+from .authentication import (
+    SnapshotTokenObtainPairSerializer,
+    SnapshotTokenRefreshSerializer,
+)
 from .user_serializer import UserSerializer
-from .models import User
+from .models import (
+    Follow,
+    User,
+)
 
 
 class Account(APIView):
+    throttle_classes = [SignupRateThrottle]
+
     def post(self, request):
         username = request.data['username']
         email = request.data['email']
@@ -30,7 +54,61 @@ class Account(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserData(generics.RetrieveAPIView):
+class TokenObtainPair(TokenObtainPairView):
+    serializer_class = SnapshotTokenObtainPairSerializer
+    throttle_classes = [LoginRateThrottle]
+
+
+class TokenRefresh(TokenRefreshView):
+    serializer_class = SnapshotTokenRefreshSerializer
+
+
+class UserData(CachedRetrieveMixin, generics.RetrieveAPIView):
     queryset = User.objects.all()
     permission_classes = [IsAuthenticated]
     serializer_class = UserSerializer
+    cache_name = 'user'
+
+
+class FollowUpdate(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_followee(self, request, pk):
+        followee = get_object_or_404(User.objects.only('id'), pk=pk)
+        if followee.pk == request.user.pk:
+            return None
+        return followee
+
+    def patch(self, request, pk):
+        followee = self.get_followee(request, pk)
+        if followee is None:
+            return Response({'error': "You can't follow yourself"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic(savepoint=False):
+            _, created = Follow.objects.get_or_create(follower_id=request.user.pk,
+                                                      followee_id=followee.pk)
+            if created:
+                User.objects.filter(pk=followee.pk).update(follower_count=F('follower_count') + 1)
+                enqueue(backfill_timeline, follower_id=request.user.pk, followee_id=followee.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    put = patch
+
+
+class UnFollowUpdate(FollowUpdate):
+    def patch(self, request, pk):
+        followee = self.get_followee(request, pk)
+        if followee is None:
+            return Response({'error': "You can't follow yourself"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic(savepoint=False):
+            deleted, _ = Follow.objects.filter(follower_id=request.user.pk,
+                                               followee_id=followee.pk).delete()
+            if deleted:
+                User.objects.filter(pk=followee.pk).update(follower_count=F('follower_count') - 1)
+                timeline.forget(request.user.pk, followee.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    put = patch
@@ -0,0 +1,68 @@
+import io
+from time import perf_counter
+
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from social_network.parsers import (
+    MessagePackParser,
+    ORJSONParser,
+)
+from social_network.renderers import (
+    MessagePackRenderer,
+    ORJSONRenderer,
+    msgpack,
+    orjson,
+)
+
+
+def codecs():
+    # name: (renderer, parser), the stdlib JSON ones are the baseline
+    available = {'json': (JSONRenderer(), JSONParser())}
+    if orjson is not None:
+        available['orjson'] = (ORJSONRenderer(), ORJSONParser())
+    if msgpack is not None:
+        available['msgpack'] = (MessagePackRenderer(), MessagePackParser())
+    return available
+
+
+def posts_page(posts):
+    # shaped like a page of /api/posts/, the serializers have already
+    # turned everything into JSON types
+    return {
+        'next': 'http://localhost:8000/api/posts/?cursor=cD0yMDIxLTA4LTAx',
+        'previous': None,
+        'results': [{
+            'id': n,
+            'title': f'benchmark post {n}',
+            'body': f'synthetic body {n} ' * 5,
+            'owner': f'bench_{n % 97}',
+            'like_count': n % 13,
+            'liked_by_me': n % 2 == 0,
+        } for n in range(posts)],
+    }
+
+
+def timed_per_call(func, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat
+
+
+def run(posts=100, repeat=200):
+    data = posts_page(posts)
+    report = {'posts': posts, 'repeat': repeat, 'codecs': {}}
+    for name, (renderer, parser) in codecs().items():
+        body = renderer.render(data)
+        report['codecs'][name] = {
+            'bytes': len(body),
+            'encode_ms': round(timed_per_call(lambda: renderer.render(data), repeat) * 1000, 4),
+            'decode_ms': round(
+                timed_per_call(lambda: parser.parse(io.BytesIO(body)), repeat) * 1000, 4),
+        }
+    baseline = report['codecs']['json']
+    for name, result in report['codecs'].items():
+        result['encode_speedup'] = round(baseline['encode_ms'] / result['encode_ms'], 2)
+        result['size_percent'] = round(result['bytes'] / baseline['bytes'] * 100, 1)
+    return report
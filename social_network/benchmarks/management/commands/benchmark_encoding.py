@@ -0,0 +1,18 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from benchmarks import encoding
+
+
+class Command(BaseCommand):
+    help = ('Time the JSON, orjson and MessagePack renderers and parsers on a page of posts '
+            'and report the time per page and the bytes as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100, help='posts on the page')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        report = encoding.run(options['posts'], options['repeat'])
+        self.stdout.write(json.dumps(report, indent=2))
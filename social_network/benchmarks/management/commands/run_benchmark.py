@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from benchmarks import runner
+
+
+class Command(BaseCommand):
+    help = ('Drive the API with concurrent clients and report the latency percentiles, '
+            'throughput and queries per request as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10, help='seconds')
+        parser.add_argument('--requests', type=int, default=None,
+                            help='stop after this many requests')
+        parser.add_argument('--scenario', action='append', choices=list(runner.SCENARIOS),
+                            dest='scenarios', help='may be repeated, all of them by default')
+        parser.add_argument('--url', default=None,
+                            help='benchmark a running server instead of going in process, '
+                                 'queries are only reported when it sends Server-Timing')
+        parser.add_argument('--provider-latency', type=float, default=0.0,
+                            help='seconds the stubbed enrichment providers take to answer')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='file to write the report to')
+        parser.add_argument('--baseline', help='a previous report to compare with')
+
+    def handle(self, *args, **options):
+        try:
+            report = runner.run(options['scenarios'], options['concurrency'], options['duration'],
+                                options['requests'], options['url'], options['provider_latency'],
+                                options['seed'])
+        except RuntimeError as e:
+            raise CommandError(e)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                report['change_percent'] = runner.compare(report, json.load(f))
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        self.stdout.write(text)
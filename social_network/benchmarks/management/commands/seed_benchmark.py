@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from benchmarks import seed
+
+
+class Command(BaseCommand):
+    help = 'Create synthetic users, posts and likes to benchmark against'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts-per-user', type=int, default=10)
+        parser.add_argument('--likes-per-post', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        created = seed.seed(options['users'], options['posts_per_user'],
+                            options['likes_per_post'], options['batch_size'])
+        self.stdout.write(f"created {created['users']} users, {created['posts']} posts "
+                          f"and {created['likes']} likes")
@@ -0,0 +1,231 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import (
+    datetime,
+    timezone,
+)
+import itertools
+import json
+import math
+import random
+import re
+import threading
+from time import (
+    monotonic,
+    perf_counter,
+)
+import urllib.error
+import urllib.request
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.test import (
+    Client,
+    override_settings,
+)
+
+from posts import sharding
+from posts.models import Post
+from . import seed
+from .stubs import stub_enrichment
+
+
+SCENARIOS = {
+    # name: weight in the request mix
+    'post_list': 40,
+    'post_detail': 30,
+    'like': 20,
+    'token': 5,
+    'signup': 5,
+}
+
+QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class InProcessTransport:
+    # goes through the whole middleware and view stack without a server
+    def __init__(self):
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        res = self.client.generic(method, path, json.dumps(data) if data is not None else '',
+                                  content_type='application/json', **headers)
+        return res.status_code, res.content, res.get('Server-Timing')
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        req = urllib.request.Request(
+            self.base_url + path, method=method,
+            data=json.dumps(data).encode() if data is not None else None,
+            headers={'Content-Type': 'application/json',
+                     **({'Authorization': f'Bearer {token}'} if token else {})})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as res:
+                return res.status, res.read(), res.headers.get('Server-Timing')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers.get('Server-Timing')
+
+
+class Session:
+    # one simulated client, logged in as one of the seeded users
+    def __init__(self, transport, username, post_ids, rng):
+        self.transport = transport
+        self.username = username
+        self.post_ids = post_ids
+        self.rng = rng
+        self.access_token = None
+
+    def login(self):
+        status_code, body, _ = self.token()
+        if status_code != 200:
+            raise RuntimeError(f'could not log in as {self.username}: {body[:200]}')
+        self.access_token = json.loads(body)['access']
+
+    def post_list(self):
+        return self.transport.request('GET', '/api/posts/', token=self.access_token)
+
+    def post_detail(self):
+        return self.transport.request('GET', f'/api/posts/{self.rng.choice(self.post_ids)}/',
+                                      token=self.access_token)
+
+    def like(self):
+        action = self.rng.choice(['like', 'unlike'])
+        return self.transport.request(
+            'PATCH', f'/api/posts/{self.rng.choice(self.post_ids)}/{action}/', {},
+            token=self.access_token)
+
+    def token(self):
+        return self.transport.request('POST', '/api/token/', {
+            'username': self.username, 'password': seed.PASSWORD})
+
+    def signup(self):
+        # unique across runs against the same database
+        name = f'{seed.USERNAME_PREFIX}signup_{uuid.uuid4().hex[:16]}'
+        return self.transport.request('POST', '/api/signup/', {
+            'username': name, 'email': f'{name}@example.com', 'password': seed.PASSWORD})
+
+
+def percentile(values, fraction):
+    # nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, elapsed):
+    # client errors such as liking your own post are expected in the mix,
+    # only server errors count as errors
+    latencies = [latency for latency, _, _ in samples]
+    queries = [count for _, _, count in samples if count is not None]
+    statuses = Counter(str(status_code) for _, status_code, _ in samples)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status_code, _ in samples if status_code >= 500),
+        'statuses': dict(sorted(statuses.items())),
+        'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': _ms(percentile(latencies, 0.50)),
+            'p95': _ms(percentile(latencies, 0.95)),
+            'p99': _ms(percentile(latencies, 0.99)),
+            'mean': _ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': _ms(max(latencies, default=None)),
+        },
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def run(scenarios=None, concurrency=8, duration=10.0, requests=None, base_url=None,
+        provider_latency=0.0, random_seed=0):
+    # runs the weighted mix of scenarios from concurrency sessions until
+    # duration seconds passed or requests were made, whichever is first
+    scenarios = scenarios or list(SCENARIOS)
+    weights = [SCENARIOS[name] for name in scenarios]
+    usernames = list(seed.seeded_users().filter(username__regex=rf'^{seed.USERNAME_PREFIX}\d+$')
+                     .values_list('username', flat=True)[:10000])
+    post_ids = [post_id for shard in sharding.shards()
+                for post_id in Post.objects.using(shard).values_list('id', flat=True)[:10000]]
+    if not usernames or not post_ids:
+        raise RuntimeError('nothing to benchmark against, run ./manage.py seed_benchmark first')
+
+    samples = {name: [] for name in scenarios}
+    lock = threading.Lock()
+    budget = itertools.count() if requests is None else iter(range(requests))
+    deadline = monotonic() + duration
+
+    def session(n):
+        rng = random.Random(random_seed + n)
+        transport = InProcessTransport() if base_url is None else HttpTransport(base_url)
+        client = Session(transport, rng.choice(usernames), post_ids, rng)
+        client.login()
+        while monotonic() < deadline and next(budget, None) is not None:
+            name = rng.choices(scenarios, weights)[0]
+            start = perf_counter()
+            status_code, _, server_timing = getattr(client, name)()
+            latency = perf_counter() - start
+            match = QUERIES_RE.search(server_timing or '')
+            with lock:
+                samples[name].append((latency, status_code,
+                                      int(match.group(1)) if match else None))
+
+    def threaded_session(n):
+        try:
+            session(n)
+        finally:
+            connection.close()
+
+    started_at = datetime.now(timezone.utc)
+    start = perf_counter()
+    # the in process client calls itself testserver
+    with stub_enrichment(provider_latency), override_settings(
+            METRICS_SERVER_TIMING=True, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        if concurrency == 1:
+            session(0)
+        else:
+            with ThreadPoolExecutor(concurrency) as pool:
+                for future in [pool.submit(threaded_session, n) for n in range(concurrency)]:
+                    future.result()
+    elapsed = perf_counter() - start
+
+    return {
+        'started_at': started_at.isoformat(),
+        'target': base_url or 'in-process',
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 3),
+        'provider_latency': provider_latency,
+        'dataset': seed.dataset_size(),
+        'total': summarize([sample for name in scenarios for sample in samples[name]], elapsed),
+        'scenarios': {name: summarize(samples[name], elapsed) for name in scenarios},
+    }
+
+
+def compare(report, baseline):
+    # relative change of the p95 latency and the throughput per scenario
+    changes = {}
+    for name, current in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            'p95': _change(before['latency_ms']['p95'], current['latency_ms']['p95']),
+            'rps': _change(before['rps'], current['rps']),
+            'queries_per_request': _change(before['queries_per_request'],
+                                           current['queries_per_request']),
+        }
+    return changes
+
+
+def _change(before, after):
+    if not before or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
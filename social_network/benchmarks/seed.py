@@ -0,0 +1,70 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+
+from accounts.models import User
+from posts import sharding
+from posts.bulk import (
+    chunked,
+    create_posts,
+    recount_likes,
+)
+from posts.models import (
+    Like,
+    Post,
+)
+
+
+USERNAME_PREFIX = 'bench_'
+PASSWORD = 'bench-password'
+
+
+def username(i):
+    return f'{USERNAME_PREFIX}{i}'
+
+
+def seeded_users():
+    return User.objects.filter(username__startswith=USERNAME_PREFIX)
+
+
+def seed(users, posts_per_user, likes_per_post, batch_size=1000, rng=None):
+    # hashing is the slow part of creating a user, they all share one hash
+    rng = rng or random.Random(0)
+    password = make_password(PASSWORD)
+    first = seeded_users().count()
+    for chunk in chunked(range(first, first + users), batch_size):
+        User.objects.bulk_create([
+            User(username=username(i), email=f'{username(i)}@example.com', password=password,
+                 ip='127.0.0.1')
+            for i in chunk])
+    user_ids = list(seeded_users().order_by('id').values_list('id', flat=True))
+    new_user_ids = user_ids[first:]
+
+    posts = ((owner_id, n) for owner_id in new_user_ids for n in range(posts_per_user))
+    for chunk in chunked(posts, batch_size):
+        create_posts([
+            Post(title=f'benchmark post {n} of {owner_id}',
+                 body=f'synthetic body {owner_id} {n} ' * 5, owner_id=owner_id)
+            for owner_id, n in chunk])
+    post_ids = [post_id for shard in sharding.shards()
+                for post_id in Post.objects.using(shard).filter(owner_id__in=new_user_ids)
+                .values_list('id', flat=True)]
+
+    likers = min(likes_per_post, len(user_ids))
+    for chunk in chunked(post_ids, max(1, batch_size // max(1, likers))):
+        for shard, shard_post_ids in sharding.group_by_shard(chunk).items():
+            Like.objects.using(shard).bulk_create([
+                Like(post_id=post_id, user_id=user_id)
+                for post_id in shard_post_ids for user_id in rng.sample(user_ids, likers)],
+                ignore_conflicts=True)
+            recount_likes(set(shard_post_ids), shard)
+
+    return {'users': len(new_user_ids), 'posts': len(post_ids), 'likes': len(post_ids) * likers}
+
+
+def dataset_size():
+    return {
+        'users': User.objects.count(),
+        'posts': sum(Post.objects.using(shard).count() for shard in sharding.shards()),
+        'likes': sum(Like.objects.using(shard).count() for shard in sharding.shards()),
+    }
@@ -0,0 +1,26 @@
+import asyncio
+from contextlib import contextmanager
+from unittest import mock
+
+from accounts import data_enrichment
+
+
+# canned provider answers, the client's caching, retries and breakers still
+# run, only the network round trip is replaced by a sleep
+
+RESPONSES = {
+    data_enrichment.EMAIL_URL: {'is_valid_format': {'value': True}},
+    data_enrichment.GEO_URL: {'city': 'Tel Aviv', 'region': 'Tel Aviv District',
+                              'country_code': 'IL', 'timezone': {'gmt_offset': 2}},
+    data_enrichment.HOLIDAY_URL: [],
+}
+
+
+@contextmanager
+def stub_enrichment(latency=0.0):
+    async def request(client, url, params, timeout):
+        await asyncio.sleep(latency)
+        return 200, RESPONSES[url]
+
+    with mock.patch.object(data_enrichment.EnrichmentClient, '_request', request):
+        yield
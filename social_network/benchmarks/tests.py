@@ -0,0 +1,51 @@
+from django.test import TestCase
+
+from accounts.models import User
+from posts import sharding
+from posts.models import Post
+from . import (
+    runner,
+    seed,
+)
+
+
+class BenchmarkTestCase(TestCase):
+    databases = '__all__'
+
+    def test_seed(self):
+        created = seed.seed(users=4, posts_per_user=3, likes_per_post=2, batch_size=5)
+        self.assertEqual({'users': 4, 'posts': 12, 'likes': 24}, created)
+        self.assertEqual(4, User.objects.count())
+        self.assertEqual([2] * 12, [like_count for using in sharding.shards() for like_count in
+                                    Post.objects.using(using).values_list('like_count', flat=True)])
+
+        # seeding again adds more users instead of clashing with the first ones
+        seed.seed(users=2, posts_per_user=1, likes_per_post=0)
+        self.assertEqual(6, User.objects.count())
+
+    def test_run(self):
+        seed.seed(users=3, posts_per_user=2, likes_per_post=1)
+        report = runner.run(concurrency=1, requests=30)
+
+        self.assertEqual(30, report['total']['requests'])
+        self.assertEqual(0, report['total']['errors'])
+        self.assertEqual(set(runner.SCENARIOS), set(report['scenarios']))
+        post_list = report['scenarios']['post_list']
+        self.assertLessEqual(post_list['latency_ms']['p50'], post_list['latency_ms']['p99'])
+        if not sharding.enabled():
+            # the page, the user comes from the token
+            self.assertEqual(1, post_list['queries_per_request'])
+
+        changes = runner.compare(report, report)
+        self.assertEqual(0, changes['post_list']['p95'])
+
+    def test_run_needs_a_seed(self):
+        with self.assertRaises(RuntimeError):
+            runner.run(concurrency=1, requests=1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, runner.percentile(values, 0.5))
+        self.assertEqual(99, runner.percentile(values, 0.99))
+        self.assertEqual(7, runner.percentile([7], 0.95))
+        self.assertIsNone(runner.percentile([], 0.5))
@@ -0,0 +1,38 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from jobs.worker import (
+    run_pending,
+    work,
+)
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--poll-interval', type=float, default=None)
+        parser.add_argument('--once', action='store_true',
+                            help='run the jobs that are due and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = run_pending()
+            self.stdout.write(f'ran {count} jobs')
+            return
+
+        if options['processes'] == 1:
+            work(options['poll_interval'])
+            return
+
+        # children must not share the parent's database connections
+        connections.close_all()
+        workers = [multiprocessing.Process(target=work, args=(options['poll_interval'],))
+                   for _ in range(options['processes'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+from time import sleep
+
+from django.conf import settings
+from django.db import (
+    close_old_connections,
+    transaction,
+)
+
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_backend = None
+
+
+def task(func):
+    name = f'{func.__module__}.{func.__name__}'
+    _registry[name] = func
+    func.job_name = name
+    return func
+
+
+def get_task(name):
+    return _registry[name]
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.JOBS_RETRY_BACKOFF * 2 ** (attempts - 1))
+
+
+class DatabaseBackend:
+    def push(self, name, payload):
+        from .models import Job
+        Job.objects.create(name=name, payload=payload)
+
+
+class ThreadBackend:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=settings.JOBS_THREADS,
+                                           thread_name_prefix='jobs')
+
+    def push(self, name, payload):
+        self.executor.submit(self.run, name, payload)
+
+    def run(self, name, payload):
+        try:
+            for attempt in range(1, settings.JOBS_MAX_ATTEMPTS + 1):
+                try:
+                    get_task(name)(**payload)
+                    return
+                except Exception:
+                    logger.exception(f'job {name} failed, attempt {attempt}')
+                    if attempt < settings.JOBS_MAX_ATTEMPTS:
+                        sleep(retry_delay(attempt).total_seconds())
+        finally:
+            close_old_connections()
+
+
+BACKENDS = {
+    'database': DatabaseBackend,
+    'thread': ThreadBackend,
+}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[settings.JOBS_BACKEND]()
+    return _backend
+
+
+def enqueue(func, **payload):
+    # the job only makes sense once the rows it refers to are visible
+    # to other connections, so wait for the surrounding transaction
+    transaction.on_commit(lambda: get_backend().push(func.job_name, payload))
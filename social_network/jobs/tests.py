@@ -0,0 +1,65 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from accounts.models import User
+from accounts.tasks import enrich_user
+from .models import Job
+from .queue import enqueue
+from .worker import run_pending
+
+
+def fake_enrich_geo(user):
+    user.city = 'Tel Aviv'
+    user.region = 'Tel Aviv'
+    user.country = 'IL'
+    user.signup_at_holiday = False
+    return user
+
+
+class JobTestCase(TestCase):
+    def setUp(self) -> None:
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user('moshe', 'moshe@gmail.com', 'hello',
+                                                 ip='127.0.0.1')
+
+    def test_signup_enqueues_enrichment_job(self):
+        job = Job.objects.get()
+        self.assertEqual(enrich_user.job_name, job.name)
+        self.assertEqual({'user_id': self.user.pk}, job.payload)
+        self.assertEqual(Job.QUEUED, job.status)
+
+    def test_enqueue_waits_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            enqueue(enrich_user, user_id=self.user.pk)
+            self.assertEqual(1, Job.objects.count())
+        self.assertEqual(1, len(callbacks))
+
+    @mock.patch('accounts.data_enrichment.enrich_geo', side_effect=fake_enrich_geo)
+    def test_run_pending_writes_user(self, enrich_geo):
+        self.assertEqual(1, run_pending())
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual('IL', user.country)
+        self.assertEqual('Tel Aviv', user.city)
+        self.assertFalse(user.signup_at_holiday)
+        self.assertEqual(Job.DONE, Job.objects.get().status)
+
+    @mock.patch('accounts.data_enrichment.enrich_geo', side_effect=Exception('down'))
+    def test_failed_job_is_retried_with_backoff(self, enrich_geo):
+        self.assertEqual(1, run_pending())
+        job = Job.objects.get()
+        self.assertEqual(Job.QUEUED, job.status)
+        self.assertEqual(1, job.attempts)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('down', job.last_error)
+
+    @mock.patch('accounts.data_enrichment.enrich_geo', side_effect=Exception('down'))
+    def test_job_fails_after_max_attempts(self, enrich_geo):
+        with self.settings(JOBS_MAX_ATTEMPTS=2):
+            run_pending()
+            Job.objects.update(run_at=timezone.now())
+            run_pending()
+        job = Job.objects.get()
+        self.assertEqual(Job.FAILED, job.status)
+        self.assertEqual(2, job.attempts)
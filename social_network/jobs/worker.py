@@ -0,0 +1,71 @@
+import logging
+import traceback
+from time import sleep
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+from .queue import (
+    get_task,
+    retry_delay,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def claim_job():
+    now = timezone.now()
+    stale = now - settings.JOBS_LOCK_TIMEOUT
+    candidates = (Job.objects
+                  .filter(Q(status=Job.QUEUED, run_at__lte=now) |
+                          Q(status=Job.RUNNING, locked_at__lt=stale))
+                  .order_by('run_at')
+                  .values_list('pk', 'status', 'locked_at')[:10])
+
+    for pk, status, locked_at in candidates:
+        # only one worker wins the conditional update for a given row
+        claimed = Job.objects.filter(pk=pk, status=status, locked_at=locked_at).update(
+            status=Job.RUNNING, locked_at=now)
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    job.attempts += 1
+    try:
+        get_task(job.name)(**job.payload)
+    except Exception:
+        logger.exception(f'job {job.name} ({job.pk}) failed, attempt {job.attempts}')
+        job.last_error = traceback.format_exc()
+        if job.attempts < settings.JOBS_MAX_ATTEMPTS:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+        else:
+            job.status = Job.FAILED
+    else:
+        job.status = Job.DONE
+    job.locked_at = None
+    job.save(update_fields=['attempts', 'status', 'run_at', 'locked_at', 'last_error'])
+
+
+def run_pending():
+    count = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+def work(poll_interval=None):
+    poll_interval = poll_interval or settings.JOBS_POLL_INTERVAL
+    while True:
+        close_old_connections()
+        if not run_pending():
+            sleep(poll_interval)
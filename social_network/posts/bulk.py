@@ -0,0 +1,162 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Count,
+    OuterRef,
+    Subquery,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework import serializers
+
+from accounts.models import User
+from social_network import response_cache
+from . import (
+    search,
+    sharding,
+    trending,
+)
+from .models import (
+    Like,
+    Post,
+    insert_sharded,
+)
+
+NOT_AN_OBJECT = {'non_field_errors': ['Expected a JSON object.']}
+
+
+class BulkPostSerializer(serializers.ModelSerializer):
+    owner = serializers.IntegerField(required=False)
+
+    class Meta:
+        model = Post
+        fields = ['title', 'body', 'owner']
+
+
+class BulkLikeSerializer(serializers.Serializer):
+    post = serializers.IntegerField()
+    user = serializers.IntegerField()
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validate_chunk(chunk, serializer_class, errors):
+    valid = []
+    for line, row in chunk:
+        if not isinstance(row, dict):
+            errors.append({'line': line, 'errors': NOT_AN_OBJECT})
+            continue
+        serializer = serializer_class(data=row)
+        if serializer.is_valid():
+            valid.append((line, serializer.validated_data))
+        else:
+            errors.append({'line': line, 'errors': serializer.errors})
+    return valid
+
+
+def existing(model, pks):
+    return set(model.objects.filter(pk__in=pks).values_list('pk', flat=True))
+
+
+def existing_posts(post_ids):
+    found = set()
+    for shard, shard_post_ids in sharding.group_by_shard(post_ids).items():
+        found.update(Post.objects.using(shard).filter(pk__in=shard_post_ids)
+                     .values_list('pk', flat=True))
+    return found
+
+
+def create_posts(posts):
+    # sharded posts get their ids here, so unlike the autoincrement ones
+    # they are known on every backend
+    if not sharding.enabled():
+        Post.objects.bulk_create(posts)
+        return
+    by_shard = {}
+    for post in posts:
+        by_shard.setdefault(sharding.shard_for_owner(post.owner_id), []).append(post)
+    for shard_posts in by_shard.values():
+        insert_sharded(shard_posts,
+                       lambda using: Post.objects.using(using).bulk_create(shard_posts))
+
+
+def import_posts(rows, owner_id=None, chunk_size=None):
+    # rows are (line number, row) and may name their owner unless owner_id
+    # forces one, owners are checked once per chunk instead of once per row
+    chunk_size = chunk_size or settings.BULK_CHUNK_SIZE
+    created = 0
+    errors = []
+    for chunk in chunked(rows, chunk_size):
+        valid = validate_chunk(chunk, BulkPostSerializer, errors)
+        if owner_id is None:
+            owners = existing(User, {data.get('owner') for _, data in valid})
+        posts = []
+        for line, data in valid:
+            post_owner = owner_id or data.get('owner')
+            if post_owner is None:
+                errors.append({'line': line, 'errors': {'owner': ['This field is required.']}})
+                continue
+            if owner_id is None and post_owner not in owners:
+                errors.append({'line': line, 'errors': {'owner': ['Unknown user.']}})
+                continue
+            posts.append(Post(title=data['title'], body=data['body'], owner_id=post_owner))
+        create_posts(posts)
+        # only some backends hand back the new ids, the rest are picked up by
+        # ./manage.py rebuild_search_index
+        search.index_posts([post for post in posts if post.pk is not None])
+        created += len(posts)
+    return {'created': created, 'errors': errors}
+
+
+def import_likes(rows, chunk_size=None):
+    chunk_size = chunk_size or settings.BULK_CHUNK_SIZE
+    imported = 0
+    errors = []
+    for chunk in chunked(rows, chunk_size):
+        valid = validate_chunk(chunk, BulkLikeSerializer, errors)
+        posts = existing_posts({data['post'] for _, data in valid})
+        users = existing(User, {data['user'] for _, data in valid})
+        # the likes of a chunk share their time, which tells them from the
+        # likes that were already there
+        imported_at = timezone.now()
+        likes = []
+        for line, data in valid:
+            if data['post'] not in posts:
+                errors.append({'line': line, 'errors': {'post': ['Unknown post.']}})
+            elif data['user'] not in users:
+                errors.append({'line': line, 'errors': {'user': ['Unknown user.']}})
+            else:
+                likes.append(Like(post_id=data['post'], user_id=data['user'],
+                                  created_at=imported_at))
+
+        # likes that are already there are skipped by the unique index
+        for shard, post_ids in sharding.group_by_shard({like.post_id for like in likes}).items():
+            post_ids = set(post_ids)
+            with transaction.atomic(using=shard):
+                Like.objects.using(shard).bulk_create(
+                    [like for like in likes if like.post_id in post_ids], ignore_conflicts=True)
+                imported += (Like.objects.using(shard)
+                             .filter(post_id__in=post_ids, created_at=imported_at).count())
+                recount_likes(post_ids, shard)
+                trending.rescore(post_ids, shard)
+    return {'imported': imported, 'errors': errors}
+
+
+def recount_likes(post_ids, using=None):
+    if not post_ids:
+        return
+    counts = (Like.objects.filter(post_id=OuterRef('pk')).order_by()
+              .values('post_id').annotate(count=Count('*')).values('count'))
+    Post.objects.using(using).filter(pk__in=post_ids).update(
+        like_count=Coalesce(Subquery(counts), 0))
+    for post_id in post_ids:
+        response_cache.invalidate('post', post_id)
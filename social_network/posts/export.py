@@ -0,0 +1,63 @@
+import csv
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from accounts.models import User
+from . import sharding
+from .models import (
+    Like,
+    Post,
+)
+
+# the first field is the primary key, exports walk it in chunks so no
+# query or transaction lives longer than one chunk
+DATASETS = {
+    'posts': (Post, ['id', 'title', 'body', 'owner_id', 'like_count', 'created_at']),
+    'users': (User, ['id', 'username', 'email', 'city', 'region', 'country',
+                     'signup_at_holiday', 'date_joined']),
+    'likes': (Like, ['id', 'post_id', 'user_id', 'created_at']),
+}
+
+FORMATS = ['ndjson', 'csv']
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_rows(dataset, chunk_size=None):
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    model, fields = DATASETS[dataset]
+    # one shard after the other, the users are not sharded
+    for using in sharding.shards() if model in (Post, Like) else [None]:
+        last_pk = None
+        while True:
+            queryset = model.objects.using(using).order_by('pk')
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            rows = list(queryset.values_list(*fields)[:chunk_size])
+            if not rows:
+                break
+            yield from rows
+            last_pk = rows[-1][0]
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def export(dataset, output_format='ndjson', chunk_size=None):
+    fields = DATASETS[dataset][1]
+    rows = iter_rows(dataset, chunk_size)
+    if output_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(fields, row))) + '\n'
@@ -0,0 +1,221 @@
+import atexit
+from collections import defaultdict
+from datetime import (
+    datetime,
+    timezone as dt_timezone,
+)
+from functools import reduce
+import logging
+import sqlite3
+import threading
+from time import sleep
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    close_old_connections,
+    transaction,
+)
+from django.db.models import F
+from django.utils import timezone
+
+from . import (
+    likes,
+    sharding,
+    trending,
+)
+from .models import (
+    Like,
+    Post,
+)
+
+
+# with LIKE_WRITE_BEHIND the like and unlike views only record the intent
+# here, the last one per post and user wins, and flush() writes them in
+# batches, so a hot post is locked and updated once a batch instead of once
+# a like. an intent is kept until it's written and the reads merge it in
+# meanwhile, users see their own likes right away
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS like_intents (
+        post_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        liked INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (post_id, user_id)
+    )
+'''
+
+
+class IntentStore:
+    # a SQLite file shared by the processes of a host, or a database in
+    # memory for this process only
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path or ':memory:'), timeout=5,
+                                           isolation_level=None, check_same_thread=False)
+        if path:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(_SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def record(self, post_id, user_id, liked, created_at):
+        # a changed intent gets a new version, so a flush that read the old
+        # one leaves it for the next
+        self._execute(
+            'INSERT INTO like_intents (post_id, user_id, liked, created_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (post_id, user_id) DO UPDATE SET liked = excluded.liked, '
+            'created_at = excluded.created_at, version = version + 1',
+            [post_id, user_id, liked, created_at.timestamp()])
+
+    def pending(self, user_id, post_ids):
+        placeholders = ', '.join('?' * len(post_ids))
+        return {post_id: bool(liked) for post_id, liked in self._execute(
+            f'SELECT post_id, liked FROM like_intents '
+            f'WHERE user_id = ? AND post_id IN ({placeholders})', [user_id, *post_ids])}
+
+    def take(self, limit):
+        return self._execute(
+            'SELECT post_id, user_id, liked, created_at, version FROM like_intents LIMIT ?', [limit])
+
+    def forget(self, rows):
+        # only the intents that didn't change since they were taken
+        with self._lock:
+            self._connection.executemany(
+                'DELETE FROM like_intents WHERE post_id = ? AND user_id = ? AND version = ?',
+                [(post_id, user_id, version) for post_id, user_id, _, _, version in rows])
+
+
+_store = None
+_store_lock = threading.Lock()
+_flusher = None
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IntentStore(settings.LIKE_BUFFER_FILE)
+        return _store
+
+
+def reset_store():
+    global _store
+    _store = None
+
+
+def record(post_id, user_id, liked):
+    get_store().record(post_id, user_id, liked, timezone.now())
+    start_flusher()
+
+
+def merge_pending(user, rows):
+    # rows are post dicts with their stored like_count and liked_by_me
+    if not settings.LIKE_WRITE_BEHIND or not user.is_authenticated or not rows:
+        return
+    pending = get_store().pending(user.pk, [row['id'] for row in rows])
+    for row in rows:
+        liked = pending.get(row['id'])
+        if liked is not None and liked != row['liked_by_me']:
+            row['liked_by_me'] = liked
+            row['like_count'] += 1 if liked else -1
+
+
+def write_intents(intents):
+    # intents are (post_id, user_id, liked, created_at), repeated likes and
+    # unlikes of nothing are skipped like add_like and remove_like do
+    for shard, post_ids in sharding.group_by_shard({intent[0] for intent in intents}).items():
+        using = shard or DEFAULT_DB_ALIAS
+        # read before the transaction starts, see likes.remove_like. it only
+        # narrows down the writes, the counts follow the rows they changed
+        post_ids = set(Post.objects.using(using).filter(pk__in=post_ids)
+                       .values_list('pk', flat=True))
+        shard_intents = [intent for intent in intents if intent[0] in post_ids]
+        existing = {(post_id, user_id): (pk, created_at) for pk, post_id, user_id, created_at in
+                    Like.objects.using(using)
+                    .filter(post_id__in=post_ids, user_id__in={intent[1] for intent in shard_intents})
+                    .values_list('id', 'post_id', 'user_id', 'created_at')}
+
+        adding = []
+        removing = []
+        for post_id, user_id, liked, created_at in shard_intents:
+            like = existing.get((post_id, user_id))
+            if liked and like is None:
+                adding.append((post_id, user_id, created_at))
+            elif not liked and like is not None:
+                removing.append((post_id, *like))
+
+        with transaction.atomic(using=using, savepoint=False):
+            added = likes.insert_likes(adding, using)
+            # a like removed meanwhile by another request was counted by it
+            removed = [(post_id, created_at) for post_id, pk, created_at in removing
+                       if Like.objects.using(using).filter(pk=pk).delete()[0]]
+            # the unlikes first, the last likes of a post are removed at a count of 0
+            removed_scores = defaultdict(list)
+            for post_id, created_at in removed:
+                removed_scores[post_id].append(trending.like_score(created_at))
+            for post_id, scores in removed_scores.items():
+                Post.objects.using(using).filter(pk=post_id).update(
+                    like_count=F('like_count') - len(scores),
+                    trending_score=trending.removed(reduce(trending.logaddexp, scores),
+                                                    len(scores)))
+            added_scores = defaultdict(list)
+            for post_id, _, created_at in added:
+                added_scores[post_id].append(trending.like_score(created_at))
+            for post_id, scores in added_scores.items():
+                Post.objects.using(using).filter(pk=post_id).update(
+                    like_count=F('like_count') + len(scores),
+                    trending_score=trending.added(reduce(trending.logaddexp, scores)))
+            likes.liked_changed_many(
+                {(post_id, user_id): liked for post_id, user_id, liked, _ in shard_intents},
+                removed_scores.keys() | added_scores.keys(), using)
+
+
+def flush(batch_size=None):
+    # writes what was recorded so far, returns how many intents were taken
+    batch_size = batch_size or settings.LIKE_FLUSH_BATCH
+    store = get_store()
+    flushed = 0
+    while True:
+        rows = store.take(batch_size)
+        if rows:
+            write_intents([
+                (post_id, user_id, bool(liked), datetime.fromtimestamp(at, dt_timezone.utc))
+                for post_id, user_id, liked, at, _ in rows])
+            store.forget(rows)
+            flushed += len(rows)
+        if len(rows) < batch_size:
+            return flushed
+
+
+def flush_forever(interval=None):
+    interval = interval or settings.LIKE_FLUSH_INTERVAL
+    while True:
+        sleep(interval)
+        try:
+            flush()
+        except Exception:
+            # the intents stay and are tried again
+            logger.exception('flushing the buffered likes failed')
+        finally:
+            close_old_connections()
+
+
+def start_flusher():
+    # a buffer in memory is written by a thread of its process, a shared one
+    # by ./manage.py flush_likes
+    global _flusher
+    if _flusher is not None or settings.LIKE_BUFFER_FILE or not settings.LIKE_FLUSH_INTERVAL:
+        return
+    with _store_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=flush_forever, name='like-flusher', daemon=True)
+            _flusher.start()
+            # what's left when the process stops
+            atexit.register(flush)
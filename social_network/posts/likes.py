@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    connections,
+    transaction,
+)
+from django.db.models import F
+from django.utils import timezone
+
+from social_network import response_cache
+from . import (
+    sharding,
+    trending,
+)
+from .models import (
+    Like,
+    Post,
+)
+
+
+def _insert_ignore_sql(connection):
+    table = connection.ops.quote_name(Like._meta.db_table)
+    if connection.vendor == 'mysql':
+        return f'INSERT IGNORE INTO {table} (post_id, user_id, created_at) VALUES (%s, %s, %s)'
+    return (f'INSERT INTO {table} (post_id, user_id, created_at) VALUES (%s, %s, %s) '
+            f'ON CONFLICT DO NOTHING')
+
+
+def insert_likes(rows, using):
+    # rows are (post_id, user_id, created_at), returns the ones inserted, the
+    # (post, user) unique index skips the likes that are already there
+    connection = connections[using]
+    sql = _insert_ignore_sql(connection)
+    inserted = []
+    with connection.cursor() as cursor:
+        for post_id, user_id, created_at in rows:
+            cursor.execute(sql, [post_id, user_id,
+                                 connection.ops.adapt_datetimefield_value(created_at)])
+            if cursor.rowcount == 1:
+                inserted.append((post_id, user_id, created_at))
+    return inserted
+
+
+def add_like(post_id, user_id):
+    # the (post, user) unique index makes a repeated like a no-op, and
+    # only the request that inserted the row moves the counter and the score
+    created_at = timezone.now()
+    using = sharding.shard_for_post(post_id) or DEFAULT_DB_ALIAS
+    with transaction.atomic(using=using, savepoint=False):
+        created = bool(insert_likes([(post_id, user_id, created_at)], using))
+        if created:
+            Post.objects.using(using).filter(pk=post_id).update(
+                like_count=F('like_count') + 1,
+                trending_score=trending.added(trending.like_score(created_at)))
+        _liked_changed(post_id, user_id, True, created, using)
+    return created
+
+
+def remove_like(post_id, user_id):
+    # read before the transaction starts, a transaction that reads before it
+    # writes can't take the write lock on SQLite while another one holds it
+    using = sharding.shard_for_post(post_id) or DEFAULT_DB_ALIAS
+    like = Like.objects.using(using).filter(post_id=post_id, user_id=user_id).values_list(
+        'id', 'created_at').first()
+    with transaction.atomic(using=using, savepoint=False):
+        deleted = like is not None and Like.objects.using(using).filter(pk=like[0]).delete()[0]
+        if deleted:
+            Post.objects.using(using).filter(pk=post_id).update(
+                like_count=F('like_count') - 1,
+                trending_score=trending.removed(trending.like_score(like[1])))
+        _liked_changed(post_id, user_id, False, deleted, using)
+    return bool(deleted)
+
+
+def _liked_key(post_id, user_id):
+    return f'liked:{post_id}:{user_id}'
+
+
+def _liked_changed(post_id, user_id, liked, changed, using):
+    def remember():
+        response_cache.get_cache().set(_liked_key(post_id, user_id), liked,
+                                       settings.RESPONSE_CACHE_TIMEOUT)
+    remember()
+    transaction.on_commit(remember, using=using)
+    if changed:
+        response_cache.invalidate('post', post_id, using)
+
+
+def liked_changed_many(liked, changed_post_ids, using):
+    # _liked_changed for the (post_id, user_id): liked of a batch
+    def remember():
+        response_cache.get_cache().set_many(
+            {_liked_key(post_id, user_id): value for (post_id, user_id), value in liked.items()},
+            settings.RESPONSE_CACHE_TIMEOUT)
+    remember()
+    transaction.on_commit(remember, using=using)
+    for post_id in changed_post_ids:
+        response_cache.invalidate('post', post_id, using)
+
+
+def is_liked(post_id, user_id):
+    if user_id is None:
+        return False
+    cache = response_cache.get_cache()
+    liked = cache.get(_liked_key(post_id, user_id))
+    if liked is None:
+        liked = (Like.objects.using(sharding.shard_for_post(post_id))
+                 .filter(post_id=post_id, user_id=user_id).exists())
+        cache.set(_liked_key(post_id, user_id), liked, settings.RESPONSE_CACHE_TIMEOUT)
+    return liked
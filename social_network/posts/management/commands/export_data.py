@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = 'Stream a dataset out as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(export.DATASETS))
+        parser.add_argument('--output-format', choices=export.FORMATS, default='ndjson')
+        parser.add_argument('--output', help='file to write to, stdout by default')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        out = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for line in export.export(options['dataset'], options['output_format'],
+                                      options['chunk_size']):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from posts import like_buffer
+
+
+class Command(BaseCommand):
+    help = 'Write the likes and unlikes buffered in LIKE_BUFFER_FILE, every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None)
+        parser.add_argument('--once', action='store_true',
+                            help='write what is buffered and exit')
+
+    def handle(self, *args, **options):
+        if not settings.LIKE_BUFFER_FILE:
+            raise CommandError('The likes are buffered in the memory of the web process, '
+                               'set LIKE_BUFFER_FILE')
+        if options['once']:
+            count = like_buffer.flush()
+            self.stdout.write(f'flushed {count} likes')
+            return
+        like_buffer.flush_forever(options['interval'])
@@ -0,0 +1,7 @@
+from posts import bulk
+from .import_posts import Command as ImportCommand
+
+
+class Command(ImportCommand):
+    help = 'Import likes from a JSON Lines file of {"post", "user"} objects'
+    importer = staticmethod(bulk.import_likes)
@@ -0,0 +1,22 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+from social_network.parsers import parse_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Import posts from a JSON Lines file of {"title", "body", "owner"} objects'
+    importer = staticmethod(bulk.import_posts)
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        with open(options['path']) as f:
+            result = self.importer(parse_ndjson(f), chunk_size=options['chunk_size'])
+        for error in result.pop('errors'):
+            self.stderr.write(json.dumps(error))
+        self.stdout.write(json.dumps(result))
@@ -0,0 +1,23 @@
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from posts import (
+    rebalance,
+    sharding,
+)
+
+
+class Command(BaseCommand):
+    help = ('Move the posts and their likes to the shards their owners hash to, '
+            'after POST_SHARDS changed or when the posts are first sharded')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('The posts are not sharded, set POST_SHARD_FILES')
+        moved = rebalance.rebalance(options['chunk_size'])
+        self.stdout.write(f'moved {moved} posts')
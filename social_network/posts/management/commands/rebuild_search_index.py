@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts import (
+    search,
+    sharding,
+)
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Index every post for search, e.g. after a bulk import'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        indexed = 0
+        for shard in sharding.shards():
+            posts = Post.objects.using(shard).only('id', 'title', 'body').order_by('pk')
+            last_pk = 0
+            while True:
+                chunk = list(posts.filter(pk__gt=last_pk)[:chunk_size])
+                if not chunk:
+                    break
+                search.index_posts(chunk)
+                indexed += len(chunk)
+                last_pk = chunk[-1].pk
+        self.stdout.write(f'indexed {indexed} posts')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'Recompute the trending scores and the trending posts snapshot, meant to run periodically'
+
+    def handle(self, *args, **options):
+        scored = trending.rebuild()
+        top = trending.snapshot()
+        self.stdout.write(f'scored {scored} posts, {len(top)} trending')
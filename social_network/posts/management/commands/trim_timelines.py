@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = 'Drop the home timeline entries past FEED_TIMELINE_LENGTH, meant to run periodically'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'trimmed {timeline.trim()} timeline entries')
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:41
+
+from django.db import migrations, models
+from django.db.models import (
+    Count,
+    OuterRef,
+    Subquery,
+)
+
+
+def count_likes(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Like = Post.likes.through
+    counts = (Like.objects.filter(post_id=OuterRef('pk')).order_by()
+              .values('post_id').annotate(count=Count('*')).values('count'))
+    Post.objects.filter(likes__isnull=False).update(like_count=Subquery(counts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_auto_20210802_1553'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 21:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_delete_cleanup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='searchposting',
+            index=models.Index(fields=['term', 'weight', 'post'], name='search_term_weight_idx'),
+        ),
+    ]
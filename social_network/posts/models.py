@@ -1,14 +1,128 @@
-from django.db import models
+from django.db import (
+    IntegrityError,
+    models,
+    transaction,
+)
+from django.utils import timezone
 
 from accounts.models import User
+from . import sharding
 
 
 # Create your models here.
 class Post(models.Model):
     title = models.CharField(max_length=400)
     body = models.TextField()
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='post_owner')
-    likes = models.ManyToManyField(User, related_name='post_likes')
+    # the posts may be sharded away from the users, see posts.sharding
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='post_owner',
+                              db_constraint=False)
+    likes = models.ManyToManyField(User, related_name='post_likes', through='Like')
+    # kept in step with likes by the like/unlike views, so listing posts
+    # never has to count the through table
+    like_count = models.PositiveIntegerField(default=0)
+    # the log of the time decayed likes, see posts.trending
+    trending_score = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # backs the keyset pagination of the posts list
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='post_created_at_id_idx'),
+            models.Index(fields=['owner', 'created_at', 'id'], name='post_owner_created_at_idx'),
+            models.Index(fields=['trending_score'], name='post_trending_score_idx'),
+        ]
 
     def __str__(self):
         return f'{self.owner}- {self.title}'
+
+    def save(self, *args, **kwargs):
+        # a sharded post is written to its owner's shard whatever the caller
+        # asked for, its id says where it is
+        if sharding.enabled():
+            if self.pk is None:
+                kwargs.pop('using', None)
+                kwargs.pop('force_insert', None)
+
+                def insert(using):
+                    super(Post, self).save(*args, force_insert=True, using=using, **kwargs)
+                insert_sharded([self], insert)
+                return
+            kwargs['using'] = sharding.shard_for_post(self.pk)
+        super().save(*args, **kwargs)
+
+
+def insert_sharded(posts, insert):
+    # gives new posts of the same shard their ids and calls insert(using), a
+    # conflict on an id another process handed out too is tried again
+    for attempt in range(sharding.ID_ATTEMPTS):
+        for post in posts:
+            post.pk = sharding.new_post_id(post.owner_id)
+        using = sharding.shard_for_post(posts[0].pk)
+        try:
+            with transaction.atomic(using=using):
+                insert(using)
+            return
+        except IntegrityError:
+            if (attempt + 1 == sharding.ID_ATTEMPTS or not Post.objects.using(using)
+                    .filter(pk__in=[post.pk for post in posts]).exists()):
+                for post in posts:
+                    post.pk = None
+                raise
+
+
+class Like(models.Model):
+    # the table used to be created by the likes ManyToManyField
+    id = models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'posts_post_likes'
+        unique_together = [['post', 'user']]
+        indexes = [
+            models.Index(fields=['created_at'], name='like_created_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # on its post's shard, like the post
+        if sharding.enabled():
+            kwargs['using'] = sharding.shard_for_post(self.post_id)
+        super().save(*args, **kwargs)
+
+
+class TimelineEntry(models.Model):
+    # a post pushed to the home timeline of one of its owner's followers
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    # deleted with the post by posts.signals, a sharded post's delete doesn't
+    # cascade to the default database
+    post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, related_name='+',
+                             db_constraint=False)
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'post'], name='timeline_user_created_at_idx'),
+        ]
+
+
+class SearchPosting(models.Model):
+    # one row of the inverted index, a term of a post and how much it counts
+    term = models.CharField(max_length=64)
+    # deleted with the post by posts.signals, like the timeline entries
+    post = models.ForeignKey(Post, on_delete=models.DO_NOTHING, related_name='+',
+                             db_constraint=False)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'post'], name='unique_search_posting'),
+        ]
+        indexes = [
+            # a one term query reads its page in this order
+            models.Index(fields=['term', 'weight', 'post'], name='search_term_weight_idx'),
+        ]
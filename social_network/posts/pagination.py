@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class LikeCursorPagination(CursorPagination):
+    ordering = '-id'
+    page_size = 100
+
+
+class PostCursorPagination(CursorPagination):
+    # newest first, (created_at, id) is indexed
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -3,15 +3,15 @@ from rest_framework import permissions
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if request in permissions.SAFE_METHODS:
+        if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.owner == request.user
+        return obj.owner_id == request.user.pk
 
 
 class IsNotOwnerAndAuthenticatedOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if request in permissions.SAFE_METHODS:
+        if request.method in permissions.SAFE_METHODS:
             return True
 
-        return obj.owner != request.user and request.user.is_authenticated
+        return request.user.is_authenticated and obj.owner_id != request.user.pk
@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    transaction,
+)
+
+from social_network import response_cache
+from . import sharding
+from .models import (
+    Like,
+    Post,
+    SearchPosting,
+    TimelineEntry,
+)
+
+
+# moves the posts that are not on the shard their id points at, which is
+# every post after the shards changed and the posts from before the sharding,
+# meant to run while the posts are not being written
+
+
+def is_misplaced(post_id, using):
+    return not sharding.is_sharded_id(post_id) or sharding.shard_for_post(post_id) != using
+
+
+def move_posts(posts, source):
+    old_ids = [post.pk for post in posts]
+    likes = list(Like.objects.using(source).filter(post_id__in=old_ids))
+
+    # posts from before the sharding get an id that says where they are,
+    # derived from the old one so a run that was cut short copies them again
+    # under the same id
+    renamed = {}
+    by_shard = defaultdict(list)
+    for post in posts:
+        if not sharding.is_sharded_id(post.pk):
+            renamed[post.pk] = post.pk = sharding.legacy_post_id(post.pk, post.owner_id)
+        by_shard[sharding.shard_for_post(post.pk)].append(post)
+
+    for shard, shard_posts in by_shard.items():
+        post_ids = {post.pk for post in shard_posts}
+        with transaction.atomic(using=shard):
+            # a run that was cut short may have copied some of them already
+            Post.objects.using(shard).bulk_create(shard_posts, ignore_conflicts=True)
+            Like.objects.using(shard).bulk_create(
+                [Like(post_id=renamed.get(like.post_id, like.post_id), user_id=like.user_id,
+                      created_at=like.created_at)
+                 for like in likes if renamed.get(like.post_id, like.post_id) in post_ids],
+                ignore_conflicts=True)
+
+    with transaction.atomic():
+        for old_id, new_id in renamed.items():
+            TimelineEntry.objects.filter(post_id=old_id).update(post_id=new_id)
+            SearchPosting.objects.filter(post_id=old_id).update(post_id=new_id)
+            response_cache.invalidate('post', old_id)
+
+    with transaction.atomic(using=source):
+        Like.objects.using(source).filter(post_id__in=old_ids).delete()
+        # without the delete signals and the cascade, the posts live on and
+        # their timeline entries and search postings go with them
+        Post.objects.using(source).filter(pk__in=old_ids)._raw_delete(source)
+
+
+def rebalance(chunk_size=500):
+    moved = 0
+    for source in dict.fromkeys([DEFAULT_DB_ALIAS, *settings.POST_SHARDS]):
+        last_pk = 0
+        while True:
+            chunk = list(Post.objects.using(source).filter(pk__gt=last_pk)
+                         .order_by('pk')[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            misplaced = [post for post in chunk if is_misplaced(post.pk, source)]
+            if misplaced:
+                move_posts(misplaced, source)
+                moved += len(misplaced)
+    return moved
@@ -0,0 +1,129 @@
+import base64
+from collections import Counter
+import heapq
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import SearchPosting
+
+
+# posts are indexed as term -> (post, weight) postings, a query matches the
+# posts having all of its terms and ranks them by their summed weights. the
+# matches are found from the postings of the query's rarest term, the other
+# terms are only looked up for those posts
+
+WORD_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+TITLE_WEIGHT = 3
+COUNT_LIMIT = 1000  # postings counted per term at first, to find the rarest
+LOOKUP_BATCH_SIZE = 500  # post ids per lookup of the other terms
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in',
+    'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'such', 'that', 'the',
+    'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was', 'will', 'with',
+])
+
+
+def tokenize(text):
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall(text.lower())
+            if len(word) > 1 and word not in STOP_WORDS]
+
+
+def term_weights(title, body):
+    weights = Counter(tokenize(body))
+    for term in tokenize(title):
+        weights[term] += TITLE_WEIGHT
+    return weights
+
+
+def index_posts(posts):
+    postings = [SearchPosting(term=term, post_id=post.pk, weight=weight)
+                for post in posts
+                for term, weight in term_weights(post.title, post.body).items()]
+    with transaction.atomic():
+        SearchPosting.objects.filter(post_id__in=[post.pk for post in posts]).delete()
+        SearchPosting.objects.bulk_create(postings, batch_size=1000)
+    return len(postings)
+
+
+def index_post(post):
+    return index_posts([post])
+
+
+def query_terms(query):
+    # duplicates would be counted twice against the matched terms
+    return list(dict.fromkeys(tokenize(query)))[:settings.SEARCH_MAX_TERMS]
+
+
+def encode_cursor(score, post_id):
+    return base64.urlsafe_b64encode(f'{score}|{post_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        score, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return int(score), int(post_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def rarest_term(terms):
+    # the postings are counted up to a limit, raised until a term has fewer
+    limit = COUNT_LIMIT
+    while True:
+        counts = {term: SearchPosting.objects.filter(term=term)[:limit].count() for term in terms}
+        rarest = min(terms, key=counts.get)
+        if counts[rarest] < limit:
+            return rarest, counts[rarest]
+        limit *= 10
+
+
+def search_term(term, cursor, page_size):
+    postings = SearchPosting.objects.filter(term=term)
+    if cursor is not None:
+        score, post_id = cursor
+        postings = postings.filter(Q(weight__lt=score) | Q(weight=score, post_id__lt=post_id))
+    return list(postings.order_by('-weight', '-post_id').values_list('weight', 'post_id')[:page_size])
+
+
+def search_terms(terms, cursor, page_size):
+    rarest, count = rarest_term(terms)
+    if not count:
+        return []
+    others = [term for term in terms if term != rarest]
+
+    scores = dict(SearchPosting.objects.filter(term=rarest).values_list('post_id', 'weight'))
+    matched = Counter()
+    post_ids = list(scores)
+    for i in range(0, len(post_ids), LOOKUP_BATCH_SIZE):
+        postings = (SearchPosting.objects
+                    .filter(term__in=others, post_id__in=post_ids[i:i + LOOKUP_BATCH_SIZE])
+                    .values_list('post_id', 'weight'))
+        for post_id, weight in postings:
+            scores[post_id] += weight
+            matched[post_id] += 1
+
+    matches = ((score, post_id) for post_id, score in scores.items()
+               if matched[post_id] == len(others))
+    if cursor is not None:
+        matches = (match for match in matches if match < tuple(cursor))
+    return heapq.nlargest(page_size, matches)
+
+
+def search(query, cursor=None, page_size=None):
+    page_size = page_size or settings.SEARCH_PAGE_SIZE
+    terms = query_terms(query)
+    if not terms:
+        return [], None
+
+    if len(terms) == 1:
+        page = search_term(terms[0], cursor, page_size)
+    else:
+        page = search_terms(terms, cursor, page_size)
+
+    next_cursor = encode_cursor(*page[-1]) if len(page) == page_size else None
+    return [post_id for _, post_id in page], next_cursor
@@ -1,17 +1,84 @@
 from rest_framework import serializers
-from .models import Post
 
+from accounts.models import User
+from social_network.metrics import TimedSerializerMixin
+from social_network.read_serializers import ReadSerializer
+from . import (
+    like_buffer,
+    sharding,
+)
+from .models import (
+    Like,
+    Post,
+)
 
-class PostSerializer(serializers.ModelSerializer):
+
+class PostSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     owner = serializers.StringRelatedField(read_only=True)
-    likes = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    liked_by_me = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'body', 'owner', 'likes']
+        fields = ['id', 'title', 'body', 'owner', 'like_count', 'liked_by_me']
+        read_only_fields = ['like_count']
+
+    def get_liked_by_me(self, obj):
+        # the views annotate it, a lookup on the through table's
+        # (post, user) unique index is the fallback
+        if hasattr(obj, 'liked_by_me'):
+            return obj.liked_by_me
+        user = self.context['request'].user
+        if not user.is_authenticated:
+            return False
+        return Like.objects.using(obj._state.db).filter(post_id=obj.pk, user_id=user.pk).exists()
 
 
-class LikeSerializer(serializers.ModelSerializer):
+class PostLikeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    id = serializers.IntegerField(source='user_id')
+    username = serializers.CharField(source='user.username')
+
     class Meta:
-        model = Post
-        fields = ['likes']
+        model = Like
+        fields = ['id', 'username']
+
+
+class ShardedUsersMixin:
+    # sharded posts and likes can't join their users, the usernames of a
+    # page are looked up on the default database instead
+    # the user's id and username lookups
+    user_lookups = None
+
+    @classmethod
+    def values(cls, queryset, *extra):
+        if not sharding.enabled():
+            return super().values(queryset, *extra)
+        user_id, username = cls.user_lookups
+        lookups = [user_id if lookup == username else lookup for lookup in cls.lookups]
+        return queryset.prefetch_related(None).values(*lookups, *extra)
+
+    def prepare(self, rows):
+        if not sharding.enabled() or not rows:
+            return
+        user_id, username = self.user_lookups
+        usernames = dict(User.objects.filter(pk__in={row[user_id] for row in rows})
+                         .values_list('id', 'username'))
+        for row in rows:
+            row[username] = usernames.get(row[user_id])
+
+
+class PostReadSerializer(ShardedUsersMixin, ReadSerializer):
+    # PostSerializer's output for the views listing posts, liked_by_me is
+    # annotated by the views
+    fields = PostSerializer.Meta.fields
+    sources = {'owner': 'owner__username'}
+    user_lookups = ('owner_id', 'owner__username')
+
+    def prepare(self, rows):
+        super().prepare(rows)
+        like_buffer.merge_pending(self.context['request'].user, rows)
+
+
+class PostLikeReadSerializer(ShardedUsersMixin, ReadSerializer):
+    fields = PostLikeSerializer.Meta.fields
+    sources = {'id': 'user_id', 'username': 'user__username'}
+    user_lookups = ('user_id', 'user__username')
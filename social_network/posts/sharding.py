@@ -0,0 +1,156 @@
+from collections import defaultdict
+import random
+import threading
+from time import time
+import zlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+# posts and their likes live on one of POST_SHARDS, picked by a hash of the
+# owner's id. the hash picks one of BUCKETS buckets and the buckets are dealt
+# over the shards, a post's id carries its bucket so the post is found from
+# the id alone, and changing the shards moves buckets without changing ids.
+# everything else, users included, stays on the default database
+
+# 53 bits with the flag below, so the ids are exact as JavaScript numbers
+BUCKET_BITS = 6
+SEQUENCE_BITS = 6
+TIME_BITS = 40
+BUCKETS = 1 << BUCKET_BITS
+
+# set on every id handed out here, ids without it are from before the posts
+# were sharded and are on the default database until rebalanced
+SHARDED_ID = 1 << (TIME_BITS + BUCKET_BITS + SEQUENCE_BITS)
+
+EPOCH_MS = 1609459200000  # 2021-01-01
+
+# inserts of posts whose ids were taken meanwhile by another process
+ID_ATTEMPTS = 5
+
+SHARDED_MODELS = ('post', 'like')
+
+_lock = threading.Lock()
+_last_ms = 0
+_sequence = 0
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def shards():
+    if not enabled():
+        return [None]
+    if settings.POST_SHARDS_READ_DEFAULT:
+        return [*settings.POST_SHARDS, DEFAULT_DB_ALIAS]
+    return list(settings.POST_SHARDS)
+
+
+def bucket_for_owner(owner_id):
+    return zlib.crc32(str(owner_id).encode()) % BUCKETS
+
+
+def is_sharded_id(post_id):
+    return bool(post_id & SHARDED_ID)
+
+
+def shard_for_bucket(bucket, shard_aliases=None):
+    shard_aliases = shard_aliases or settings.POST_SHARDS
+    return shard_aliases[bucket % len(shard_aliases)]
+
+
+# these return None when the posts are not sharded, which leaves the
+# choice of database to the other routers
+
+def shard_for_owner(owner_id):
+    if not enabled():
+        return None
+    return shard_for_bucket(bucket_for_owner(owner_id))
+
+
+def shard_for_post(post_id):
+    if not enabled():
+        return None
+    if not is_sharded_id(post_id):
+        return DEFAULT_DB_ALIAS
+    return shard_for_bucket((post_id >> SEQUENCE_BITS) & (BUCKETS - 1))
+
+
+def group_by_shard(post_ids):
+    groups = defaultdict(list)
+    for post_id in post_ids:
+        groups[shard_for_post(post_id)].append(post_id)
+    return groups
+
+
+def group_owners_by_shard(owner_ids):
+    groups = defaultdict(list)
+    for owner_id in owner_ids:
+        groups[shard_for_owner(owner_id)].append(owner_id)
+    return groups
+
+
+def new_post_id(owner_id):
+    # time ordered like the autoincrement ids. the processes hand them out on
+    # their own, two of them can give the same id to owners of the same bucket
+    # in the same millisecond, the sequence starts at random to make it rarer
+    # and the inserts try again with a new id, see models.insert_sharded
+    global _last_ms, _sequence
+    with _lock:
+        now_ms = max(int(time() * 1000) - EPOCH_MS, _last_ms)
+        if now_ms == _last_ms:
+            _sequence += 1
+            if _sequence == 1 << SEQUENCE_BITS:
+                now_ms += 1
+                _sequence = 0
+        else:
+            _sequence = random.randrange(1 << SEQUENCE_BITS)
+        _last_ms = now_ms
+        return (SHARDED_ID | now_ms << (BUCKET_BITS + SEQUENCE_BITS)
+                | bucket_for_owner(owner_id) << SEQUENCE_BITS | _sequence)
+
+
+def legacy_post_id(post_id, owner_id):
+    # the id a post from before the sharding gets when it's moved, the same
+    # on every run. the old id stands in for the time, which it's far below,
+    # so the moved posts sort before the new ones
+    return (SHARDED_ID | post_id << (BUCKET_BITS + SEQUENCE_BITS)
+            | bucket_for_owner(owner_id) << SEQUENCE_BITS)
+
+
+class ShardRouter:
+    # queries that only name the model go to the default database, the
+    # callers pick the shard with using() when they don't start from an instance
+    def _shard(self, model, hints):
+        instance = hints.get('instance')
+        if (not enabled() or instance is None or model._meta.app_label != 'posts'
+                or model._meta.model_name not in SHARDED_MODELS):
+            return None
+        label = instance._meta.label_lower
+        if label == 'posts.post':
+            if instance.pk is not None:
+                return shard_for_post(instance.pk)
+            return shard_for_owner(instance.owner_id)
+        if label == 'posts.like':
+            return shard_for_post(instance.post_id)
+        if label == settings.AUTH_USER_MODEL.lower() and model._meta.model_name == 'post':
+            return shard_for_owner(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in settings.POST_SHARDS:
+            return None
+        # the shards hold the posts app's tables, the others are never read
+        # there but let deletes cascade without failing
+        return app_label == 'posts'
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+)
+from django.dispatch import receiver
+
+from accounts.models import User
+from posts import search
+from posts.models import (
+    Like,
+    Post,
+    SearchPosting,
+    TimelineEntry,
+)
+from social_network import response_cache
+
+
+@receiver(post_save, sender=Post, dispatch_uid='post_save_invalidate_post_responses')
+@receiver(post_delete, sender=Post, dispatch_uid='post_delete_invalidate_post_responses')
+def invalidate_post_responses(sender, instance, using, **kwargs):
+    response_cache.invalidate('post', instance.pk, using)
+
+
+@receiver(post_delete, sender=Post, dispatch_uid='post_delete_forget_post')
+def forget_post(sender, instance, using, **kwargs):
+    # the timelines and the search index are on the default database, a
+    # delete on a shard can't cascade to them
+    TimelineEntry.objects.filter(post_id=instance.pk).delete()
+    SearchPosting.objects.filter(post_id=instance.pk).delete()
+
+
+@receiver(m2m_changed, sender=Like, dispatch_uid='likes_changed_invalidate_post_responses')
+def invalidate_liked_post_responses(sender, instance, action, reverse, pk_set, **kwargs):
+    # the like views write the through table directly and bump on their own
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        response_cache.invalidate('post', instance.pk)
+    else:
+        for pk in pk_set or []:
+            response_cache.invalidate('post', pk)
+
+
+@receiver(post_save, sender=Post, dispatch_uid='post_save_index_post')
+def index_post(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'title', 'body'} & set(update_fields):
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=User, dispatch_uid='user_delete_delete_sharded_posts')
+def delete_sharded_posts(sender, instance, **kwargs):
+    # the delete of a user cascades on the default database only
+    for shard in settings.POST_SHARDS:
+        if shard != DEFAULT_DB_ALIAS:
+            Like.objects.using(shard).filter(user_id=instance.pk).delete()
+            Post.objects.using(shard).filter(owner_id=instance.pk).delete()
@@ -0,0 +1,19 @@
+from jobs.queue import task
+from . import (
+    sharding,
+    timeline,
+)
+from .models import Post
+
+
+@task
+def fan_out_post(post_id):
+    post = (Post.objects.using(sharding.shard_for_post(post_id)).filter(pk=post_id)
+            .only('id', 'owner_id', 'created_at').first())
+    if post is not None:
+        timeline.fan_out(post)
+
+
+@task
+def backfill_timeline(follower_id, followee_id):
+    timeline.backfill(follower_id, followee_id)
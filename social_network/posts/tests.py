@@ -1,8 +1,80 @@
-from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+import io
+import json
+import math
+import os
+import tempfile
+from unittest import (
+    mock,
+    skipUnless,
+)
 
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import (
+    CommandError,
+    call_command,
+)
+from django.db import (
+    connections,
+    transaction,
+)
 from django.test import (
     Client,
+    RequestFactory,
+    SimpleTestCase,
     TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+
+from accounts.models import (
+    Follow,
+    User,
+)
+from jobs.worker import run_pending
+from social_network import (
+    db_routing,
+    metrics,
+    response_cache,
+)
+from social_network.parsers import (
+    MessagePackParser,
+    ORJSONParser,
+)
+from social_network.renderers import (
+    MessagePackRenderer,
+    ORJSONRenderer,
+    msgpack,
+)
+from . import (
+    bulk,
+    export,
+    like_buffer,
+    likes,
+    rebalance,
+    search,
+    sharding,
+    timeline,
+    trending,
+)
+from .models import (
+    Like,
+    Post,
+    SearchPosting,
+    TimelineEntry,
+)
+from .views import (
+    HomeFeed,
+    PostLikes,
+    PostList,
+    PostSearch,
+    TrendingPosts,
 )
 
 
@@ -14,9 +86,46 @@ POSTS_URL = f'{BASE_URL}/api/posts/'
 POST_URL = f'{BASE_URL}/api/posts/1/'
 LIKE_URL = f'{BASE_URL}/api/posts/1/like/'
 UNLIKE_URL = f'{BASE_URL}/api/posts/1/unlike/'
+LIKES_URL = f'{BASE_URL}/api/posts/1/likes/'
+FEED_URL = f'{BASE_URL}/api/feed/'
+POSTS_BULK_URL = f'{BASE_URL}/api/posts/bulk/'
+LIKES_BULK_URL = f'{BASE_URL}/api/posts/likes/bulk/'
+EXPORT_URL = f'{BASE_URL}/api/export/'
+SEARCH_URL = f'{BASE_URL}/api/posts/search/'
+TRENDING_URL = f'{BASE_URL}/api/posts/trending/'
+METRICS_URL = f'{BASE_URL}/metrics'
+
+
+# the logins of one test would count against the throttles of the next ones
+UNTHROTTLED = override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'login': None, 'signup': None}})
+
+
+# the tests run with the posts sharded too, with POST_SHARD_FILES set, where
+# the posts get ids other than 1, 2... and are found on their shards
 
+def on_every_shard(model=Post):
+    return [row for using in sharding.shards() for row in model.objects.using(using).order_by('pk')]
 
+
+def the_post():
+    [post] = on_every_shard()
+    return post
+
+
+def the_post_url(suffix=''):
+    return f'{POSTS_URL}{the_post().pk}/{suffix}'
+
+
+# the queries a page of posts makes on the default database, sharded it's the
+# owners' one and the page of the posts from before the sharding
+PAGE_QUERIES = 2 if sharding.enabled() and 'default' in sharding.shards() else 1
+
+
+@UNTHROTTLED
 class PostTestCase(TestCase):
+    databases = '__all__'
+
     @mock.patch('accounts.data_enrichment.is_valid_email')
     @mock.patch('accounts.data_enrichment.enrich_geo')
     def setUp(self, enrich_geo, is_valid_email) -> None:
@@ -33,8 +142,8 @@ class PostTestCase(TestCase):
         post = self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                                 HTTP_AUTHORIZATION=self.token)
         self.assertEqual(201, post.status_code)
-        self.assertEqual({'id': 1, 'title': 'title', 'body': 'body',
-                          'owner': 'moshe', 'likes': []},
+        self.assertEqual({'id': the_post().pk, 'title': 'title', 'body': 'body',
+                          'owner': 'moshe', 'like_count': 0, 'liked_by_me': False},
                          post.json())
 
     def test_create_post_post_with_like_doesnt_register_like(self):
@@ -42,8 +151,8 @@ class PostTestCase(TestCase):
                                        'likes': 1},
                                 HTTP_AUTHORIZATION=self.token)
         self.assertEqual(201, post.status_code)
-        self.assertEqual({'id': 1, 'title': 'title', 'body': 'body',
-                          'owner': 'moshe', 'likes': []},
+        self.assertEqual({'id': the_post().pk, 'title': 'title', 'body': 'body',
+                          'owner': 'moshe', 'like_count': 0, 'liked_by_me': False},
                          post.json())
 
     def test_create_post_cant_post_if_not_logged_in(self):
@@ -54,11 +163,43 @@ class PostTestCase(TestCase):
         post1 = self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                                  HTTP_AUTHORIZATION=self.token)
         first = self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token)
-        self.assertEqual([post1.json()], first.json())
+        self.assertEqual([post1.json()], first.json()['results'])
         post2 = self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                                  HTTP_AUTHORIZATION=self.token)
         second = self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token)
-        self.assertEqual([post1.json(), post2.json()], second.json())
+        self.assertEqual([post2.json(), post1.json()], second.json()['results'])
+
+    def test_get_posts_cursor_pagination(self):
+        for i in range(5):
+            self.client.post(POSTS_URL, {'title': f'title {i}', 'body': 'body'},
+                             HTTP_AUTHORIZATION=self.token)
+
+        titles = []
+        url = f'{POSTS_URL}?page_size=2'
+        while url:
+            page = self.client.get(url, HTTP_AUTHORIZATION=self.token).json()
+            self.assertLessEqual(len(page['results']), 2)
+            titles.extend(post['title'] for post in page['results'])
+            url = page['next']
+        self.assertEqual([f'title {i}' for i in reversed(range(5))], titles)
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def test_get_posts_query_count_doesnt_grow(self, is_valid_email):
+        is_valid_email.return_value = True
+        self.client.post(SIGNUP,
+                         {'username': 'moshe1', 'email': 'moshe1@gmail.com',
+                          'password': 'hello'})
+        login = self.client.post(LOGIN,
+                                 {'username': 'moshe1', 'password': 'hello'})
+        token = f"Bearer {login.json()['access']}"
+        for i in range(10):
+            self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
+                             HTTP_AUTHORIZATION=self.token if i % 2 else token)
+
+        # the user comes from the token, the page is the only query
+        with self.assertNumQueries(PAGE_QUERIES):
+            posts = self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(10, len(posts.json()['results']))
 
     def test_get_posts_cant_see_post_if_not_logged_in(self):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
@@ -70,7 +211,7 @@ class PostTestCase(TestCase):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                          HTTP_AUTHORIZATION=self.token)
 
-        delete = self.client.delete(POST_URL, HTTP_AUTHORIZATION=self.token)
+        delete = self.client.delete(the_post_url(), HTTP_AUTHORIZATION=self.token)
         self.assertEqual(204, delete.status_code)
 
     @mock.patch('accounts.data_enrichment.is_valid_email')
@@ -85,25 +226,25 @@ class PostTestCase(TestCase):
         login = self.client.post(LOGIN,
                                  {'username': 'moshe1', 'password': 'hello'})
         token = f"Bearer {login.json()['access']}"
-        delete = self.client.delete(POST_URL, HTTP_AUTHORIZATION=token)
+        delete = self.client.delete(the_post_url(), HTTP_AUTHORIZATION=token)
         self.assertEqual(403, delete.status_code)
 
     def test_delete_post_cant_delete_if_not_logged_in(self):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                          HTTP_AUTHORIZATION=self.token)
 
-        delete = self.client.delete(POST_URL)
+        delete = self.client.delete(the_post_url())
         self.assertEqual(401, delete.status_code)
 
     def test_patch_post_success(self):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                          HTTP_AUTHORIZATION=self.token)
-        patch_result = self.client.patch(POST_URL, {'title': 'this is a title'},
+        patch_result = self.client.patch(the_post_url(), {'title': 'this is a title'},
                                          content_type='application/json',
                                          HTTP_AUTHORIZATION=self.token)
         self.assertEqual(200, patch_result.status_code)
-        self.assertEqual({'title': 'this is a title', 'body': 'body', 'id': 1,
-                          'likes': [], 'owner': 'moshe'},
+        self.assertEqual({'title': 'this is a title', 'body': 'body', 'id': the_post().pk,
+                          'like_count': 0, 'liked_by_me': False, 'owner': 'moshe'},
                          patch_result.json())
 
     @mock.patch('accounts.data_enrichment.is_valid_email')
@@ -118,18 +259,58 @@ class PostTestCase(TestCase):
         login = self.client.post(LOGIN,
                                  {'username': 'moshe1', 'password': 'hello'})
         token = f"Bearer {login.json()['access']}"
-        patch_result = self.client.patch(POST_URL, {'title': 'this is a title'},
+        patch_result = self.client.patch(the_post_url(), {'title': 'this is a title'},
                                          content_type='application/json',
                                          HTTP_AUTHORIZATION=token)
         self.assertEqual(403, patch_result.status_code)
 
+    def test_get_post_is_cached_with_etag(self):
+        self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
+                         HTTP_AUTHORIZATION=self.token)
+        post_url = the_post_url()
+        first = self.client.get(post_url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(200, first.status_code)
+        self.assertIn('Last-Modified', first)
+
+        # served from the cache without loading the user
+        with self.assertNumQueries(0):
+            second = self.client.get(post_url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+        not_modified = self.client.get(post_url, HTTP_AUTHORIZATION=self.token,
+                                       HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(304, not_modified.status_code)
+        not_modified = self.client.get(post_url, HTTP_AUTHORIZATION=self.token,
+                                       HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(304, not_modified.status_code)
+
+    def test_get_post_cache_is_invalidated_on_update(self):
+        self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
+                         HTTP_AUTHORIZATION=self.token)
+        post_url = the_post_url()
+        first = self.client.get(post_url, HTTP_AUTHORIZATION=self.token)
+        self.client.patch(post_url, {'title': 'this is a title'},
+                          content_type='application/json', HTTP_AUTHORIZATION=self.token)
+
+        second = self.client.get(post_url, HTTP_AUTHORIZATION=self.token,
+                                 HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(200, second.status_code)
+        self.assertEqual('this is a title', second.json()['title'])
+
+        self.client.delete(post_url, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(404, self.client.get(post_url, HTTP_AUTHORIZATION=self.token).status_code)
+
     def test_patch_post_cant_patch_if_not_logged_in(self):
         post = self.client.patch(POSTS_URL, {'title': 'title', 'body': 'body'},
                                  content_type='application/json')
         self.assertEqual(401, post.status_code)
 
 
+@UNTHROTTLED
 class LikeTestCase(TestCase):
+    databases = '__all__'
+
     @mock.patch('accounts.data_enrichment.is_valid_email')
     @mock.patch('accounts.data_enrichment.enrich_geo')
     def setUp(self, is_valid_email, enrich_geo) -> None:
@@ -152,34 +333,57 @@ class LikeTestCase(TestCase):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                          HTTP_AUTHORIZATION=self.token_1)
 
-        like = self.client.patch(LIKE_URL, content_type='application/json',
+        like = self.client.patch(the_post_url('like/'), content_type='application/json',
                                  HTTP_AUTHORIZATION=self.token_2)
-        self.assertEqual(200, like.status_code)
-        self.assertEqual({'likes': [2]}, like.json())
+        self.assertEqual(204, like.status_code)
+        self.assertEqual(1, len(on_every_shard(Like)))
+
+    def test_concurrent_unlikes(self):
+        post = Post.objects.create(title='title', body='body', owner_id=1)
+        self.assertTrue(likes.add_like(post.pk, 2))
+        atomic = transaction.atomic
+        raced = []
+
+        # the other unlike gets in between the read of the like and the delete
+        def atomic_after_the_other_unlike(*args, **kwargs):
+            if not raced:
+                raced.append(True)
+                # the like was read outside the transaction, on SQLite a
+                # transaction that reads first can't take the write lock
+                self.assertEqual(['SELECT'], [query['sql'].split()[0] for query in queries])
+                self.assertTrue(likes.remove_like(post.pk, 2))
+            return atomic(*args, **kwargs)
+
+        with CaptureQueriesContext(connections[post._state.db]) as queries:
+            with mock.patch.object(transaction, 'atomic', atomic_after_the_other_unlike):
+                self.assertFalse(likes.remove_like(post.pk, 2))
+        post.refresh_from_db()
+        self.assertEqual(0, post.like_count)
+        self.assertEqual([], on_every_shard(Like))
 
     def test_like_cant_like_your_posts(self):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                          HTTP_AUTHORIZATION=self.token_1)
-        like = self.client.patch(LIKE_URL, content_type='application/json',
+        like = self.client.patch(the_post_url('like/'), content_type='application/json',
                                  HTTP_AUTHORIZATION=self.token_1)
         self.assertEqual(403, like.status_code)
 
     def test_like_cant_like_if_not_logged_in(self):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                          HTTP_AUTHORIZATION=self.token_1)
-        like = self.client.patch(LIKE_URL, content_type='application/json')
+        like = self.client.patch(the_post_url('like/'), content_type='application/json')
         self.assertEqual(401, like.status_code)
 
     def test_unlike_success(self):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
                          HTTP_AUTHORIZATION=self.token_1)
-        like = self.client.patch(LIKE_URL, content_type='application/json',
+        like = self.client.patch(the_post_url('like/'), content_type='application/json',
                                  HTTP_AUTHORIZATION=self.token_2)
 
-        unlike = self.client.patch(UNLIKE_URL, content_type='application/json',
+        unlike = self.client.patch(the_post_url('unlike/'), content_type='application/json',
                                    HTTP_AUTHORIZATION=self.token_2)
-        self.assertEqual(200, unlike.status_code)
-        self.assertEqual({'likes': []}, unlike.json())
+        self.assertEqual(204, unlike.status_code)
+        self.assertEqual(0, len(on_every_shard(Like)))
 
     def test_like_404(self):
         self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
@@ -188,3 +392,973 @@ class LikeTestCase(TestCase):
                                  content_type='application/json',
                                  HTTP_AUTHORIZATION=self.token_2)
         self.assertEqual(404, like.status_code)
+
+    def test_like_count_and_liked_by_me(self):
+        self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
+                         HTTP_AUTHORIZATION=self.token_1)
+        self.client.patch(the_post_url('like/'), content_type='application/json',
+                          HTTP_AUTHORIZATION=self.token_2)
+        self.client.patch(the_post_url('like/'), content_type='application/json',
+                          HTTP_AUTHORIZATION=self.token_2)
+
+        liker_view = self.client.get(the_post_url(), HTTP_AUTHORIZATION=self.token_2).json()
+        self.assertEqual(1, liker_view['like_count'])
+        self.assertTrue(liker_view['liked_by_me'])
+        owner_view = self.client.get(the_post_url(), HTTP_AUTHORIZATION=self.token_1).json()
+        self.assertFalse(owner_view['liked_by_me'])
+
+        self.client.patch(the_post_url('unlike/'), content_type='application/json',
+                          HTTP_AUTHORIZATION=self.token_2)
+        self.client.patch(the_post_url('unlike/'), content_type='application/json',
+                          HTTP_AUTHORIZATION=self.token_2)
+        liker_view = self.client.get(the_post_url(), HTTP_AUTHORIZATION=self.token_2).json()
+        self.assertEqual(0, liker_view['like_count'])
+        self.assertFalse(liker_view['liked_by_me'])
+
+    def test_post_likes(self):
+        self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
+                         HTTP_AUTHORIZATION=self.token_1)
+        self.client.patch(the_post_url('like/'), content_type='application/json',
+                          HTTP_AUTHORIZATION=self.token_2)
+
+        likes = self.client.get(the_post_url('likes/'), HTTP_AUTHORIZATION=self.token_1)
+        self.assertEqual(200, likes.status_code)
+        self.assertEqual([{'id': 2, 'username': 'moshe1'}], likes.json()['results'])
+        self.assertIsNone(likes.json()['next'])
+
+    def test_post_likes_404(self):
+        likes = self.client.get(LIKES_URL, HTTP_AUTHORIZATION=self.token_1)
+        self.assertEqual(404, likes.status_code)
+
+    def test_like_is_idempotent(self):
+        self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
+                         HTTP_AUTHORIZATION=self.token_1)
+        for _ in range(3):
+            like = self.client.put(the_post_url('like/'), content_type='application/json',
+                                   HTTP_AUTHORIZATION=self.token_2)
+            self.assertEqual(204, like.status_code)
+        self.assertEqual(1, the_post().like_count)
+        self.assertEqual(1, len(on_every_shard(Like)))
+
+        for _ in range(2):
+            unlike = self.client.patch(the_post_url('unlike/'), content_type='application/json',
+                                       HTTP_AUTHORIZATION=self.token_2)
+            self.assertEqual(204, unlike.status_code)
+        self.assertEqual(0, the_post().like_count)
+
+    def test_like_queries(self):
+        self.client.post(POSTS_URL, {'title': 'title', 'body': 'body'},
+                         HTTP_AUTHORIZATION=self.token_1)
+        like_url = the_post_url('like/')
+        using = sharding.shard_for_post(the_post().pk) or 'default'
+        # the owner check, the insert and the counter
+        with self.assertNumQueries(3, using=using):
+            self.client.patch(like_url, content_type='application/json',
+                              HTTP_AUTHORIZATION=self.token_2)
+        # a repeated tap doesn't touch the counter
+        with self.assertNumQueries(2, using=using):
+            self.client.patch(like_url, content_type='application/json',
+                              HTTP_AUTHORIZATION=self.token_2)
+
+
+# the tests are a single process, the intents are kept in memory
+@UNTHROTTLED
+@override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_FILE=None, LIKE_FLUSH_INTERVAL=0)
+class WriteBehindLikeTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        like_buffer.reset_store()
+        self.client = Client()
+        is_valid_email.return_value = True
+        for username in ['moshe', 'moshe1']:
+            self.client.post(SIGNUP, {'username': username, 'email': 'moshe@gmail.com',
+                                      'password': 'hello'})
+        login = self.client.post(LOGIN, {'username': 'moshe1', 'password': 'hello'})
+        self.token = f"Bearer {login.json()['access']}"
+        self.post = Post.objects.create(title='title', body='body', owner_id=1)
+
+    def assertSeen(self, like_count, liked_by_me):
+        detail = self.client.get(the_post_url(), HTTP_AUTHORIZATION=self.token).json()
+        listed = self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token).json()['results'][0]
+        for post in [detail, listed]:
+            self.assertEqual((like_count, liked_by_me), (post['like_count'], post['liked_by_me']))
+
+    def test_pending_like_is_seen(self):
+        self.client.patch(the_post_url('like/'), HTTP_AUTHORIZATION=self.token)
+        self.assertEqual([], on_every_shard(Like))
+        self.assertSeen(1, True)
+
+        self.assertEqual(1, like_buffer.flush())
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.like_count)
+        self.assertGreater(self.post.trending_score, 0)
+        self.assertSeen(1, True)
+        self.assertEqual(0, like_buffer.flush())
+
+        self.client.patch(the_post_url('unlike/'), HTTP_AUTHORIZATION=self.token)
+        self.assertSeen(0, False)
+        like_buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual((0, 0.0), (self.post.like_count, self.post.trending_score))
+        self.assertEqual([], on_every_shard(Like))
+
+    def test_last_intent_wins(self):
+        for action in ['like/', 'unlike/', 'like/', 'unlike/']:
+            res = self.client.patch(the_post_url(action), HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(204, res.status_code)
+        self.assertSeen(0, False)
+        self.assertEqual(1, like_buffer.flush())
+        self.assertEqual([], on_every_shard(Like))
+        self.post.refresh_from_db()
+        self.assertEqual(0, self.post.like_count)
+
+    def test_batch(self):
+        User.objects.bulk_create([User(username=f'user{i}', ip='127.0.0.1') for i in range(30)])
+        users = list(User.objects.filter(username__startswith='user'))
+        for user in users:
+            like_buffer.record(self.post.pk, user.pk, True)
+        deleted = Post.objects.create(title='deleted', body='body', owner_id=1)
+        deleted_id = deleted.pk
+        deleted.delete()
+        like_buffer.record(deleted_id, users[0].pk, True)
+        # the posts, the likes already there, an insert a like and the counter
+        with self.assertNumQueries(3 + len(users), using=self.post._state.db):
+            self.assertEqual(31, like_buffer.flush(batch_size=100))
+
+        self.post.refresh_from_db()
+        self.assertEqual(30, self.post.like_count)
+        trending.rebuild()
+        self.assertAlmostEqual(the_post().trending_score, self.post.trending_score)
+
+        for user in users[:10]:
+            like_buffer.record(self.post.pk, user.pk, False)
+        like_buffer.flush(batch_size=3)
+        self.post.refresh_from_db()
+        self.assertEqual(20, self.post.like_count)
+        trending.rebuild()
+        self.assertAlmostEqual(the_post().trending_score, self.post.trending_score)
+
+    def test_intent_changed_while_flushing(self):
+        like_buffer.record(self.post.pk, 2, True)
+        write_intents = like_buffer.write_intents
+
+        def unlike_meanwhile(intents):
+            write_intents(intents)
+            like_buffer.record(self.post.pk, 2, False)
+
+        with mock.patch.object(like_buffer, 'write_intents', unlike_meanwhile):
+            like_buffer.flush()
+        self.assertSeen(0, False)
+        like_buffer.flush()
+        self.assertEqual(0, the_post().like_count)
+
+    def test_counts_what_was_written(self):
+        insert_likes = likes.insert_likes
+
+        # the views get to the like between the read and the writes
+        def raced(view, user_id):
+            def insert(rows, using):
+                with mock.patch.object(likes, 'insert_likes', insert_likes):
+                    view(self.post.pk, user_id)
+                return insert_likes(rows, using)
+            return mock.patch.object(likes, 'insert_likes', insert)
+
+        likes.add_like(self.post.pk, 1)
+        like_buffer.record(self.post.pk, 1, False)
+        with raced(likes.remove_like, 1):
+            like_buffer.flush()
+        like_buffer.record(self.post.pk, 2, True)
+        with raced(likes.add_like, 2):
+            like_buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.like_count)
+        self.assertEqual([2], [like.user_id for like in on_every_shard(Like)])
+
+    def test_shared_by_the_workers(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'likes.sqlite3')
+        # another worker's like, then this one's unlike
+        like_buffer.IntentStore(path).record(self.post.pk, 2, True, timezone.now())
+        with self.settings(LIKE_BUFFER_FILE=path):
+            like_buffer.reset_store()
+            self.addCleanup(like_buffer.reset_store)
+            self.assertSeen(1, True)
+            self.client.patch(the_post_url('unlike/'), HTTP_AUTHORIZATION=self.token)
+            call_command('flush_likes', '--once', stdout=open(os.devnull, 'w'))
+        self.assertEqual([], on_every_shard(Like))
+
+        with self.assertRaises(CommandError):
+            call_command('flush_likes', '--once')
+
+
+@UNTHROTTLED
+class FeedTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.tokens = {}
+        for username in ['moshe', 'moshe1', 'moshe2']:
+            self.client.post(SIGNUP,
+                             {'username': username, 'email': f'{username}@gmail.com',
+                              'password': 'hello'})
+            login = self.client.post(LOGIN, {'username': username, 'password': 'hello'})
+            self.tokens[username] = f"Bearer {login.json()['access']}"
+
+    def follow(self, username, pk, action='follow'):
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.patch(f'{BASE_URL}/api/user_data/{pk}/{action}/',
+                                    content_type='application/json',
+                                    HTTP_AUTHORIZATION=self.tokens[username])
+        run_pending()
+        return res
+
+    def post(self, username, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = self.client.post(POSTS_URL, {'title': title, 'body': 'body'},
+                                    HTTP_AUTHORIZATION=self.tokens[username])
+        run_pending()
+        return post.json()
+
+    def feed_titles(self, username, url=FEED_URL):
+        feed = self.client.get(url, HTTP_AUTHORIZATION=self.tokens[username]).json()
+        return [post['title'] for post in feed['results']], feed['next']
+
+    def test_follow_fans_out_posts(self):
+        self.assertEqual(204, self.follow('moshe', 2).status_code)
+        self.post('moshe1', 'followed')
+        self.post('moshe2', 'not followed')
+        self.post('moshe', 'mine')
+
+        self.assertEqual((['mine', 'followed'], None), self.feed_titles('moshe'))
+        self.assertEqual(1, TimelineEntry.objects.filter(user_id=1).count())
+        self.assertEqual(1, User.objects.get(pk=2).follower_count)
+
+    def test_follow_is_idempotent_and_cant_follow_yourself(self):
+        self.follow('moshe', 2)
+        self.follow('moshe', 2)
+        self.assertEqual(1, User.objects.get(pk=2).follower_count)
+        self.assertEqual(400, self.follow('moshe', 1).status_code)
+        self.assertEqual(404, self.follow('moshe', 10).status_code)
+
+    def test_follow_backfills_and_unfollow_forgets(self):
+        self.post('moshe1', 'old post')
+        self.follow('moshe', 2)
+        self.assertEqual((['old post'], None), self.feed_titles('moshe'))
+
+        self.follow('moshe', 2, action='unfollow')
+        self.assertEqual(([], None), self.feed_titles('moshe'))
+        self.assertEqual(0, User.objects.get(pk=2).follower_count)
+
+    def test_celebrity_posts_are_merged_on_read(self):
+        with self.settings(FEED_CELEBRITY_THRESHOLD=0):
+            self.follow('moshe', 2)
+            self.post('moshe1', 'celebrity post')
+            self.assertFalse(TimelineEntry.objects.exists())
+            self.assertEqual((['celebrity post'], None), self.feed_titles('moshe'))
+
+    def test_feed_pagination(self):
+        self.follow('moshe', 2)
+        with self.settings(FEED_CELEBRITY_THRESHOLD=1):
+            self.follow('moshe2', 2)
+            self.follow('moshe', 3)
+            for i in range(5):
+                self.post('moshe1' if i % 2 else 'moshe2', f'post {i}')
+
+        titles = []
+        url = FEED_URL
+        with self.settings(FEED_PAGE_SIZE=2, FEED_CELEBRITY_THRESHOLD=1):
+            while url:
+                page, url = self.feed_titles('moshe', url)
+                titles.extend(page)
+        self.assertEqual([f'post {i}' for i in reversed(range(5))], titles)
+
+    def test_trim(self):
+        self.follow('moshe', 2)
+        post_ids = [self.post('moshe1', f'post {i}')['id'] for i in range(3)]
+        with self.settings(FEED_TIMELINE_LENGTH=2):
+            self.assertEqual(1, timeline.trim())
+        self.assertEqual(post_ids[:0:-1], list(TimelineEntry.objects.order_by('-created_at')
+                                               .values_list('post_id', flat=True)))
+
+
+@UNTHROTTLED
+class BulkImportTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.tokens = {}
+        for username in ['moshe', 'moshe1']:
+            self.client.post(SIGNUP,
+                             {'username': username, 'email': f'{username}@gmail.com',
+                              'password': 'hello'})
+        # the tokens carry is_staff, so it's set before logging in
+        User.objects.filter(username='moshe').update(is_staff=True)
+        for username in ['moshe', 'moshe1']:
+            login = self.client.post(LOGIN, {'username': username, 'password': 'hello'})
+            self.tokens[username] = f"Bearer {login.json()['access']}"
+
+    def test_bulk_create_posts(self):
+        body = '\n'.join([
+            json.dumps({'title': 'first', 'body': 'body', 'owner': 1}),
+            'not json',
+            json.dumps({'body': 'no title'}),
+            '',
+            json.dumps({'title': 'second', 'body': 'body'}),
+        ])
+        res = self.client.post(POSTS_BULK_URL, body, content_type='application/x-ndjson',
+                               HTTP_AUTHORIZATION=self.tokens['moshe1'])
+        self.assertEqual(200, res.status_code)
+        self.assertEqual(2, res.json()['created'])
+        self.assertEqual([2, 3], [error['line'] for error in res.json()['errors']])
+        self.assertIn('title', res.json()['errors'][1]['errors'])
+        # owners are only taken from the rows of staff imports
+        self.assertEqual({2}, {post.owner_id for post in on_every_shard()})
+
+    def test_bulk_create_posts_staff_sets_owner(self):
+        rows = [{'title': 'first', 'body': 'body', 'owner': 2},
+                {'title': 'second', 'body': 'body', 'owner': 10}]
+        res = self.client.post(POSTS_BULK_URL, rows, content_type='application/json',
+                               HTTP_AUTHORIZATION=self.tokens['moshe'])
+        self.assertEqual(1, res.json()['created'])
+        self.assertEqual([{'line': 2, 'errors': {'owner': ['Unknown user.']}}],
+                         res.json()['errors'])
+        self.assertEqual(2, the_post().owner_id)
+
+    def test_bulk_import_likes(self):
+        post = Post.objects.create(title='title', body='body', owner_id=1)
+        Like.objects.create(post_id=post.pk, user_id=2)
+        # the blank line is counted in the line numbers
+        body = '\n'.join(json.dumps(row) if row else '' for row in [
+            {'post': post.pk, 'user': 2}, None, {'post': post.pk, 'user': 1},
+            {'post': 10, 'user': 1}, {'post': post.pk, 'user': 10}])
+
+        forbidden = self.client.post(LIKES_BULK_URL, body, content_type='application/jsonl',
+                                     HTTP_AUTHORIZATION=self.tokens['moshe1'])
+        self.assertEqual(403, forbidden.status_code)
+
+        res = self.client.post(LIKES_BULK_URL, body, content_type='application/jsonl',
+                               HTTP_AUTHORIZATION=self.tokens['moshe'])
+        # the like of moshe1 was there already
+        self.assertEqual(1, res.json()['imported'])
+        self.assertEqual([4, 5], [error['line'] for error in res.json()['errors']])
+        self.assertEqual(2, the_post().like_count)
+        self.assertEqual(2, len(on_every_shard(Like)))
+        # the imported likes count towards trending right away
+        score = the_post().trending_score
+        self.assertGreater(score, 0)
+        trending.rebuild()
+        self.assertAlmostEqual(score, the_post().trending_score)
+
+    def test_recount_post_without_likes(self):
+        post = Post.objects.create(title='title', body='body', owner_id=1)
+        Post.objects.using(post._state.db).filter(pk=post.pk).update(like_count=3)
+        bulk.recount_likes({post.pk}, post._state.db)
+        post.refresh_from_db()
+        self.assertEqual(0, post.like_count)
+
+    def test_import_commands(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        posts_path = os.path.join(tmp_dir.name, 'posts.jsonl')
+        with open(posts_path, 'w') as f:
+            for i in range(5):
+                f.write(json.dumps({'title': f'title {i}', 'body': 'body', 'owner': 1}) + '\n')
+        devnull = open(os.devnull, 'w')
+        self.addCleanup(devnull.close)
+        call_command('import_posts', posts_path, chunk_size=2, stdout=devnull)
+        posts = on_every_shard()
+        self.assertEqual(5, len(posts))
+
+        likes_path = os.path.join(tmp_dir.name, 'likes.jsonl')
+        with open(likes_path, 'w') as f:
+            f.write(json.dumps({'post': posts[0].pk, 'user': 2}) + '\n')
+        call_command('import_likes', likes_path, stdout=devnull)
+        posts[0].refresh_from_db()
+        self.assertEqual(1, posts[0].like_count)
+
+
+@UNTHROTTLED
+class ExportTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.tokens = {}
+        for username in ['moshe', 'moshe1']:
+            self.client.post(SIGNUP,
+                             {'username': username, 'email': f'{username}@gmail.com',
+                              'password': 'hello'})
+        # the tokens carry is_staff, so it's set before logging in
+        User.objects.filter(username='moshe').update(is_staff=True)
+        for username in ['moshe', 'moshe1']:
+            login = self.client.post(LOGIN, {'username': username, 'password': 'hello'})
+            self.tokens[username] = f"Bearer {login.json()['access']}"
+        self.posts = [Post.objects.create(title=f'title {i}', body='body', owner_id=1)
+                      for i in range(5)]
+        Like.objects.create(post=self.posts[0], user_id=2)
+
+    def test_export_ndjson(self):
+        res = self.client.get(f'{EXPORT_URL}posts/', HTTP_AUTHORIZATION=self.tokens['moshe'])
+        self.assertEqual(200, res.status_code)
+        self.assertEqual('application/x-ndjson', res['Content-Type'])
+        rows = [json.loads(line) for line in b''.join(res.streaming_content).splitlines()]
+        self.assertEqual([post.title for post in on_every_shard()], [row['title'] for row in rows])
+        self.assertEqual(['id', 'title', 'body', 'owner_id', 'like_count', 'created_at'],
+                         list(rows[0]))
+
+    def test_export_csv(self):
+        res = self.client.get(f'{EXPORT_URL}users/?output=csv',
+                              HTTP_AUTHORIZATION=self.tokens['moshe'])
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        self.assertEqual('id,username,email,city,region,country,signup_at_holiday,date_joined',
+                         lines[0])
+        self.assertEqual(3, len(lines))
+        self.assertNotIn('password', lines[0])
+
+    def test_export_is_staff_only(self):
+        res = self.client.get(f'{EXPORT_URL}likes/', HTTP_AUTHORIZATION=self.tokens['moshe1'])
+        self.assertEqual(403, res.status_code)
+        res = self.client.get(f'{EXPORT_URL}passwords/', HTTP_AUTHORIZATION=self.tokens['moshe'])
+        self.assertEqual(404, res.status_code)
+
+    def test_export_walks_chunks(self):
+        rows = list(export.iter_rows('posts', chunk_size=2))
+        self.assertEqual([post.pk for post in on_every_shard()], [row[0] for row in rows])
+
+
+@UNTHROTTLED
+class SearchTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.client.post(SIGNUP,
+                         {'username': 'moshe', 'email': 'moshe@gmail.com',
+                          'password': 'hello'})
+        login = self.client.post(LOGIN, {'username': 'moshe', 'password': 'hello'})
+        self.token = f"Bearer {login.json()['access']}"
+
+    def search(self, url):
+        res = self.client.get(url, HTTP_AUTHORIZATION=self.token)
+        return res.status_code, res.json()
+
+    def test_search_ranks_title_matches_first(self):
+        Post.objects.create(title='cooking', body='a Python recipe for soup', owner_id=1)
+        Post.objects.create(title='Python tips', body='some python', owner_id=1)
+        Post.objects.create(title='soup', body='no snakes here', owner_id=1)
+
+        status_code, res = self.search(f'{SEARCH_URL}?q=python')
+        self.assertEqual(200, status_code)
+        self.assertEqual(['Python tips', 'cooking'], [post['title'] for post in res['results']])
+        res = self.search(f'{SEARCH_URL}?q=python+soup')[1]
+        self.assertEqual(['cooking'], [post['title'] for post in res['results']])
+
+    def test_index_follows_updates_and_deletes(self):
+        post = Post.objects.create(title='old title', body='body', owner_id=1)
+        post.title = 'new title'
+        post.save()
+        self.assertEqual([], search.search('old')[0])
+        self.assertEqual([post.pk], search.search('new')[0])
+        post.delete()
+        self.assertFalse(SearchPosting.objects.exists())
+
+    def test_search_pagination(self):
+        for i in range(5):
+            Post.objects.create(title=f'post {i}', body='match ' * (i + 1), owner_id=1)
+
+        titles = []
+        url = f'{SEARCH_URL}?q=match'
+        with self.settings(SEARCH_PAGE_SIZE=2):
+            while url:
+                res = self.search(url)[1]
+                titles.extend(post['title'] for post in res['results'])
+                url = res['next']
+        self.assertEqual([f'post {i}' for i in reversed(range(5))], titles)
+
+    def test_search_pagination_with_many_terms(self):
+        for i in range(5):
+            Post.objects.create(title=f'post {i}', body='match ' * (i + 1) + 'other', owner_id=1)
+        Post.objects.create(title='tie', body='match other', owner_id=1)
+        Post.objects.create(title='unmatched', body='match match match', owner_id=1)
+
+        titles = []
+        url = f'{SEARCH_URL}?q=match+other'
+        with self.settings(SEARCH_PAGE_SIZE=2):
+            while url:
+                res = self.search(url)[1]
+                titles.extend(post['title'] for post in res['results'])
+                url = res['next']
+        self.assertEqual(['post 4', 'post 3', 'post 2', 'post 1', 'tie', 'post 0'], titles)
+
+    def test_search_reads_the_rarest_term(self):
+        for i in range(30):
+            Post.objects.create(title='common', body='rare' if i % 10 == 0 else 'body', owner_id=1)
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(3, len(search.search('common rare')[0]))
+        # the common postings are only looked up for the posts having the rare term
+        lookups = [query['sql'] for query in queries if "'common'" in query['sql']]
+        self.assertTrue(all('LIMIT' in sql or '"post_id" IN' in sql for sql in lookups))
+        self.assertFalse(any('GROUP BY' in query['sql'] for query in queries))
+
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(20, len(search.search('common')[0]))
+        self.assertEqual(1, len(queries))
+        self.assertIn('LIMIT 20', queries[0]['sql'])
+
+    def test_search_errors(self):
+        self.assertEqual(400, self.search(f'{SEARCH_URL}?q=the')[0])
+        self.assertEqual(400, self.search(f'{SEARCH_URL}?q=post&cursor=nope')[0])
+
+    # a post from before the sharding, on the default database
+    @override_settings(POST_SHARDS_READ_DEFAULT=True)
+    def test_rebuild_index(self):
+        Post.objects.bulk_create([Post(title='imported', body='body', owner_id=1)])
+        SearchPosting.objects.all().delete()
+        call_command('rebuild_search_index', stdout=open(os.devnull, 'w'))
+        self.assertEqual(1, len(search.search('imported')[0]))
+
+
+@UNTHROTTLED
+class TrendingTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        for username in ['moshe', 'moshe1', 'moshe2']:
+            self.client.post(SIGNUP,
+                             {'username': username, 'email': f'{username}@gmail.com',
+                              'password': 'hello'})
+        login = self.client.post(LOGIN, {'username': 'moshe', 'password': 'hello'})
+        self.token = f"Bearer {login.json()['access']}"
+        self.old = Post.objects.create(title='old', body='body', owner_id=1)
+        self.new = Post.objects.create(title='new', body='body', owner_id=1)
+        trending.response_cache.get_cache().delete(trending.TRENDING_KEY)
+
+    def like(self, post, user_id, ago):
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - ago):
+            likes.add_like(post.pk, user_id)
+
+    def scores(self):
+        return {post.title: post.trending_score for post in on_every_shard()}
+
+    def test_newer_likes_outweigh_older_ones(self):
+        with self.settings(TRENDING_HALF_LIFE=3600):
+            self.like(self.old, 2, timedelta(hours=3))
+            self.like(self.old, 3, timedelta(hours=3))
+            self.like(self.new, 2, timedelta(hours=1))
+
+            res = self.client.get(TRENDING_URL, HTTP_AUTHORIZATION=self.token)
+            self.assertEqual(['new', 'old'], [post['title'] for post in res.json()['results']])
+            # two likes two half lives older are worth half of the new one
+            scores = self.scores()
+            self.assertAlmostEqual(math.log(2), scores['new'] - scores['old'], places=4)
+
+    def test_unlike_and_rebuild_agree_with_incremental_scores(self):
+        self.like(self.old, 2, timedelta(hours=1))
+        self.like(self.old, 3, timedelta(hours=2))
+        self.like(self.new, 2, timedelta(days=10))
+        likes.remove_like(self.old.pk, 3)
+        incremental = self.scores()
+
+        self.assertEqual(1, trending.rebuild())
+        rebuilt = self.scores()
+        self.assertAlmostEqual(incremental['old'], rebuilt['old'])
+        self.assertEqual(0, rebuilt['new'])
+
+    def test_unlike_last_like_resets_the_score(self):
+        self.like(self.old, 2, timedelta(hours=1))
+        likes.remove_like(self.old.pk, 2)
+        self.assertEqual(0, self.scores()['old'])
+
+    def test_trending_is_served_from_the_snapshot(self):
+        self.like(self.old, 2, timedelta(hours=1))
+        call_command('refresh_trending', stdout=open(os.devnull, 'w'))
+        self.like(self.new, 2, timedelta(0))
+        with self.assertNumQueries(1):
+            res = self.client.get(TRENDING_URL, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(['old'], [post['title'] for post in res.json()['results']])
+
+
+@UNTHROTTLED
+class MetricsTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.client.post(SIGNUP,
+                         {'username': 'moshe', 'email': 'moshe@gmail.com',
+                          'password': 'hello'})
+        login = self.client.post(LOGIN, {'username': 'moshe', 'password': 'hello'})
+        self.token = f"Bearer {login.json()['access']}"
+        metrics.reset_metrics()
+
+    def test_request_metrics(self):
+        for i in range(3):
+            Post.objects.create(title=f'title {i}', body='body', owner_id=1)
+        self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token)
+
+        body = self.client.get(METRICS_URL).content.decode()
+        self.assertIn('http_request_duration_seconds_count'
+                      '{method="GET",route="api/posts/",status="200"} 1', body)
+        self.assertIn('http_request_db_queries_bucket{method="GET",route="api/posts/",le="0"} 0',
+                      body)
+        if not sharding.enabled():
+            # the page is a single query, sharded it's one a shard and the owners
+            self.assertIn('http_request_db_queries_bucket{method="GET",route="api/posts/",le="1"} 1',
+                          body)
+        self.assertIn('http_request_phase_duration_seconds_count'
+                      '{method="GET",route="api/posts/",phase="serialize"} 1', body)
+        self.assertIn('http_request_phase_duration_seconds_count'
+                      '{method="GET",route="api/posts/",phase="render"} 1', body)
+
+    def test_server_timing(self):
+        res = self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token)
+        self.assertNotIn('Server-Timing', res)
+        with self.settings(METRICS_SERVER_TIMING=True):
+            res = self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token)
+        self.assertRegex(res['Server-Timing'], r'^db;dur=[0-9.]+;desc="[0-9]+ queries", .*total;dur=')
+
+    def test_outbound_calls(self):
+        metrics.observe_outbound('geo', 0.2, 'ok')
+        metrics.observe_outbound('geo', 3, 'error')
+        body = metrics.render_metrics()
+        self.assertIn('outbound_request_duration_seconds_bucket'
+                      '{provider="geo",outcome="ok",le="0.25"} 1', body)
+        self.assertIn('outbound_request_errors_total{provider="geo"} 1', body)
+
+    def test_metrics_token(self):
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(403, self.client.get(METRICS_URL).status_code)
+            res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(200, res.status_code)
+
+    def test_metrics_without_a_token_are_for_the_host_only(self):
+        self.assertEqual(403, self.client.get(METRICS_URL, REMOTE_ADDR='10.0.0.1').status_code)
+        self.assertEqual(200, self.client.get(METRICS_URL, REMOTE_ADDR='::1').status_code)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+@mock.patch.object(db_routing.random, 'choice', lambda replicas: replicas[0])
+class ReplicaRoutingTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        caches['shared'].clear()
+        db_routing._down_until.clear()
+        self.router = db_routing.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read_from(self, request):
+        # the alias the view would have read from
+        middleware = db_routing.ReplicaRoutingMiddleware(
+            lambda request: mock.Mock(status_code=200, db=self.router.db_for_read(Post)))
+        return middleware(request).db
+
+    def test_reads_go_to_a_replica(self):
+        self.assertEqual('replica1', self.read_from(self.factory.get(POSTS_URL)))
+        self.assertEqual('default', self.router.db_for_write(Post))
+        self.assertTrue(self.router.allow_migrate('default', 'posts'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'posts'))
+
+    def test_reads_outside_a_request_stay_on_the_primary(self):
+        # a job reading the user its request just created
+        self.assertEqual('default', self.router.db_for_read(Post))
+
+    def test_replicas_failing_health_checks_are_skipped(self):
+        db_routing.mark_down('replica1')
+        self.assertEqual('replica2', self.read_from(self.factory.get(POSTS_URL)))
+        db_routing.mark_down('replica2')
+        self.assertEqual('default', self.read_from(self.factory.get(POSTS_URL)))
+
+    def test_broken_connections_are_closed(self):
+        connections = {
+            'default': mock.Mock(in_atomic_block=False, **{'is_usable.return_value': True}),
+            'replica1': mock.Mock(in_atomic_block=False, **{'is_usable.return_value': False}),
+        }
+        with mock.patch.object(db_routing, 'connections', connections):
+            self.assertEqual('replica2', self.read_from(self.factory.get(POSTS_URL)))
+            # pinged once a DATABASE_CHECK_INTERVAL, not once a request
+            self.read_from(self.factory.get(POSTS_URL))
+        connections['replica1'].close.assert_called_once_with()
+        connections['default'].close.assert_not_called()
+        self.assertEqual(1, connections['default'].is_usable.call_count)
+
+    def test_cached_responses_are_built_from_the_primary(self):
+        router = self.router
+
+        class View(response_cache.CachedRetrieveMixin):
+            cache_name = 'post'
+
+            def get_object(self):
+                return mock.Mock(pk=1, db=router.db_for_read(Post))
+
+            def get_serializer(self, instance):
+                return mock.Mock(data={'db': instance.db})
+
+        # every client gets the cached post, not only the one that wrote it
+        middleware = db_routing.ReplicaRoutingMiddleware(
+            lambda request: mock.Mock(status_code=200, entry=View().build_entry()))
+        entry = middleware(self.factory.get(POSTS_URL)).entry
+        self.assertEqual({'db': 'default'}, entry['data'])
+
+    def test_writers_read_their_writes(self):
+        token = 'Bearer header.eyJ1c2VyX2lkIjoxfQ.signature'  # {"user_id":1}
+        self.assertEqual('replica1', self.read_from(self.factory.get(POSTS_URL,
+                                                                     HTTP_AUTHORIZATION=token)))
+        self.assertEqual('default', self.read_from(self.factory.patch(LIKE_URL,
+                                                                      HTTP_AUTHORIZATION=token)))
+        # only the client that wrote is stuck to the primary, until the window ends
+        self.assertEqual('default', self.read_from(self.factory.get(POSTS_URL,
+                                                                    HTTP_AUTHORIZATION=token)))
+        self.assertEqual('replica1', self.read_from(self.factory.get(POSTS_URL)))
+        caches['shared'].clear()
+        self.assertEqual('replica1', self.read_from(self.factory.get(POSTS_URL,
+                                                                     HTTP_AUTHORIZATION=token)))
+
+
+@override_settings(POST_SHARDS=['shard1', 'shard2'])
+class ShardingTestCase(SimpleTestCase):
+    def test_ids_say_where_the_post_is(self):
+        for owner_id in range(1, 20):
+            post_id = sharding.new_post_id(owner_id)
+            self.assertTrue(sharding.is_sharded_id(post_id))
+            self.assertEqual(sharding.shard_for_owner(owner_id), sharding.shard_for_post(post_id))
+        self.assertEqual({'shard1', 'shard2'},
+                         {sharding.shard_for_owner(owner_id) for owner_id in range(1, 20)})
+
+    def test_ids_grow(self):
+        post_ids = [sharding.new_post_id(1) for _ in range(5000)]
+        self.assertEqual(post_ids, sorted(set(post_ids)))
+        # JavaScript clients read them as doubles
+        self.assertLess(post_ids[-1], 2 ** 53)
+
+    def test_posts_from_before_the_sharding_are_on_the_default_database(self):
+        self.assertEqual('default', sharding.shard_for_post(1))
+        with self.settings(POST_SHARDS=[]):
+            self.assertIsNone(sharding.shard_for_post(sharding.new_post_id(1)))
+
+    def test_moved_posts_keep_their_order(self):
+        post_ids = [sharding.legacy_post_id(post_id, owner_id)
+                    for post_id, owner_id in [(1, 3), (2, 1), (1000000, 2)]]
+        self.assertEqual(post_ids, sorted(post_ids))
+        self.assertEqual(post_ids[0], sharding.legacy_post_id(1, 3))
+        self.assertEqual(sharding.shard_for_owner(3), sharding.shard_for_post(post_ids[0]))
+        self.assertLess(post_ids[-1], sharding.new_post_id(1))
+
+
+@UNTHROTTLED
+@skipUnless(len(settings.POST_SHARDS) > 1, 'set POST_SHARD_FILES to two SQLite files or more')
+class ShardedPostsTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        self.tokens = {}
+        for username in ['moshe', 'moshe1', 'moshe2', 'moshe3']:
+            self.client.post(SIGNUP, {'username': username, 'email': 'moshe@gmail.com',
+                                      'password': 'hello'})
+            login = self.client.post(LOGIN, {'username': username, 'password': 'hello'})
+            self.tokens[username] = f"Bearer {login.json()['access']}"
+        # the owners of the posts hash to different shards
+        self.owners = ['moshe', 'moshe3']
+        self.assertNotEqual(sharding.shard_for_owner(1), sharding.shard_for_owner(4))
+
+    def create_post(self, username, title='title'):
+        res = self.client.post(POSTS_URL, {'title': title, 'body': 'body'},
+                               HTTP_AUTHORIZATION=self.tokens[username])
+        return res.json()['id']
+
+    def test_posts_are_on_their_owners_shard(self):
+        for owner_id, username in [(1, 'moshe'), (4, 'moshe3')]:
+            post_id = self.create_post(username)
+            shard = sharding.shard_for_owner(owner_id)
+            self.assertTrue(Post.objects.using(shard).filter(pk=post_id, owner_id=owner_id).exists())
+            res = self.client.get(f'{POSTS_URL}{post_id}/', HTTP_AUTHORIZATION=self.tokens['moshe1'])
+            self.assertEqual(username, res.json()['owner'])
+
+    def test_id_taken_by_another_process(self):
+        post_id = self.create_post('moshe')
+        new_post_id = sharding.new_post_id
+        taken = iter([post_id])
+        with mock.patch.object(sharding, 'new_post_id',
+                               lambda owner_id: next(taken, None) or new_post_id(owner_id)):
+            other_id = self.create_post('moshe')
+        self.assertNotEqual(post_id, other_id)
+        self.assertEqual(2, Post.objects.using(sharding.shard_for_owner(1)).count())
+
+    def test_likes_are_next_to_their_post(self):
+        post_id = self.create_post('moshe')
+        shard = sharding.shard_for_post(post_id)
+        like = self.client.patch(f'{POSTS_URL}{post_id}/like/', content_type='application/json',
+                                 HTTP_AUTHORIZATION=self.tokens['moshe3'])
+        self.assertEqual(204, like.status_code)
+        self.assertEqual(1, Post.objects.using(shard).get(pk=post_id).like_count)
+        self.assertTrue(Like.objects.using(shard).filter(post_id=post_id, user_id=4).exists())
+        res = self.client.get(f'{POSTS_URL}{post_id}/', HTTP_AUTHORIZATION=self.tokens['moshe3'])
+        self.assertTrue(res.json()['liked_by_me'])
+
+        self.client.patch(f'{POSTS_URL}{post_id}/unlike/', content_type='application/json',
+                          HTTP_AUTHORIZATION=self.tokens['moshe3'])
+        self.assertEqual(0, Post.objects.using(shard).get(pk=post_id).like_count)
+
+    def test_list_merges_the_shards(self):
+        post_ids = [self.create_post(username, f'title {i}')
+                    for i, username in enumerate(self.owners * 2)]
+        res = self.client.get(POSTS_URL, {'page_size': 3}, HTTP_AUTHORIZATION=self.tokens['moshe1'])
+        page = res.json()
+        self.assertEqual(post_ids[:0:-1], [post['id'] for post in page['results']])
+
+        res = self.client.get(page['next'], HTTP_AUTHORIZATION=self.tokens['moshe1'])
+        self.assertEqual([post_ids[0]], [post['id'] for post in res.json()['results']])
+        self.assertIsNone(res.json()['next'])
+
+    def test_rebalance(self):
+        # a post from before the sharding, still on the default database
+        Post.objects.using('default').bulk_create(
+            [Post(pk=7, title='title', body='body', owner_id=4, created_at=timezone.now())])
+        Like.objects.using('default').create(post_id=7, user_id=1)
+        TimelineEntry.objects.create(user_id=2, post_id=7, author_id=4, created_at=timezone.now())
+
+        call_command('rebalance_posts', stdout=open(os.devnull, 'w'))
+        shard = sharding.shard_for_owner(4)
+        post = Post.objects.using(shard).get(owner_id=4)
+        self.assertTrue(sharding.is_sharded_id(post.pk))
+        self.assertFalse(Post.objects.using('default').filter(pk=7).exists())
+        self.assertTrue(Like.objects.using(shard).filter(post_id=post.pk, user_id=1).exists())
+        self.assertEqual(post.pk, TimelineEntry.objects.get(user_id=2).post_id)
+
+    def test_rebalance_again_after_a_crash(self):
+        Post.objects.using('default').bulk_create(
+            [Post(pk=7, title='title', body='body', owner_id=4, created_at=timezone.now())])
+        # the post is copied, the crash leaves the old one behind
+        with mock.patch.object(rebalance.response_cache, 'invalidate', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('rebalance_posts', stdout=open(os.devnull, 'w'))
+        self.assertTrue(Post.objects.using('default').filter(pk=7).exists())
+
+        call_command('rebalance_posts', stdout=open(os.devnull, 'w'))
+        shard = sharding.shard_for_owner(4)
+        self.assertEqual([sharding.legacy_post_id(7, 4)],
+                         list(Post.objects.using(shard).values_list('pk', flat=True)))
+        self.assertFalse(Post.objects.using('default').filter(pk=7).exists())
+
+
+@UNTHROTTLED
+class ReadSerializerTestCase(TestCase):
+    databases = '__all__'
+
+    @mock.patch('accounts.data_enrichment.is_valid_email')
+    def setUp(self, is_valid_email) -> None:
+        self.client = Client()
+        is_valid_email.return_value = True
+        for username in ['moshe', 'משה']:
+            self.client.post(SIGNUP, {'username': username, 'email': 'moshe@gmail.com',
+                                      'password': 'hello'})
+        login = self.client.post(LOGIN, {'username': 'moshe', 'password': 'hello'})
+        self.token = f"Bearer {login.json()['access']}"
+        for i in range(5):
+            post = Post.objects.create(title=f'כותרת {i}', body='body "quoted"', owner_id=2)
+            search.index_post(post)
+            if i % 2:
+                likes.add_like(post.pk, 1)
+        trending.snapshot()
+
+    def assertSameOutput(self, view, url, params=None):
+        # byte for byte what the model serializers render
+        fast = self.client.get(url, params, HTTP_AUTHORIZATION=self.token)
+        with mock.patch.object(view, 'read_serializer_class', None):
+            slow = self.client.get(url, params, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(200, fast.status_code)
+        self.assertEqual(slow.content, fast.content)
+        return fast.json()
+
+    def test_same_output(self):
+        posts = self.assertSameOutput(PostList, POSTS_URL, {'page_size': 3})
+        self.assertEqual([False, True, False], [post['liked_by_me'] for post in posts['results']])
+        self.assertSameOutput(PostList, posts['next'])
+        self.assertSameOutput(PostSearch, SEARCH_URL, {'q': 'body'})
+        self.assertSameOutput(TrendingPosts, TRENDING_URL)
+        self.assertSameOutput(PostLikes, f'{POSTS_URL}{on_every_shard()[1].pk}/likes/')
+        Follow.objects.create(follower_id=1, followee_id=2)
+        for post in on_every_shard():
+            timeline.fan_out(post)
+        self.assertSameOutput(HomeFeed, FEED_URL)
+
+    def test_list_is_one_query(self):
+        with self.assertNumQueries(PAGE_QUERIES):
+            self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token)
+
+    @skipUnless(msgpack, 'needs msgpack')
+    def test_msgpack(self):
+        res = self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token,
+                              HTTP_ACCEPT='application/msgpack')
+        self.assertEqual('application/msgpack', res['Content-Type'])
+        self.assertEqual(self.client.get(POSTS_URL, HTTP_AUTHORIZATION=self.token).json(),
+                         msgpack.unpackb(res.content))
+
+        created = self.client.post(POSTS_URL, msgpack.packb({'title': 'title', 'body': 'body'}),
+                                   content_type='application/msgpack',
+                                   HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(201, created.status_code)
+        self.assertEqual('title', created.json()['title'])
+
+
+class RendererTestCase(TestCase):
+    data = {
+        'created_at': timezone.now(),
+        'price': Decimal('1.10'),
+        'title': gettext_lazy('כותרת'),
+        'separators': 'a\u2028b\u2029c',
+        1: [None, True, 1.5],
+    }
+
+    def test_same_output_as_json(self):
+        for context in [{}, {'indent': 2}, {'indent': 4}]:
+            self.assertEqual(JSONRenderer().render(self.data, renderer_context=context),
+                             ORJSONRenderer().render(self.data, renderer_context=context))
+        self.assertEqual(b'', ORJSONRenderer().render(None))
+
+    def test_big_int(self):
+        self.assertEqual(b'{"id":18446744073709551616}',
+                         ORJSONRenderer().render({'id': 2 ** 64}))
+
+    def test_non_finite_floats(self):
+        for data in [{'score': float('nan')}, {'scores': [1.5, float('inf')]}]:
+            for renderer in [JSONRenderer(), ORJSONRenderer()]:
+                with self.assertRaises(ValueError):
+                    renderer.render(data)
+
+    def test_parse(self):
+        parser = ORJSONParser()
+        self.assertEqual({'title': 'כותרת'},
+                         parser.parse(io.BytesIO('{"title": "כותרת"}'.encode())))
+        for body in [b'{"title": ', b'{"count": NaN}']:
+            with self.assertRaises(ParseError):
+                parser.parse(io.BytesIO(body))
+
+    @skipUnless(msgpack, 'needs msgpack')
+    def test_msgpack_round_trip(self):
+        data = {'id': 1, 'created_at': self.data['created_at']}
+        body = MessagePackRenderer().render(data)
+        self.assertEqual(json.loads(JSONRenderer().render(data)),
+                         MessagePackParser().parse(io.BytesIO(body)))
+        with self.assertRaises(ParseError):
+            MessagePackParser().parse(io.BytesIO(b'\xc1'))
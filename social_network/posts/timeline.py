@@ -0,0 +1,122 @@
+import base64
+from datetime import datetime
+import heapq
+
+from django.conf import settings
+from django.db.models import (
+    Count,
+    Q,
+)
+
+from accounts.models import (
+    Follow,
+    User,
+)
+from . import sharding
+from .models import (
+    Post,
+    TimelineEntry,
+)
+
+
+# accounts with more followers than FEED_CELEBRITY_THRESHOLD are not fanned
+# out on write, their posts are merged into the timeline when it's read
+
+
+def is_celebrity(follower_count):
+    return follower_count > settings.FEED_CELEBRITY_THRESHOLD
+
+
+def fan_out(post):
+    if is_celebrity(User.objects.values_list('follower_count', flat=True).get(pk=post.owner_id)):
+        return 0
+
+    followers = (Follow.objects.filter(followee_id=post.owner_id)
+                 .values_list('follower_id', flat=True).iterator(chunk_size=1000))
+    entries = [TimelineEntry(user_id=follower_id, post_id=post.pk, author_id=post.owner_id,
+                             created_at=post.created_at)
+               for follower_id in followers]
+    TimelineEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+    return len(entries)
+
+
+def backfill(follower_id, followee_id):
+    followee = User.objects.only('follower_count').get(pk=followee_id)
+    if is_celebrity(followee.follower_count):
+        return
+    posts = (Post.objects.using(sharding.shard_for_owner(followee_id))
+             .filter(owner_id=followee_id).order_by('-created_at', '-id')
+             .values_list('id', 'created_at')[:settings.FEED_TIMELINE_LENGTH])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=follower_id, post_id=post_id, author_id=followee_id,
+                       created_at=created_at)
+         for post_id, created_at in posts],
+        ignore_conflicts=True)
+
+
+def forget(follower_id, followee_id):
+    TimelineEntry.objects.filter(user_id=follower_id, author_id=followee_id).delete()
+
+
+def trim():
+    # keeps the newest FEED_TIMELINE_LENGTH entries of every timeline
+    length = settings.FEED_TIMELINE_LENGTH
+    trimmed = 0
+    overflowing = (TimelineEntry.objects.values('user_id').order_by()
+                   .annotate(entries=Count('*')).filter(entries__gt=length)
+                   .values_list('user_id', flat=True))
+    for user_id in overflowing.iterator():
+        entries = TimelineEntry.objects.filter(user_id=user_id).order_by('-created_at', '-post_id')
+        oldest_kept = entries.values_list('created_at', 'post_id')[length - 1]
+        trimmed += entries.filter(before(*oldest_kept, field='post_id')).delete()[0]
+    return trimmed
+
+
+def before(created_at, post_id, field='id'):
+    return Q(created_at__lt=created_at) | Q(created_at=created_at, **{f'{field}__lt': post_id})
+
+
+def encode_cursor(created_at, post_id):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{post_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def home_timeline(user, cursor=None, page_size=None):
+    # merges the fanned out entries with the newest posts of the celebrities
+    # the user follows and of the user, each source is read at most a page deep
+    page_size = page_size or settings.FEED_PAGE_SIZE
+
+    entries = TimelineEntry.objects.filter(user_id=user.pk)
+    pulled_owners = [user.pk] + list(
+        Follow.objects.filter(follower_id=user.pk,
+                              followee__follower_count__gt=settings.FEED_CELEBRITY_THRESHOLD)
+        .values_list('followee_id', flat=True))
+    if cursor is not None:
+        entries = entries.filter(before(*cursor, field='post_id'))
+    sources = [
+        entries.order_by('-created_at', '-post_id').values_list('created_at', 'post_id')[:page_size],
+    ]
+    # one source per shard when the posts are sharded
+    for shard, owners in sharding.group_owners_by_shard(pulled_owners).items():
+        pulled = Post.objects.using(shard).filter(owner_id__in=owners)
+        if cursor is not None:
+            pulled = pulled.filter(before(*cursor))
+        sources.append(
+            pulled.order_by('-created_at', '-id').values_list('created_at', 'id')[:page_size])
+
+    page = []
+    for item in heapq.merge(*sources, reverse=True):
+        if not page or page[-1] != item:
+            page.append(item)
+        if len(page) == page_size:
+            break
+
+    next_cursor = encode_cursor(*page[-1]) if len(page) == page_size else None
+    return [post_id for _, post_id in page], next_cursor
@@ -0,0 +1,134 @@
+from datetime import (
+    datetime,
+    timezone as dt_timezone,
+)
+import heapq
+import itertools
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Case,
+    F,
+    FloatField,
+    Value,
+    When,
+)
+from django.db.models.functions import (
+    Abs,
+    Exp,
+    Greatest,
+    Least,
+    Ln,
+)
+from django.utils import timezone
+
+from social_network import response_cache
+from . import sharding
+from .models import (
+    Like,
+    Post,
+)
+
+
+# a like is worth twice as much as one a TRENDING_HALF_LIFE older. instead of
+# decaying every score as time goes by, newer likes weigh exponentially more
+# and Post.trending_score keeps the log of the sum, which only changes when
+# a post is liked or unliked and still orders the posts by their decayed likes.
+# 0 stands for no likes, a single like from EPOCH on is worth far more
+
+EPOCH = datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+
+# exp() of anything below it underflows on some backends
+MIN_EXPONENT = -700.0
+
+TRENDING_KEY = 'trending'
+
+
+def like_score(created_at):
+    return (created_at - EPOCH).total_seconds() * math.log(2) / settings.TRENDING_HALF_LIFE
+
+
+def logaddexp(a, b):
+    return max(a, b) + math.log1p(math.exp(-abs(a - b)))
+
+
+def _float(value):
+    return Value(value, output_field=FloatField())
+
+
+def added(score):
+    # log(exp(trending_score) + exp(score))
+    current = F('trending_score')
+    return (Greatest(current, _float(score))
+            + Ln(_float(1.0) + Exp(Greatest(-Abs(current - score), _float(MIN_EXPONENT)))))
+
+
+def removed(score, count=1):
+    # log(exp(trending_score) - exp(score)), back to no likes with the last
+    # count of them
+    current = F('trending_score')
+    remaining = _float(1.0) - Exp(Least(Greatest(_float(score) - current, _float(MIN_EXPONENT)),
+                                        _float(0.0)))
+    return Case(
+        When(like_count__lte=count, then=_float(0.0)),
+        default=Greatest(current + Ln(Greatest(remaining, _float(math.exp(MIN_EXPONENT)))),
+                         _float(0.0)),
+    )
+
+
+def _scores(likes):
+    # the (post_id, created_at) of likes, summed up per post
+    scores = {}
+    for post_id, created_at in likes:
+        scores[post_id] = logaddexp(scores.get(post_id, 0.0), like_score(created_at))
+    return scores
+
+
+def rescore(post_ids, using=None):
+    # rebuild() for some posts of a database, after their likes were written
+    # in bulk
+    since = timezone.now() - settings.TRENDING_WINDOW
+    scores = _scores(Like.objects.using(using).filter(post_id__in=post_ids, created_at__gte=since)
+                     .values_list('post_id', 'created_at'))
+    Post.objects.using(using).bulk_update(
+        [Post(pk=post_id, trending_score=scores.get(post_id, 0.0)) for post_id in post_ids],
+        ['trending_score'], batch_size=1000)
+
+
+def rebuild():
+    # recomputes the scores from the likes of the last TRENDING_WINDOW, which
+    # drops the posts nobody liked lately and the float drift of the unlikes
+    since = timezone.now() - settings.TRENDING_WINDOW
+    scored = 0
+    # a post and its likes are on the same shard
+    for shard in sharding.shards():
+        scores = _scores(Like.objects.using(shard).filter(created_at__gte=since)
+                         .values_list('post_id', 'created_at').iterator(chunk_size=2000))
+
+        with transaction.atomic(using=shard):
+            Post.objects.using(shard).filter(trending_score__gt=0).update(trending_score=0)
+            Post.objects.using(shard).bulk_update([Post(pk=post_id, trending_score=score)
+                                                   for post_id, score in scores.items()],
+                                                  ['trending_score'], batch_size=1000)
+        scored += len(scores)
+    return scored
+
+
+def snapshot():
+    # the trending_score index hands back the top posts without aggregating
+    # and the top of every shard is merged
+    tops = [Post.objects.using(shard).filter(trending_score__gt=0).order_by('-trending_score')
+            .values_list('trending_score', 'id')[:settings.TRENDING_SIZE]
+            for shard in sharding.shards()]
+    top = [post_id for _, post_id in heapq.nlargest(settings.TRENDING_SIZE, itertools.chain(*tops))]
+    response_cache.get_cache().set(TRENDING_KEY, top, settings.TRENDING_CACHE_TIMEOUT)
+    return top
+
+
+def top_posts():
+    top = response_cache.get_cache().get(TRENDING_KEY)
+    if top is None:
+        top = snapshot()
+    return top
@@ -1,50 +1,329 @@
-from rest_framework import generics
-from rest_framework.permissions import IsAuthenticated
+import heapq
+import itertools
+from operator import (
+    attrgetter,
+    itemgetter,
+)
+
+from django.conf import settings
+from django.db.models import (
+    Exists,
+    OuterRef,
+)
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import (
+    generics,
+    status,
+)
+from rest_framework.permissions import (
+    IsAdminUser,
+    IsAuthenticated,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
-from .models import Post
+from jobs.queue import enqueue
+from social_network.parsers import (
+    JSONLinesParser,
+    NDJSONParser,
+    NumberedRows,
+    ORJSONParser,
+)
+from social_network.read_serializers import ReadListMixin
+from social_network.response_cache import CachedRetrieveMixin
+from . import (
+    bulk,
+    export,
+    like_buffer,
+    likes,
+    search,
+    sharding,
+    timeline,
+    trending,
+)
+from .models import (
+    Like,
+    Post,
+)
+from .pagination import (
+    LikeCursorPagination,
+    PostCursorPagination,
+)
 from .permissions import (
     IsOwnerOrReadOnly,
     IsNotOwnerAndAuthenticatedOrReadOnly,
 )
 from .serializers import (
+    PostLikeReadSerializer,
+    PostLikeSerializer,
+    PostReadSerializer,
     PostSerializer,
-    LikeSerializer,
 )
+from .tasks import fan_out_post
+
+
+def with_liked_by_me(queryset, user):
+    if not user.is_authenticated:
+        return queryset
+    return queryset.annotate(liked_by_me=Exists(
+        Like.objects.filter(post_id=OuterRef('pk'), user_id=user.pk)))
+
+
+def post_queryset(user, using=None):
+    # sharded posts are away from their owners, who are then fetched from
+    # the default database instead of joined
+    queryset = Post.objects.using(using)
+    if sharding.enabled():
+        queryset = queryset.prefetch_related('owner')
+    else:
+        queryset = queryset.select_related('owner')
+    return with_liked_by_me(queryset, user)
+
+
+def posts_in_bulk(user, post_ids, read_serializer_class=None):
+    # the posts, or their rows for read_serializer_class, by id
+    posts = {}
+    for shard, shard_post_ids in sharding.group_by_shard(post_ids).items():
+        queryset = post_queryset(user, shard)
+        if read_serializer_class is None:
+            posts.update(queryset.in_bulk(shard_post_ids))
+        else:
+            rows = read_serializer_class.values(queryset.filter(pk__in=shard_post_ids))
+            posts.update((row['id'], row) for row in rows)
+    return posts
+
 
+class PostsByIdMixin:
+    # for the views serving the posts their ids were picked by
+    read_serializer_class = None
 
-class PostList(generics.ListCreateAPIView):
-    queryset = Post.objects.all()
+    def serialize_posts(self, request, post_ids):
+        posts = posts_in_bulk(request.user, post_ids, self.read_serializer_class)
+        serializer_class = self.read_serializer_class or PostSerializer
+        serializer = serializer_class([posts[pk] for pk in post_ids if pk in posts], many=True,
+                                      context={'request': request})
+        return serializer.data
+
+
+class PostList(ReadListMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = PostSerializer
+    read_serializer_class = PostReadSerializer
+    pagination_class = PostCursorPagination
+
+    def get_queryset(self):
+        # the owner is joined and the likes come from like_count and the
+        # liked_by_me annotation, so a page is a single query
+        return post_queryset(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        if not sharding.enabled():
+            return super().list(request, *args, **kwargs)
+
+        # every shard is read a page deep from the cursor and the pages are
+        # merged, the cursor is the (created_at, id) of the last post
+        cursor = request.query_params.get('cursor')
+        if cursor is not None:
+            cursor = timeline.decode_cursor(cursor)
+            if cursor is None:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        page_size = self.paginator.get_page_size(request)
+        pages = []
+        for shard in sharding.shards():
+            queryset = self.get_queryset().using(shard)
+            if cursor is not None:
+                queryset = queryset.filter(timeline.before(*cursor))
+            queryset = queryset.order_by('-created_at', '-id')
+            if self.read_serializer_class is not None:
+                queryset = self.read_serializer_class.values(queryset, 'created_at')
+            pages.append(queryset[:page_size])
+        position = (attrgetter('created_at', 'pk') if self.read_serializer_class is None
+                    else itemgetter('created_at', 'id'))
+        page = list(itertools.islice(heapq.merge(*pages, key=position, reverse=True), page_size))
+
+        next_url = None
+        if len(page) == page_size:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor',
+                                           timeline.encode_cursor(*position(page[-1])))
+        if self.read_serializer_class is None:
+            serializer = self.get_serializer(page, many=True)
+        else:
+            serializer = self.read_serializer_class(page, many=True,
+                                                    context=self.get_serializer_context())
+        return Response({'next': next_url, 'previous': None, 'results': serializer.data})
 
     def perform_create(self, serializer):
         user = self.request.user
-        serializer.save(owner=user)
+        post = serializer.save(owner=user)
+        enqueue(fan_out_post, post_id=post.pk)
 
 
-class PostDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Post.objects.all()
-    permission_classes = [IsOwnerOrReadOnly]
+class PostDetail(CachedRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
+    # reads are served from the response cache, everyone may read a post
+    # so skipping the object permissions on a hit is safe
+    permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
     serializer_class = PostSerializer
+    cache_name = 'post'
 
+    def get_queryset(self):
+        return post_queryset(self.request.user, sharding.shard_for_post(self.kwargs['pk']))
 
-class LikeUpdate(generics.UpdateAPIView):
-    queryset = Post.objects.all()
-    permission_classes = [IsNotOwnerAndAuthenticatedOrReadOnly]
-    serializer_class = LikeSerializer
+    def cache_dependencies(self, instance):
+        # the owner's username is part of the post
+        return [('post', instance.pk), ('user', instance.owner_id)]
 
-    def perform_update(self, serializer):
-        user = self.request.user
-        post = Post.objects.get(pk=self.kwargs.get('pk'))
-        post.likes.add(user)
+    def shared_data(self, data):
+        del data['liked_by_me']
+        return data
 
+    def personalize(self, request, data):
+        data['liked_by_me'] = likes.is_liked(data['id'], request.user.pk)
+        like_buffer.merge_pending(request.user, [data])
+        return data
 
-class UnLikeUpdate(generics.UpdateAPIView):
-    queryset = Post.objects.all()
+
+class PostLikes(ReadListMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = PostLikeSerializer
+    read_serializer_class = PostLikeReadSerializer
+    pagination_class = LikeCursorPagination
+
+    def get_queryset(self):
+        using = sharding.shard_for_post(self.kwargs['pk'])
+        post = get_object_or_404(Post.objects.using(using).only('pk'), pk=self.kwargs['pk'])
+        likes = Like.objects.using(using).filter(post_id=post.pk)
+        if sharding.enabled():
+            return likes.prefetch_related('user')
+        return likes.select_related('user')
+
+
+class LikeUpdate(APIView):
     permission_classes = [IsNotOwnerAndAuthenticatedOrReadOnly]
-    serializer_class = LikeSerializer
 
-    def perform_update(self, serializer, *args, **kwargs):
-        user = self.request.user
-        post = Post.objects.get(pk=self.kwargs.get('pk'))
-        post.likes.remove(user)
+    def get_object(self):
+        post = get_object_or_404(
+            Post.objects.using(sharding.shard_for_post(self.kwargs['pk'])).only('id', 'owner_id'),
+            pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, post)
+        return post
+
+    def patch(self, request, pk):
+        post = self.get_object()
+        if settings.LIKE_WRITE_BEHIND:
+            like_buffer.record(post.pk, request.user.pk, True)
+        else:
+            likes.add_like(post.pk, request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    put = patch
+
+
+class UnLikeUpdate(LikeUpdate):
+    def patch(self, request, pk):
+        post = self.get_object()
+        if settings.LIKE_WRITE_BEHIND:
+            like_buffer.record(post.pk, request.user.pk, False)
+        else:
+            likes.remove_like(post.pk, request.user.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    put = patch
+
+
+class HomeFeed(PostsByIdMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    read_serializer_class = PostReadSerializer
+
+    def get(self, request):
+        cursor = request.query_params.get('cursor')
+        if cursor is not None:
+            cursor = timeline.decode_cursor(cursor)
+            if cursor is None:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        post_ids, next_cursor = timeline.home_timeline(request.user, cursor)
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        return Response({'next': next_url, 'results': self.serialize_posts(request, post_ids)})
+
+
+class PostSearch(PostsByIdMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    read_serializer_class = PostReadSerializer
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        if not search.query_terms(query):
+            return Response({'error': 'Nothing to search for'}, status=status.HTTP_400_BAD_REQUEST)
+        cursor = request.query_params.get('cursor')
+        if cursor is not None:
+            cursor = search.decode_cursor(cursor)
+            if cursor is None:
+                return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        post_ids, next_cursor = search.search(query, cursor)
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        return Response({'next': next_url, 'results': self.serialize_posts(request, post_ids)})
+
+
+class TrendingPosts(PostsByIdMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    read_serializer_class = PostReadSerializer
+
+    def get(self, request):
+        post_ids = trending.top_posts()
+        return Response({'results': self.serialize_posts(request, post_ids)})
+
+
+class BulkImportView(APIView):
+    parser_classes = [NDJSONParser, JSONLinesParser, ORJSONParser]
+
+    def get_rows(self, request):
+        # a JSON array or one JSON object per line, numbered for the errors
+        if isinstance(request.data, NumberedRows):
+            return request.data
+        if not isinstance(request.data, list):
+            return None
+        return list(enumerate(request.data, 1))
+
+
+class PostBulkCreate(BulkImportView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        rows = self.get_rows(request)
+        if rows is None:
+            return Response({'error': 'Expected a list of posts'}, status=status.HTTP_400_BAD_REQUEST)
+        # staff may import posts of other users
+        owner_id = None if request.user.is_staff else request.user.pk
+        return Response(bulk.import_posts(rows, owner_id=owner_id))
+
+
+class LikeBulkCreate(BulkImportView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        rows = self.get_rows(request)
+        if rows is None:
+            return Response({'error': 'Expected a list of likes'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(bulk.import_likes(rows))
+
+
+class Export(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, dataset):
+        output_format = request.query_params.get('output', 'ndjson')
+        if dataset not in export.DATASETS or output_format not in export.FORMATS:
+            return Response({'error': 'Unknown dataset or output format'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        response = StreamingHttpResponse(export.export(dataset, output_format),
+                                         content_type=export.CONTENT_TYPES[output_format])
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{output_format}"'
+        return response
@@ -0,0 +1,125 @@
+import base64
+from contextlib import contextmanager
+import contextvars
+import json
+from math import inf
+import random
+from time import monotonic
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    connections,
+)
+
+
+# the reads of a request go to one of the DATABASE_REPLICAS unless it writes,
+# runs in a transaction, or comes from a client that wrote in the last
+# DATABASE_STICKY_SECONDS, those read from the primary so they see their writes.
+# the jobs and the commands read from the primary, they read what they wrote
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# cleared by ReplicaRoutingMiddleware for the requests that can read from a replica
+_pinned = contextvars.ContextVar('db_pinned', default=True)
+
+# replica alias: monotonic time until which it's skipped
+_down_until = {}
+
+# connection: monotonic time it was last pinged, the connections are per thread
+_checked_at = weakref.WeakKeyDictionary()
+
+
+@contextmanager
+def reads_from_primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def mark_down(alias):
+    _down_until[alias] = monotonic() + settings.DATABASE_REPLICA_RETRY
+
+
+def healthy_replicas():
+    now = monotonic()
+    return [alias for alias in settings.DATABASE_REPLICAS if _down_until.get(alias, 0) <= now]
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def check_connections():
+    # persistent connections are pinged before a request, at most every
+    # DATABASE_CHECK_INTERVAL seconds each. a broken one is closed so it's
+    # reopened, and a broken replica is skipped for a while
+    now = monotonic()
+    for alias in connections:
+        connection = connections[alias]
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if _checked_at.get(connection, -inf) > now - settings.DATABASE_CHECK_INTERVAL:
+            continue
+        _checked_at[connection] = now
+        if not connection.is_usable():
+            connection.close()
+            if alias in settings.DATABASE_REPLICAS:
+                mark_down(alias)
+
+
+def client_key(request):
+    # the user id of a bearer token, read without checking the signature, a
+    # forged token can only send its own reads to the primary
+    auth = request.META.get('HTTP_AUTHORIZATION', '')
+    if auth.startswith('Bearer '):
+        try:
+            payload = auth[7:].split('.')[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            return f'user:{claims["user_id"]}'
+        except (IndexError, KeyError, TypeError, ValueError):
+            pass
+    return f'ip:{request.META.get("REMOTE_ADDR")}'
+
+
+def sticky_key(request):
+    return f'db_sticky:{client_key(request)}'
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        check_connections()
+        cache = caches[settings.DATABASE_STICKY_CACHE_ALIAS]
+        writes = request.method not in SAFE_METHODS
+        token = _pinned.set(writes or bool(cache.get(sticky_key(request))))
+        try:
+            response = self.get_response(request)
+        finally:
+            _pinned.reset(token)
+        if writes and response.status_code < 400:
+            cache.set(sticky_key(request), True, settings.DATABASE_STICKY_SECONDS)
+        return response
@@ -0,0 +1,260 @@
+from bisect import bisect_left
+from contextlib import (
+    ExitStack,
+    contextmanager,
+)
+import contextvars
+from ipaddress import ip_address
+import threading
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.http import (
+    HttpResponse,
+    HttpResponseForbidden,
+)
+from django.utils.crypto import constant_time_compare
+
+
+# in process metrics in the Prometheus text format, each worker process
+# keeps its own and is scraped on its own
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_labels_text(self.labels, key)} {_number(value)}'
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                cumulative += count
+                labels = _labels_text(self.labels, key, [('le', bound)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_labels_text(self.labels, key)} {_number(total)}'
+            yield f'{self.name}_count{_labels_text(self.labels, key)} {cumulative}'
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Time spent serving a request',
+                            labels=('method', 'route', 'status'))
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'Database queries run by a request',
+                            labels=('method', 'route'), buckets=QUERY_BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_db_duration_seconds',
+                            'Time a request spent in database queries',
+                            labels=('method', 'route'))
+REQUEST_PHASE_TIME = Histogram('http_request_phase_duration_seconds',
+                               'Time a request spent serializing, rendering or calling providers',
+                               labels=('method', 'route', 'phase'))
+OUTBOUND_LATENCY = Histogram('outbound_request_duration_seconds',
+                             'Time spent calling third party providers',
+                             labels=('provider', 'outcome'))
+OUTBOUND_ERRORS = Counter('outbound_request_errors_total',
+                          'Failed calls to third party providers', labels=('provider',))
+
+REGISTRY = [
+    REQUEST_LATENCY,
+    REQUEST_QUERIES,
+    REQUEST_DB_TIME,
+    REQUEST_PHASE_TIME,
+    OUTBOUND_LATENCY,
+    OUTBOUND_ERRORS,
+]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    for metric in REGISTRY:
+        metric.reset()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.durations = {}
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0) + duration
+
+    def record_query(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.add('db', perf_counter() - start)
+
+    def server_timing(self, total):
+        entries = []
+        for name, duration in sorted(self.durations.items()):
+            entry = f'{name};dur={duration * 1000:.1f}'
+            if name == 'db':
+                entry += f';desc="{self.queries} queries"'
+            entries.append(entry)
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+# the timings of the request being served, copied into the tasks it starts
+# so the enrichment calls made on the background loop are counted too
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def timed(name):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, perf_counter() - start)
+
+
+class TimedSerializerMixin:
+    # adds the time spent turning instances into primitives to the request
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+def observe_outbound(provider, duration, outcome):
+    OUTBOUND_LATENCY.observe(duration, provider=provider, outcome=outcome)
+    if outcome != 'ok':
+        OUTBOUND_ERRORS.inc(provider=provider)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(provider, duration)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = perf_counter() - start
+
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        REQUEST_LATENCY.observe(total, method=request.method, route=route,
+                                status=response.status_code)
+        REQUEST_QUERIES.observe(timings.queries, method=request.method, route=route)
+        REQUEST_DB_TIME.observe(timings.durations.get('db', 0), method=request.method, route=route)
+        for phase, duration in timings.durations.items():
+            if phase != 'db':
+                REQUEST_PHASE_TIME.observe(duration, method=request.method, route=route,
+                                           phase=phase)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns
+        timings = _current.get()
+        if timings is not None:
+            start = perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: timings.add('render', perf_counter() - start))
+        return response
+
+
+def is_loopback(address):
+    try:
+        return ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+def metrics_view(request):
+    # the scraper authenticates with METRICS_TOKEN, without one the metrics
+    # are only served to the host itself
+    if settings.METRICS_TOKEN:
+        allowed = constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+                                        f'Bearer {settings.METRICS_TOKEN}')
+    else:
+        allowed = is_loopback(request.META.get('REMOTE_ADDR', ''))
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,73 @@
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import (
+    BaseParser,
+    JSONParser,
+)
+
+from .renderers import (
+    MessagePackRenderer,
+    ORJSONRenderer,
+    msgpack,
+    orjson,
+)
+
+
+def parse_ndjson(lines):
+    # (line number, value) for each line, blank lines are skipped and a line
+    # that isn't valid JSON comes out as None so the caller can report it
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+class NumberedRows(list):
+    # the (line number, value) pairs of an NDJSON body, a JSON array's rows
+    # are numbered by the views
+    pass
+
+
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return NumberedRows(parse_ndjson(codecs.getreader(encoding)(stream)))
+
+
+class JSONLinesParser(NDJSONParser):
+    media_type = 'application/jsonl'
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        # orjson reads UTF-8 only, like the stdlib it refuses NaN and Infinity
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
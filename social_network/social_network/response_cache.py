@@ -0,0 +1,107 @@
+import hashlib
+import json
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import (
+    http_date,
+    parse_http_date_safe,
+)
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import db_routing
+
+
+# a cached representation remembers the versions of the objects it was
+# built from (a post and its owner, say). saving any of them bumps its
+# version, which makes the representation stale without having to know
+# every cache entry it appears in
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def version_key(name, pk):
+    return f'response_version:{name}:{pk}'
+
+
+def bump(name, pk):
+    get_cache().set(version_key(name, pk), time_ns(), None)
+
+
+def invalidate(name, pk, using=None):
+    # bumped right away for reads on this connection, and again on commit
+    # in case another request cached the old rows in between
+    bump(name, pk)
+    transaction.on_commit(lambda: bump(name, pk), using=using)
+
+
+def get_versions(dependencies):
+    cache = get_cache()
+    keys = {version_key(name, pk): (name, pk) for name, pk in dependencies}
+    found = cache.get_many(list(keys))
+    for key in keys.keys() - found.keys():
+        # first time this object is cached, or its version was evicted
+        cache.add(key, time_ns(), None)
+        found[key] = cache.get(key)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def make_etag(data):
+    body = json.dumps(data, sort_keys=True, default=str).encode()
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match == '*'
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(last_modified) <= if_modified_since
+
+
+class CachedRetrieveMixin:
+    cache_name = None
+
+    def cache_dependencies(self, instance):
+        return [(self.cache_name, instance.pk)]
+
+    def shared_data(self, data):
+        return data
+
+    def personalize(self, request, data):
+        return data
+
+    def build_entry(self):
+        # stored under the latest versions for every client, a replica that
+        # lags behind would put the rows from before the change there
+        with db_routing.reads_from_primary():
+            instance = self.get_object()
+            versions = get_versions(self.cache_dependencies(instance))
+            data = self.shared_data(dict(self.get_serializer(instance).data))
+        return {'data': data, 'versions': versions}
+
+    def retrieve(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = f'response:{self.cache_name}:{kwargs[self.lookup_field]}'
+        entry = cache.get(key)
+        if entry is None or get_versions(entry['versions']) != entry['versions']:
+            entry = self.build_entry()
+            cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+
+        data = self.personalize(request, dict(entry['data']))
+        etag = make_etag(data)
+        last_modified = max(entry['versions'].values()) / 1e9
+        if not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Authorization'])
+        return response
@@ -9,6 +9,8 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+from datetime import timedelta
+from importlib.util import find_spec
 import os
 from pathlib import Path
 
@@ -41,9 +43,13 @@ INSTALLED_APPS = [
     'rest_framework',
     'accounts',
     'posts',
+    'jobs',
+    'benchmarks',
 ]
 
 MIDDLEWARE = [
+    'social_network.metrics.MetricsMiddleware',
+    'social_network.db_routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,13 +83,88 @@ WSGI_APPLICATION = 'social_network.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# connections are kept open for this many seconds and pinged before reuse
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+    }
+}
+
+# comma separated SQLite copies of the primary, each becomes a replica<n>
+# alias. other replicas, Postgres ones say, are added to DATABASES and named
+# in DATABASE_REPLICAS
+DATABASE_REPLICAS = []
+
+for n, name in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_FILES', '').split(',')), 1):
+    DATABASES[f'replica{n}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(f'replica{n}')
+
+# comma separated SQLite files the posts and likes are sharded over by
+# owner, each becomes a shard<n> alias, see posts.sharding. after changing
+# the shards ./manage.py rebalance_posts moves the posts to where they belong
+POST_SHARDS = []
+
+for n, name in enumerate(filter(None, os.environ.get('POST_SHARD_FILES', '').split(',')), 1):
+    DATABASES[f'shard{n}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+    }
+    POST_SHARDS.append(f'shard{n}')
+
+# the posts from before the sharding stay on the default database until
+# ./manage.py rebalance_posts moved them, the lists and the rebuilds read it
+# with the shards meanwhile. set to 0 once they're moved, to spare the query
+POST_SHARDS_READ_DEFAULT = os.environ.get('POST_SHARDS_READ_DEFAULT', '1') == '1'
+
+DATABASE_ROUTERS = [
+    'posts.sharding.ShardRouter',
+    'social_network.db_routing.ReplicaRouter',
+]
+
+# a client reads from the primary for this long after it writes
+DATABASE_STICKY_SECONDS = 5
+
+# seen by every web process, the client's next read may go to another one
+DATABASE_STICKY_CACHE_ALIAS = 'shared'
+
+# a replica that failed its health check is skipped for this long
+DATABASE_REPLICA_RETRY = 30
+
+# an open connection is pinged before a request at most this often
+DATABASE_CHECK_INTERVAL = 10
+
+# Caches
+# 'default' is in the memory of each process, 'shared' is seen by all the web
+# processes and the job workers and has to be for what's invalidated or
+# counted across them. a file cache shares it between the processes of a
+# host, with several hosts set SHARED_CACHE_BACKEND and SHARED_CACHE_LOCATION
+# to a Redis or a Memcached one
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+    },
+    'shared': {
+        'BACKEND': os.environ.get('SHARED_CACHE_BACKEND',
+                                  'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('SHARED_CACHE_LOCATION', BASE_DIR / 'cache'),
+    },
 }
 
+# the tests are a single process and keep both caches in its memory
+TEST_RUNNER = 'social_network.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -128,10 +209,198 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# MessagePack is offered to the clients that accept it when msgpack is installed
+HAS_MSGPACK = find_spec('msgpack') is not None
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.SnapshotJWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': [
+        'social_network.renderers.ORJSONRenderer',
+        *(['social_network.renderers.MessagePackRenderer'] if HAS_MSGPACK else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'social_network.parsers.ORJSONParser',
+        *(['social_network.parsers.MessagePackParser'] if HAS_MSGPACK else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # attempts per client IP on the token and signup views
+    'DEFAULT_THROTTLE_RATES': {
+        'login': os.environ.get('LOGIN_RATE', '20/min'),
+        'signup': os.environ.get('SIGNUP_RATE', '10/min'),
+    },
 }
 
+# the throttles count the attempts of an IP across every web process, the
+# cache has to be a shared one or the limits hold per process
+THROTTLE_CACHE_ALIAS = 'shared'
+
 AUTH_USER_MODEL = 'accounts.User'
+
+# Background jobs
+# JOBS_BACKEND is either 'database' (run by ./manage.py run_workers) or
+# 'thread' (run in a thread pool inside the web process)
+
+JOBS_BACKEND = os.environ.get('JOBS_BACKEND', 'database')
+
+JOBS_MAX_ATTEMPTS = 5
+
+JOBS_RETRY_BACKOFF = 2  # seconds, doubled on every attempt
+
+JOBS_POLL_INTERVAL = 1
+
+JOBS_LOCK_TIMEOUT = timedelta(minutes=10)
+
+JOBS_THREADS = 4
+
+# Third party enrichment lookups cache
+# ENRICHMENT_CACHE_BACKEND is either 'memory' (an LRU per process) or
+# 'django' (the ENRICHMENT_CACHE_ALIAS cache, shared between the workers)
+
+ENRICHMENT_CACHE_BACKEND = os.environ.get('ENRICHMENT_CACHE_BACKEND', 'memory')
+
+ENRICHMENT_CACHE_ALIAS = 'default'
+
+ENRICHMENT_CACHE_SIZE = 10000
+
+ENRICHMENT_CACHE_TTLS = {  # seconds
+    'email': 24 * 60 * 60,
+    'email_domain': 24 * 60 * 60,
+    'geo': 24 * 60 * 60,
+    'holiday': 24 * 60 * 60,
+}
+
+# IP geo location
+# GEO_RESOLVER is either 'api' (abstractapi) or 'local' (the GEOIP_DATABASE
+# file, built with ./manage.py build_geoip_db)
+
+GEO_RESOLVER = os.environ.get('GEO_RESOLVER', 'api')
+
+GEOIP_DATABASE = os.environ.get('GEOIP_DATABASE', BASE_DIR / 'geoip.bin')
+
+# Holidays
+# HOLIDAY_RESOLVER is either 'api' (abstractapi) or 'local' (the HOLIDAYS_INDEX
+# file, built with ./manage.py load_holidays and loaded on startup)
+
+HOLIDAY_RESOLVER = os.environ.get('HOLIDAY_RESOLVER', 'api')
+
+HOLIDAYS_INDEX = os.environ.get('HOLIDAYS_INDEX', BASE_DIR / 'holidays.bin')
+
+# Enrichment providers resilience
+
+ENRICHMENT_RETRIES = 3
+
+ENRICHMENT_RETRY_BASE_DELAY = 0.1  # seconds, doubled on every attempt, with jitter
+
+ENRICHMENT_RETRY_MAX_DELAY = 1
+
+ENRICHMENT_BREAKER_THRESHOLD = 5  # consecutive failures before failing fast
+
+ENRICHMENT_BREAKER_RESET = 30  # seconds before a probe is let through
+
+ENRICHMENT_DEADLINE = 3  # seconds for all the lookups of one signup
+
+# Local email validation
+# EMAIL_MX_RESOLVER is a dotted path to a callable answering if a domain has
+# MX records (True, False or None when unknown), e.g.
+# 'accounts.email_validation.StaticMXResolver' reading EMAIL_MX_RECORDS
+
+EMAIL_MX_RESOLVER = os.environ.get('EMAIL_MX_RESOLVER')
+
+EMAIL_MX_RECORDS = os.environ.get('EMAIL_MX_RECORDS', BASE_DIR / 'mx_records.txt')
+
+EMAIL_DISPOSABLE_DOMAINS_FILE = os.environ.get('EMAIL_DISPOSABLE_DOMAINS_FILE')
+
+# Home feed
+
+FEED_CELEBRITY_THRESHOLD = 10000  # followers, above it posts are merged on read
+
+FEED_TIMELINE_LENGTH = 800  # entries kept per timeline by ./manage.py trim_timelines
+
+FEED_PAGE_SIZE = 20
+
+# Response cache of the post and user data endpoints, shared so that an edit
+# invalidates the bodies every process serves
+
+RESPONSE_CACHE_ALIAS = 'shared'
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60  # seconds
+
+# Bulk imports
+
+BULK_CHUNK_SIZE = 1000  # rows validated and inserted together
+
+# Post search
+
+SEARCH_PAGE_SIZE = 20
+
+SEARCH_MAX_TERMS = 8  # a query's terms past these are ignored
+
+# Trending posts
+
+TRENDING_HALF_LIFE = 6 * 60 * 60  # seconds for a like to lose half its weight
+
+TRENDING_WINDOW = timedelta(days=3)  # older likes are dropped by ./manage.py refresh_trending
+
+TRENDING_SIZE = 100
+
+TRENDING_CACHE_TIMEOUT = 60
+
+# Likes
+# with LIKE_WRITE_BEHIND the like and unlike views only record the intent and
+# the intents are written in batches, see posts.like_buffer. they're kept in
+# the LIKE_BUFFER_FILE SQLite file, shared by the web processes of a host and
+# written by ./manage.py flush_likes. set empty they're kept in memory and
+# written by a thread every LIKE_FLUSH_INTERVAL seconds (0 for never), which
+# is only right with a single web process, the workers don't see each other's
+
+LIKE_WRITE_BEHIND = os.environ.get('LIKE_WRITE_BEHIND', '') == '1'
+
+LIKE_BUFFER_FILE = os.environ.get('LIKE_BUFFER_FILE', BASE_DIR / 'likes.sqlite3')
+
+LIKE_FLUSH_INTERVAL = 1
+
+LIKE_FLUSH_BATCH = 1000  # intents written together
+
+# Metrics, scraped from /metrics
+
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '') == '1'  # adds Server-Timing headers
+
+# bearer token the scraper sends, without one only the host itself is served.
+# behind a proxy on the same host every request comes from there, set one
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Users loaded by the authentication, for tokens without a user snapshot and
+# on token refresh
+
+AUTH_USER_CACHE_ALIAS = 'default'
+
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Password hashing
+# PASSWORD_HASHER hashes new passwords, the passwords of the other hashers
+# are rehashed with it on the next login
+
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'accounts.hashers.ScryptPasswordHasher')
+
+PASSWORD_HASHERS = [PASSWORD_HASHER] + [hasher for hasher in [
+    'accounts.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',  # needs argon2-cffi
+] if hasher != PASSWORD_HASHER]
+
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+
+PASSWORD_SCRYPT_R = 8
+
+PASSWORD_SCRYPT_P = 1
+
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+
+# Exports
+
+EXPORT_CHUNK_SIZE = 2000  # rows fetched per query
@@ -16,30 +16,47 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
-
 from accounts.views import (
     Account,
+    FollowUpdate,
+    TokenObtainPair,
+    TokenRefresh,
+    UnFollowUpdate,
     UserData,
 )
 from posts.views import (
+    Export,
+    HomeFeed,
+    LikeBulkCreate,
+    PostBulkCreate,
     PostList,
     PostDetail,
+    PostLikes,
+    PostSearch,
+    TrendingPosts,
     LikeUpdate,
     UnLikeUpdate,
 )
+from social_network.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/signup/', Account.as_view()),
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/', TokenObtainPair.as_view(), name='token_obtain_pair'),
+    path('api/token/refresh/', TokenRefresh.as_view(), name='token_refresh'),
     path('api/posts/', PostList.as_view(), name='posts'),
+    path('api/posts/search/', PostSearch.as_view(), name='post_search'),
+    path('api/posts/trending/', TrendingPosts.as_view(), name='trending'),
+    path('api/posts/bulk/', PostBulkCreate.as_view(), name='posts_bulk'),
+    path('api/posts/likes/bulk/', LikeBulkCreate.as_view(), name='likes_bulk'),
     path('api/user_data/<int:pk>/', UserData.as_view(), name='user_data'),
+    path('api/user_data/<int:pk>/follow/', FollowUpdate.as_view(), name='follow'),
+    path('api/user_data/<int:pk>/unfollow/', UnFollowUpdate.as_view(), name='unfollow'),
+    path('api/export/<str:dataset>/', Export.as_view(), name='export'),
+    path('api/feed/', HomeFeed.as_view(), name='feed'),
     path('api/posts/<int:pk>/', PostDetail.as_view(), name='post'),
+    path('api/posts/<int:pk>/likes/', PostLikes.as_view(), name='post_likes'),
     path('api/posts/<int:pk>/like/', LikeUpdate.as_view(), name='like'),
     path('api/posts/<int:pk>/unlike/', UnLikeUpdate.as_view(), name='unlike'),
 ]